@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class RestaurantConfig(AppConfig):
+    name = 'restaurant'
+
+    def ready(self):
+        from .utils import db_router # registers the replica cache check
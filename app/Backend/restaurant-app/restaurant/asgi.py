@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Run with an ASGI server, e.g. `uvicorn restaurant.asgi:application`, the async views
+(signup, login, change_password) then run on the event loop without a thread per request.
+The waiter order feed (/waiter/orders/feed/, Server-Sent Events) needs it: every connected tablet
+is a coroutine waiting for events instead of a worker thread.
 """
 
 import os
@@ -0,0 +1,131 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+from restaurant.user.models import User, LoginHistory, KnownDevice
+from restaurant.user.devices import user_agent_hash
+from restaurant.product.models import Product, ProductVariant, Image
+from restaurant.product.search import reindex_variants, rebuild_index
+from restaurant.product.cache import invalidate_menu
+from restaurant.order.models import Cart, Order, OrderItem
+
+'''
+    The benchmark dataset, seeded next to whatever is already in the database and removed with flush().
+    Every row hangs off a bench user (email @bench.invalid) or a bench product (name "Bench ..."), so flush()
+    deletes exactly those and cascades.
+
+    Defaults: 500 products x 10 variants with images, 200 users with 500 logins each (and a few known devices),
+    20000 orders of 1 to 4 items spread over the last 90 days. Same seed, same data.
+'''
+
+EMAIL_DOMAIN = 'bench.invalid'
+PRODUCT_PREFIX = 'Bench '
+PASSWORD = 'bench-password'
+USER_AGENT = 'restaurant-bench/1.0' # what the load generator sends, a known device of every bench user
+BATCH_SIZE = 1000
+
+DISHES = ['Lasagna', 'Pizza', 'Risotto', 'Ramen', 'Burger', 'Taco', 'Curry', 'Salad', 'Gnocchi', 'Paella', 'Pho', 'Burrito']
+STYLES = ['classic', 'spicy', 'vegan', 'large', 'small', 'extra cheese', 'truffle', 'smoked', 'family size', 'gluten free']
+AGENTS = ['Mozilla/5.0 (iPhone)', 'Mozilla/5.0 (Windows NT 10.0)', 'Mozilla/5.0 (Macintosh)', 'okhttp/4.9', USER_AGENT]
+
+
+def counts():
+    return {
+        'products': Product.objects.filter(name__startswith=PRODUCT_PREFIX).count(),
+        'variants': ProductVariant.objects.filter(product__name__startswith=PRODUCT_PREFIX).count(),
+        'users': User.objects.filter(email__endswith='@' + EMAIL_DOMAIN).count(),
+        'logins': LoginHistory.objects.filter(user__email__endswith='@' + EMAIL_DOMAIN).count(),
+        'orders': Order.objects.filter(user__email__endswith='@' + EMAIL_DOMAIN).count(),
+    }
+
+
+def seed(products=500, variants_per_product=10, users=200, logins_per_user=500, orders=20000, seed=1, log=print):
+    rng = random.Random(seed)
+    now = timezone.now()
+    with transaction.atomic():
+        first = Product.objects.filter(name__startswith=PRODUCT_PREFIX).count()
+        created = Product.objects.bulk_create([
+            Product(name=f'{PRODUCT_PREFIX}{DISHES[i % len(DISHES)]} {i}') for i in range(first, first + products)
+        ], batch_size=BATCH_SIZE)
+        variants = ProductVariant.objects.bulk_create([
+            ProductVariant(
+                product=product,
+                name=f'{product.name.split()[1]} {STYLES[v % len(STYLES)]}',
+                price=Decimal(rng.randint(450, 4500)) / 100,
+                stock=rng.randint(1000, 100000), # checkouts during a run shouldn't sell anything out
+                description=f'{STYLES[v % len(STYLES)]} {product.name.split()[1].lower()} with {rng.choice(STYLES)} sides',
+                is_active=rng.random() > 0.05,
+            )
+            for product in created for v in range(variants_per_product)
+        ], batch_size=BATCH_SIZE)
+        Image.objects.bulk_create([
+            Image(product_variant=variant, url=f'https://img.example.com/{variant.id}/{n}.jpg', alt_text=variant.name)
+            for variant in variants for n in range(rng.randint(0, 3))
+        ], batch_size=BATCH_SIZE)
+        reindex_variants([variant.id for variant in variants])
+        log(f'{len(created)} products, {len(variants)} variants')
+
+        password_hash = make_password(PASSWORD) # one hash for everyone, hashing 200 passwords would take minutes
+        first = User.objects.filter(email__endswith='@' + EMAIL_DOMAIN).count()
+        people = User.objects.bulk_create([
+            User(first_name=f'Bench{i}', email=f'user{i}@{EMAIL_DOMAIN}', password_hash=password_hash)
+            for i in range(first, first + users)
+        ], batch_size=BATCH_SIZE)
+        devices = []
+        for user in people:
+            agents = rng.sample(AGENTS[:-1], 2) + [USER_AGENT]
+            devices += [KnownDevice(user=user, ip='127.0.0.1', user_agent_hash=user_agent_hash(agent)) for agent in agents]
+        KnownDevice.objects.bulk_create(devices, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        logins = (
+            LoginHistory(user=user, login_ip='127.0.0.1', user_agent=rng.choice(AGENTS), login_time=now - timedelta(minutes=rng.randint(1, 180 * 24 * 60)))
+            for user in people for _ in range(logins_per_user)
+        )
+        LoginHistory.objects.bulk_create(logins, batch_size=BATCH_SIZE)
+        log(f'{len(people)} users, {len(people) * logins_per_user} logins')
+
+        active = [variant for variant in variants if variant.is_active]
+        for start in range(0, orders, BATCH_SIZE):
+            size = min(BATCH_SIZE, orders - start)
+            buyers = [rng.choice(people) for _ in range(size)]
+            carts = Cart.objects.bulk_create([Cart(user=user) for user in buyers])
+            lines = [rng.sample(active, rng.randint(1, 4)) for _ in range(size)]
+            quantities = [[rng.randint(1, 3) for _ in picked] for picked in lines]
+            moments = [now - timedelta(minutes=rng.randint(1, 90 * 24 * 60)) for _ in range(size)]
+            placed = Order.objects.bulk_create([
+                Order(
+                    user=user, cart=cart,
+                    total_amount=sum((variant.price * quantity for variant, quantity in zip(picked, amounts)), Decimal('0.00')),
+                    status=rng.choices(['completed', 'pending', 'cancelled'], [85, 10, 5])[0],
+                    time_to_eat=moment,
+                )
+                for user, cart, picked, amounts, moment in zip(buyers, carts, lines, quantities, moments)
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_variant=variant, quantity=quantity, unit_price=variant.price)
+                for order, picked, amounts in zip(placed, lines, quantities) for variant, quantity in zip(picked, amounts)
+            ], batch_size=BATCH_SIZE)
+            backdate(placed, moments)
+        log(f'{orders} orders')
+        invalidate_menu()
+    return counts()
+
+
+def backdate(orders, moments):
+    # created_at is auto_now_add, the orders are spread over the past afterwards with one executemany UPDATE
+    field = Order._meta.get_field('created_at')
+    sql = 'UPDATE %s SET %s = %%s WHERE %s = %%s' % (
+        connection.ops.quote_name(Order._meta.db_table), connection.ops.quote_name(field.column), connection.ops.quote_name(Order._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [[field.get_db_prep_save(moment, connection), order.pk] for order, moment in zip(orders, moments)])
+
+
+def flush():
+    with transaction.atomic():
+        users = User.objects.filter(email__endswith='@' + EMAIL_DOMAIN).delete()[0]
+        products = Product.objects.filter(name__startswith=PRODUCT_PREFIX).delete()[0]
+        rebuild_index()
+        invalidate_menu()
+    return users + products
@@ -0,0 +1,370 @@
+import http.client
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlsplit
+import django
+from django.conf import settings
+from django.db import connection, close_old_connections
+from django.test import Client
+from django.utils import timezone
+from restaurant.user.models import User
+from restaurant.product.models import ProductVariant
+from restaurant.order.models import Cart, CartItem
+from restaurant.utils.jwt_utils import create_access_token
+from restaurant.user.tokens import issue_refresh_token
+from . import dataset
+
+'''
+    Load generator for the main endpoints, against the bench dataset (dataset.py).
+
+    A scenario builds one request at a time (method, path, body, token), the runner sends it with
+    --concurrency worker threads through a transport:
+        - InProcessTransport: django.test.Client, the full middleware stack without a socket or server
+        - HttpTransport: a keep-alive http.client connection per worker to a running server (runserver, gunicorn, uvicorn...).
+          runserver writes the headers and the body of a response separately without TCP_NODELAY, on a reused connection
+          Nagle + delayed ACK add ~40ms to every response, so against runserver it opens a connection per request.
+    and keeps the latency of every request. Warmup requests are sent first and not counted.
+
+    Results are a JSON document: meta (commit, mode, concurrency, database, dataset) and per scenario
+    requests, errors, status codes, throughput (requests/s) and latency mean/p50/p95/p99/max in ms.
+    compare() puts two of them side by side.
+'''
+
+SCENARIOS = {} # name -> function(context, rng) -> Call
+
+
+class Call:
+    def __init__(self, method, path, body=None, token=None, expect=(200,)):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.token = token
+        self.expect = expect
+
+
+def scenario(name):
+    def register(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return register
+
+
+class Context:
+    # what the scenarios pick from, loaded once before the run
+    def __init__(self):
+        variants = list(
+            ProductVariant.objects.filter(product__name__startswith=dataset.PRODUCT_PREFIX, is_active=True)
+            .values_list('id', 'product_id', 'price')
+        )
+        users = list(User.objects.filter(email__endswith='@' + dataset.EMAIL_DOMAIN).values_list('id', 'email'))
+        if not variants or not users:
+            raise ValueError('No bench data, run `python manage.py seed_bench_data` first')
+        self.variant_ids = [variant_id for variant_id, _, _ in variants]
+        self.product_ids = sorted({product_id for _, product_id, _ in variants})
+        self.users = users
+        self.access_tokens = {user_id: create_access_token(user_id, email) for user_id, email in users}
+        self.nonce = 0
+        self.lock = threading.Lock()
+
+    def next_nonce(self):
+        with self.lock:
+            self.nonce += 1
+            return self.nonce
+
+
+# --- scenarios ---
+
+PRODUCT_FILTERS = [
+    lambda c, rng: f'?page={rng.randint(1, 20)}&limit=20',
+    lambda c, rng: '?cursor=&limit=20',
+    lambda c, rng: '?cursor=&limit=50&include_total=true',
+    lambda c, rng: f'?min_price={rng.randint(5, 20)}&max_price={rng.randint(21, 45)}&limit=20',
+    lambda c, rng: f'?product_id={rng.choice(c.product_ids)}',
+    lambda c, rng: f'?variant_name={rng.choice(dataset.DISHES).lower()[:4]}&limit=20',
+    lambda c, rng: f'?variant_name={rng.choice(dataset.STYLES).split()[0]}&order=relevance&limit=20',
+    lambda c, rng: f'?limit=20&order=desc',
+]
+
+
+@scenario('products')
+def products(context, rng):
+    # the menu as deployed, repeated filter sets are served by the menu cache
+    return Call('GET', '/products/' + rng.choice(PRODUCT_FILTERS)(context, rng))
+
+
+@scenario('products_uncached')
+def products_uncached(context, rng):
+    # same mix with a parameter that is never repeated, every request misses the menu cache
+    return Call('GET', '/products/' + rng.choice(PRODUCT_FILTERS)(context, rng) + f'&bench={context.next_nonce()}')
+
+
+@scenario('variant_detail')
+def variant_detail(context, rng):
+    return Call('GET', f'/products/{rng.choice(context.variant_ids)}/')
+
+
+@scenario('login')
+def login(context, rng):
+    _, email = rng.choice(context.users)
+    return Call('POST', '/user/login/', {'email': email, 'password': dataset.PASSWORD})
+
+
+@scenario('refresh_access_token')
+def refresh_access_token(context, rng):
+    # refresh tokens are single use (rotation), a fresh one from the store per request (not timed)
+    user_id, email = rng.choice(context.users)
+    return Call('POST', '/user/refresh-token/', {'refresh_token': issue_refresh_token(user_id, email)})
+
+
+@scenario('login_history')
+def login_history(context, rng):
+    user_id, _ = rng.choice(context.users)
+    return Call('GET', '/user/login-history/?limit=50', token=context.access_tokens[user_id])
+
+
+@scenario('checkout')
+def checkout(context, rng):
+    # a fresh cart of 1 to 4 lines per checkout, filled before the request (not timed)
+    user_id, _ = rng.choice(context.users)
+    cart = Cart.objects.create(user_id=user_id)
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product_variant_id=variant_id, quantity=rng.randint(1, 3))
+        for variant_id in rng.sample(context.variant_ids, rng.randint(1, 4))
+    ])
+    return Call('POST', '/orders/checkout/', {'cart_id': cart.id}, token=context.access_tokens[user_id], expect=(201,))
+
+
+# --- transports ---
+
+class InProcessTransport:
+    name = 'inprocess'
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=False, HTTP_USER_AGENT=dataset.USER_AGENT, REMOTE_ADDR='127.0.0.1')
+
+    def send(self, call):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {call.token}'} if call.token else {}
+        body = json.dumps(call.body) if call.body is not None else ''
+        response = self.client.generic(call.method, call.path, body, content_type='application/json', **headers)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    name = 'http'
+
+    def __init__(self, url, keepalive=True):
+        parts = urlsplit(url)
+        self.keepalive = keepalive
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.connection = None
+
+    def send(self, call):
+        headers = {'User-Agent': dataset.USER_AGENT, 'Content-Type': 'application/json'}
+        if call.token:
+            headers['Authorization'] = f'Bearer {call.token}'
+        body = json.dumps(call.body).encode() if call.body is not None else None
+        for attempt in range(2): # the server may have closed the idle keep-alive connection
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request(call.method, self.prefix + call.path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                if not self.keepalive or response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# --- running ---
+
+def percentiles(samples):
+    if not samples:
+        return {'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+    return {
+        'mean': round(sum(samples) / len(samples), 3),
+        'p50': round(pick(50), 3), 'p95': round(pick(95), 3), 'p99': round(pick(99), 3), 'max': round(samples[-1], 3),
+    }
+
+
+def run_scenario(name, context, make_transport, requests=200, concurrency=4, warmup=20, seed=1):
+    build = SCENARIOS[name]
+    latencies = []
+    statuses = Counter()
+    errors = []
+    window = [None, None] # first counted request sent, last one answered
+    remaining = [warmup + requests]
+    lock = threading.Lock()
+
+    def take():
+        with lock:
+            if remaining[0] <= 0:
+                return None
+            remaining[0] -= 1
+            return remaining[0] < requests # False while warming up
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        transport = make_transport()
+        try:
+            while True:
+                counted = take()
+                if counted is None:
+                    return
+                call = build(context, rng)
+                start = time.perf_counter()
+                try:
+                    status = transport.send(call)
+                except Exception as e:
+                    status = type(e).__name__
+                end = time.perf_counter()
+                if not counted:
+                    continue
+                with lock:
+                    window[0] = start if window[0] is None else min(window[0], start)
+                    window[1] = end if window[1] is None else max(window[1], end)
+                    latencies.append((end - start) * 1000)
+                    statuses[str(status)] += 1
+                    if status not in call.expect:
+                        errors.append(status)
+        finally:
+            transport.close()
+            close_old_connections()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    seconds = window[1] - window[0] if latencies else 0
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'statuses': dict(statuses),
+        'throughput': round(len(latencies) / seconds, 2) if seconds else None,
+        'seconds': round(seconds, 3),
+        'latency_ms': percentiles(latencies),
+    }
+
+
+def run(scenarios, mode='inprocess', url=None, requests=200, concurrency=4, warmup=20, seed=1, keepalive=True, log=print):
+    context = Context()
+    if mode == 'http':
+        make_transport = lambda: HttpTransport(url, keepalive)
+    else:
+        make_transport = InProcessTransport
+    results = {'meta': meta(mode, url, requests, concurrency, warmup, seed, keepalive), 'scenarios': {}}
+    for name in scenarios:
+        results['scenarios'][name] = stats = run_scenario(name, context, make_transport, requests, concurrency, warmup, seed)
+        log(format_stats(name, stats))
+    return results
+
+
+def meta(mode, url, requests, concurrency, warmup, seed, keepalive):
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'created_at': timezone.now().isoformat(),
+        'mode': mode,
+        'url': url,
+        'keepalive': keepalive if mode == 'http' else None,
+        'requests': requests,
+        'concurrency': concurrency,
+        'warmup': warmup,
+        'seed': seed,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'dataset': dataset.counts(),
+    }
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def format_stats(name, stats):
+    latency = stats['latency_ms']
+    if not stats['requests']:
+        return f'{name:22} no requests'
+    return (
+        f"{name:22} {stats['throughput']:9.1f} req/s  p50 {latency['p50']:8.2f}ms  p95 {latency['p95']:8.2f}ms  "
+        f"p99 {latency['p99']:8.2f}ms  errors {stats['errors']}/{stats['requests']}"
+    )
+
+
+def save(results, path=None):
+    if path is None:
+        folder = Path(getattr(settings, 'BENCH_RESULTS_DIR', Path(settings.BASE_DIR) / 'var' / 'bench'))
+        commit = (results['meta']['commit'] or 'nocommit')[:10]
+        path = folder / f"{timezone.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json"
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2))
+    return path
+
+
+def load(path):
+    return json.loads(Path(path).read_text())
+
+
+def compare(base, head, threshold=10.0):
+    # returns [(scenario, metric, base value, head value, change %, regression)], latency up or throughput down by
+    # more than threshold % is a regression
+    rows = []
+    for name in base['scenarios']:
+        if name not in head['scenarios']:
+            continue
+        old, new = base['scenarios'][name], head['scenarios'][name]
+        for metric in ('throughput', 'p50', 'p95', 'p99'):
+            before = old['throughput'] if metric == 'throughput' else old['latency_ms'][metric]
+            after = new['throughput'] if metric == 'throughput' else new['latency_ms'][metric]
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if metric == 'throughput' else change
+            rows.append((name, metric, before, after, round(change, 1), worse > threshold))
+    return rows
+
+
+def wait_for_server(url, timeout=30):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            probe = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=2)
+            probe.request('GET', '/products/?limit=1')
+            probe.getresponse().read()
+            probe.close()
+            return True
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    return False
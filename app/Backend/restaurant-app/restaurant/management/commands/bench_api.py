@@ -0,0 +1,79 @@
+import socket
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from restaurant.benchmark import runner
+
+'''
+    Load test of the main endpoints against the bench dataset (seed it first with `python manage.py seed_bench_data`).
+    usage:
+        python manage.py bench_api                                                # every scenario, in process
+        python manage.py bench_api --scenarios products,checkout --requests 1000 --concurrency 8
+        python manage.py bench_api --mode http --url http://127.0.0.1:8000       # a server that is already running
+        python manage.py bench_api --mode http --serve                            # starts runserver on a free port for the run
+        python manage.py bench_api --output var/bench/before.json
+
+    Results are saved as JSON (default var/bench/<time>-<commit>.json), compare two runs with `python manage.py bench_compare`.
+    Checkouts and logins write rows (orders, login history) that stay, `seed_bench_data --flush` removes them with the rest.
+'''
+
+class Command(BaseCommand):
+    help = 'Benchmark the API: throughput and p50/p95/p99 latency per scenario'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(runner.SCENARIOS), help='comma separated, default: all')
+        parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+        parser.add_argument('--url', help='base URL of the server, with --mode http')
+        parser.add_argument('--serve', action='store_true', help='start runserver for the run, with --mode http')
+        parser.add_argument('--no-keepalive', action='store_true', help='a new connection per request (implied by --serve)')
+        parser.add_argument('--requests', type=int, default=200, help='counted requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='where to save the JSON results')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = [name for name in scenarios if name not in runner.SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(runner.SCENARIOS)})")
+
+        server = None
+        url = options['url']
+        if options['mode'] == 'http':
+            if options['serve']:
+                server, url = self.start_server()
+            elif not url:
+                raise CommandError('--mode http needs --url or --serve')
+
+        try:
+            results = runner.run(
+                scenarios, mode=options['mode'], url=url, requests=options['requests'], concurrency=options['concurrency'],
+                warmup=options['warmup'], seed=options['seed'], keepalive=not (options['no_keepalive'] or options['serve']),
+                log=self.stdout.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=10)
+
+        path = runner.save(results, options['output'])
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {path}'))
+
+    def start_server(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(
+            [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload'],
+            cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        if not runner.wait_for_server(url):
+            server.terminate()
+            raise CommandError(f'runserver did not come up on {url}')
+        self.stdout.write(f'runserver on {url}')
+        return server, url
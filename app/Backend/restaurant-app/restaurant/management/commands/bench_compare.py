@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from restaurant.benchmark import runner
+
+'''
+    Compares two bench_api results, e.g. the commit before a change and after it.
+    usage:
+        python manage.py bench_compare var/bench/before.json var/bench/after.json
+        python manage.py bench_compare before.json after.json --threshold 5 --fail-on-regression   # exit code 1 on a regression (CI)
+'''
+
+class Command(BaseCommand):
+    help = 'Compare two benchmark results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base')
+        parser.add_argument('head')
+        parser.add_argument('--threshold', type=float, default=10.0, help='percent, latency up or throughput down by more is a regression')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            base, head = runner.load(options['base']), runner.load(options['head'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        describe = lambda results: f"{(results['meta'].get('commit') or '?')[:10]}{' (dirty)' if results['meta'].get('dirty') else ''}"
+        self.stdout.write(f"base {describe(base)}  head {describe(head)}")
+        if base['meta'].get('mode') != head['meta'].get('mode') or base['meta'].get('concurrency') != head['meta'].get('concurrency'):
+            self.stdout.write(self.style.WARNING('the runs used a different mode or concurrency'))
+
+        rows = runner.compare(base, head, options['threshold'])
+        for name, metric, before, after, change, regression in rows:
+            line = f'{name:22} {metric:10} {before:10.2f} -> {after:10.2f}  {change:+7.1f}%'
+            self.stdout.write(self.style.ERROR(line + '  REGRESSION') if regression else line)
+
+        regressions = sum(1 for row in rows if row[-1])
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{regressions} regressions over {options["threshold"]}%')
+        self.stdout.write(self.style.SUCCESS(f'{regressions} regressions'))
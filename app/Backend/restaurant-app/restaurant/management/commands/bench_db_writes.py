@@ -0,0 +1,159 @@
+import json
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, OperationalError
+from restaurant.utils.db_profiles import load_databases
+from restaurant.benchmark.runner import percentiles
+
+'''
+    Concurrent write throughput of the database profiles (config/database, see restaurant/utils/db_profiles.py).
+    usage:
+        python manage.py bench_db_writes                                          # sqlite-default vs sqlite
+        python manage.py bench_db_writes --profiles sqlite,postgres --writers 16 --seconds 10
+        python manage.py bench_db_writes --readers 4 --output var/bench/db-writes.json
+
+    Every writer runs short transactions like a request does: insert a row + bump one of a few hot counters (the
+    stock/rollup kind of UPDATE), then ends the "request" the way Django does (close_if_unusable_or_obsolete), so
+    CONN_MAX_AGE=0 reconnects every time, persistent connections and pools don't. Readers count rows meanwhile.
+    Reports committed transactions/s, failed ones (database is locked...) and the transaction latency.
+
+    The tables (bench_db_writes, bench_db_counters) are created and dropped by the run. SQLite profiles run on a
+    throwaway file each (journal_mode=WAL sticks to a file), Postgres ones on the configured database.
+'''
+
+HOT_ROWS = 8
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent writes for each database profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='sqlite-default,sqlite')
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--output', help='save the results as JSON')
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in [name.strip() for name in options['profiles'].split(',') if name.strip()]:
+            alias = f'bench_{profile}'
+            with tempfile.TemporaryDirectory() as folder:
+                database = load_databases(profile, settings.DATABASE_PROFILE_DIR, settings.BASE_DIR)['default']
+                if database['ENGINE'].endswith('sqlite3'):
+                    database['NAME'] = Path(folder) / 'bench.sqlite3'
+                connections.settings[alias] = connections.configure_settings({'default': database})['default']
+                try:
+                    results[profile] = self.run(alias, options)
+                except Exception as e:
+                    raise CommandError(f'{profile}: {e}')
+                finally:
+                    connections[alias].close()
+                    if hasattr(connections[alias], 'close_pool'):
+                        connections[alias].close_pool()
+                    del connections.settings[alias]
+            self.report(profile, results[profile])
+
+        if options['output']:
+            path = Path(options['output'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Results saved to {path}'))
+
+    def run(self, alias, options):
+        self.create_tables(alias)
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies = []
+        failures = []
+        reads = [0]
+
+        def writer(number):
+            connection = connections[alias]
+            seq = 0
+            try:
+                while not stop.is_set():
+                    seq += 1
+                    start = time.perf_counter()
+                    try:
+                        with transaction.atomic(using=alias), connection.cursor() as cursor:
+                            cursor.execute('INSERT INTO bench_db_writes (worker, seq, payload) VALUES (%s, %s, %s)', [number, seq, 'x' * 100])
+                            cursor.execute('UPDATE bench_db_counters SET value = value + 1 WHERE id = %s', [seq % HOT_ROWS])
+                    except OperationalError as e:
+                        with lock:
+                            failures.append(str(e))
+                    else:
+                        with lock:
+                            latencies.append((time.perf_counter() - start) * 1000)
+                    connection.close_if_unusable_or_obsolete() # end of the request
+            finally:
+                connection.close()
+
+        def reader():
+            connection = connections[alias]
+            try:
+                while not stop.is_set():
+                    try:
+                        with connection.cursor() as cursor:
+                            cursor.execute('SELECT COUNT(*), SUM(value) FROM bench_db_counters')
+                            cursor.fetchone()
+                        with lock:
+                            reads[0] += 1
+                    except OperationalError as e:
+                        with lock:
+                            failures.append(str(e))
+                    connection.close_if_unusable_or_obsolete()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        threads += [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.drop_tables(alias)
+        connection = connections[alias]
+        return {
+            'vendor': connection.vendor,
+            'writers': options['writers'],
+            'readers': options['readers'],
+            'seconds': round(elapsed, 3),
+            'commits': len(latencies),
+            'commits_per_second': round(len(latencies) / elapsed, 1),
+            'failures': len(failures),
+            'failure_examples': sorted(set(failures))[:3],
+            'reads_per_second': round(reads[0] / elapsed, 1),
+            'latency_ms': percentiles(latencies),
+        }
+
+    def create_tables(self, alias):
+        self.drop_tables(alias)
+        with connections[alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE bench_db_writes (worker INTEGER NOT NULL, seq INTEGER NOT NULL, payload VARCHAR(200) NOT NULL)')
+            cursor.execute('CREATE TABLE bench_db_counters (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            for row in range(HOT_ROWS):
+                cursor.execute('INSERT INTO bench_db_counters (id, value) VALUES (%s, 0)', [row])
+
+    def drop_tables(self, alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS bench_db_writes')
+            cursor.execute('DROP TABLE IF EXISTS bench_db_counters')
+
+    def report(self, profile, stats):
+        latency = stats['latency_ms']
+        self.stdout.write(
+            f"{profile:22} {stats['commits_per_second']:9.1f} commits/s  {stats['reads_per_second']:9.1f} reads/s  "
+            f"failed {stats['failures']:5}  p50 {latency['p50'] or 0:8.2f}ms  p95 {latency['p95'] or 0:8.2f}ms  p99 {latency['p99'] or 0:8.2f}ms"
+        )
+        for example in stats['failure_examples']:
+            self.stdout.write(self.style.WARNING(f'    {example}'))
@@ -0,0 +1,181 @@
+import re
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from restaurant.order.models import Cart, Order, SalesRollup, SalesTotalRollup, StockReservation
+from restaurant.order.views import in_range
+from restaurant.product.queries import fetch_variant, images_for
+from restaurant.product.views import build_products_page
+from restaurant.table.services import free_tables
+from restaurant.user.models import AuditLog, KnownDevice, LoginHistory, Token
+from restaurant.user.tokens import delete_expired
+from restaurant.utils.cursor import encode_cursor
+
+'''
+    EXPLAIN of every query of the hot paths, fails (exit code 1) when one of them reads a whole table instead of an index.
+    usage:
+        python manage.py explain_queries                 # every path, one line per query with the indexes it uses
+        python manage.py explain_queries --plans         # the whole plans
+        python manage.py explain_queries --path menu     # only the paths whose name contains "menu"
+
+    The paths run the real code (build_products_page, fetch_variant, free_tables...) or the same querysets as the views,
+    inside a transaction that is rolled back, the SQL they send is captured and explained.
+    The check is whether an index can serve the query, not whether the planner picks it for today's data (counting the
+    active variants when all of them are active is rightly a scan), so the statistics are left out:
+        SQLite: EXPLAIN QUERY PLAN without sqlite_stat1 (hidden in a transaction that is rolled back), a "SCAN <table>"
+                without an index is a full scan
+        Postgres: EXPLAIN with enable_seqscan off, a "Seq Scan" is a full scan
+    SMALL_TABLES may be scanned, they never grow past a few dozen rows.
+'''
+
+SMALL_TABLES = {'table_table', 'user_role'}
+
+
+def login_history(user_id, since):
+    # same query as view_login_history
+    return list(LoginHistory.objects.filter(user_id=user_id, login_time__gte=since).order_by('-login_time', '-id').values('id', 'login_time', 'user_agent')[:51])
+
+
+def sales_report(since, until):
+    # same queries as sales_report (group=variant and total) and peak_hours_report
+    rows = in_range(SalesRollup.objects.filter(period=SalesRollup.DAY), since, until).values('product_variant_id', 'product_id')
+    list(rows.order_by('product_variant_id')[:50])
+    list(in_range(SalesTotalRollup.objects.filter(period=SalesRollup.DAY), since, until).order_by('period_start')[:50])
+    list(in_range(SalesTotalRollup.objects.filter(period=SalesRollup.HOUR), since, until).values('period_start'))
+
+
+def hot_paths():
+    now = timezone.now()
+    month_ago = now - timedelta(days=30)
+    return {
+        'menu page': lambda: build_products_page({}),
+        'menu page desc': lambda: build_products_page({'order': 'desc'}),
+        'menu page product': lambda: build_products_page({'product_id': '1'}),
+        'menu page product price': lambda: build_products_page({'product_id': '1', 'min_price': '5', 'max_price': '20'}),
+        'menu page price': lambda: build_products_page({'min_price': '5', 'max_price': '20'}),
+        'menu cursor page': lambda: build_products_page({'cursor': encode_cursor(['m', 1]), 'limit': '20', 'include_total': 'true'}),
+        'menu search': lambda: build_products_page({'variant_name': 'pizza'}),
+        'menu images': lambda: images_for([1, 2, 3]),
+        'variant detail': lambda: fetch_variant(1),
+        'login history': lambda: login_history(1, month_ago),
+        'known device': lambda: KnownDevice.objects.filter(user_id=1, ip='127.0.0.1', user_agent_hash='0' * 64).update(last_seen=now),
+        'audit log of a user': lambda: list(AuditLog.objects.filter(user_id=1, action_time__gte=month_ago).order_by('-action_time')[:50]),
+        'token lookup': lambda: Token.objects.filter(token='token', revoked_at__isnull=True, expires_at__gt=now).update(revoked_at=now, rotated=True),
+        'expired tokens': lambda: delete_expired(batch_size=500),
+        'latest cart': lambda: Cart.objects.filter(user_id=1).order_by('-created_at').first(),
+        'cart holds': lambda: list(StockReservation.objects.filter(cart_id=1, status=StockReservation.HELD, expires_at__gt=now)),
+        'expired holds': lambda: list(StockReservation.objects.filter(status=StockReservation.HELD, expires_at__lte=now)[:500]),
+        'pending rollups': lambda: list(Order.objects.filter(status='completed', rolled_up_at__isnull=True).order_by('id').values_list('id', flat=True)[:500]),
+        'sales reports': lambda: sales_report(month_ago, now),
+        'free tables': lambda: list(free_tables(now, now + timedelta(hours=2), 2)),
+    }
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries of the hot paths and check that they use indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--path', help='only the paths whose name contains this')
+        parser.add_argument('--plans', action='store_true', help='print the whole plans')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'explain_queries knows SQLite and Postgres plans, not {connection.vendor}')
+
+        failures = []
+        try:
+            with transaction.atomic(using=connection.alias):
+                hide_statistics(connection)
+                self.check_paths(connection, options, failures)
+                transaction.set_rollback(True, using=connection.alias)
+        finally:
+            reload_statistics(connection)
+
+        if failures:
+            raise CommandError('Queries without an index:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index'))
+
+    def check_paths(self, connection, options, failures):
+        for name, run in hot_paths().items():
+            if options['path'] and options['path'] not in name:
+                continue
+            self.stdout.write(name)
+            for sql in self.capture(connection, run):
+                plan = self.explain(connection, sql)
+                scans = [table for table in full_scans(connection.vendor, plan) if table not in SMALL_TABLES]
+                indexes = indexes_used(connection.vendor, plan)
+                summary = ', '.join(indexes) or 'no index'
+                if scans:
+                    failures.append(f"{name}: full scan of {', '.join(scans)}")
+                    self.stdout.write(self.style.ERROR(f"  FULL SCAN {', '.join(scans)}  {sql[:120]}"))
+                else:
+                    self.stdout.write(f'  ok  {summary}  {sql[:120]}')
+                if options['plans']:
+                    for line in plan:
+                        self.stdout.write(f'      {line}')
+
+    def capture(self, connection, run):
+        # the statements the path sends (SELECT/UPDATE/DELETE), nothing it writes is kept
+        with transaction.atomic(using=connection.alias), CaptureQueriesContext(connection) as captured:
+            run()
+            transaction.set_rollback(True, using=connection.alias)
+        statements = [query['sql'] for query in captured.captured_queries]
+        return [sql for sql in statements if sql.lstrip().split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'WITH')]
+
+    def explain(self, connection, sql):
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            else:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = [row[0] for row in cursor.fetchall()]
+            transaction.set_rollback(True, using=connection.alias)
+        return plan
+
+
+def hide_statistics(connection):
+    if connection.vendor == 'sqlite' and has_statistics(connection):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM sqlite_stat1')
+            cursor.execute('ANALYZE sqlite_schema') # makes the planner reread them
+
+
+def reload_statistics(connection):
+    if connection.vendor == 'sqlite' and has_statistics(connection):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE sqlite_schema')
+
+
+def has_statistics(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_schema WHERE name = 'sqlite_stat1'")
+        return cursor.fetchone() is not None
+
+
+def full_scans(vendor, plan):
+    if vendor == 'sqlite':
+        # "SCAN product_productvariant" is a full scan, "SCAN ... USING INDEX" walks an index, virtual tables are the search index
+        pattern = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+    else:
+        pattern = re.compile(r'Seq Scan on (\w+)')
+    return [match.group(1) for match in map(pattern.search, plan) if match]
+
+
+def indexes_used(vendor, plan):
+    if vendor == 'sqlite':
+        pattern = re.compile(r'USING (?:COVERING )?(INDEX \w+|INTEGER PRIMARY KEY)')
+    else:
+        pattern = re.compile(r'Index (?:Only )?Scan (?:Backward )?using (\w+)|Bitmap Index Scan on (\w+)')
+    used = []
+    for line in plan:
+        for match in pattern.finditer(line):
+            index = next(group for group in match.groups() if group).removeprefix('INDEX ')
+            if index not in used:
+                used.append(index)
+    return used
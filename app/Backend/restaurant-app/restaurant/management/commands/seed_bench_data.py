@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from restaurant.benchmark import dataset
+
+'''
+    Seeds (or removes) the benchmark dataset, see restaurant/benchmark/dataset.py
+    usage:
+        python manage.py seed_bench_data                                         # defaults: 5000 variants, 200 users x 500 logins, 20000 orders
+        python manage.py seed_bench_data --products 1000 --orders 50000 --seed 2
+        python manage.py seed_bench_data --flush                                 # delete the bench users and products (and all their rows)
+'''
+
+class Command(BaseCommand):
+    help = 'Seed or remove the benchmark dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--variants-per-product', type=int, default=10)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--logins-per-user', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--flush', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            deleted = dataset.flush()
+            self.stdout.write(self.style.SUCCESS(f'{deleted} bench rows deleted'))
+            return
+
+        counts = dataset.seed(
+            products=options['products'],
+            variants_per_product=options['variants_per_product'],
+            users=options['users'],
+            logins_per_user=options['logins_per_user'],
+            orders=options['orders'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS('Bench dataset: ' + ', '.join(f'{count} {name}' for name, count in counts.items())))
@@ -0,0 +1,39 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from restaurant.utils.db_router import start_request, finish_request
+
+'''
+    Per request state of the read replica router (utils/db_router.py): whether the request wrote, whether the client
+    is pinned to the primary. A request that wrote pins its client (db_pin cookie + cache key of the jwt user) for
+    DATABASE_REPLICA_MAX_LAG_SECONDS so it reads its own writes.
+'''
+
+
+class DatabaseRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = start_request(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request(token, response)
+        return response
+
+    async def __acall__(self, request):
+        # the state is a contextvar, sync_to_async copies it into the thread the ORM calls run in
+        token = start_request(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            finish_request(token, response)
+        return response
@@ -0,0 +1,39 @@
+from functools import wraps
+from django.http import JsonResponse
+from restaurant.user.models import User, Role
+
+'''
+    Role guard for views, needs jwt_required first (it is what sets request.user).
+        @role_required('admin')
+        @role_required('admin', 'waiter') # any of them
+
+    The role name is resolved once per request and kept on the request, so stacking guards costs nothing extra:
+        - jwt_required already loaded the user with its role (utils/auth_cache.py): 0 queries
+        - otherwise: 1 query for the role name
+'''
+
+def get_role_name(request):
+    if not hasattr(request, '_role_name'):
+        request._role_name = _resolve_role_name(request.user)
+    return request._role_name
+
+def _resolve_role_name(user):
+    role_id = getattr(user, 'role_id', None) # AnonymousUser has no role
+    if role_id is None:
+        return None
+    if User.role.is_cached(user):
+        return user.role.name.lower()
+    name = Role.objects.filter(id=role_id).values_list('name', flat=True).first()
+    return name.lower() if name else None
+
+def role_required(*roles):
+    allowed = {role.lower() for role in roles}
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if get_role_name(request) in allowed:
+                return view_func(request, *args, **kwargs)
+            return JsonResponse({'error': 'Unauthorized access'}, status=403)
+        return _wrapped_view
+    return decorator
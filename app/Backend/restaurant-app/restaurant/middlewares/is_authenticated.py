@@ -3,12 +3,13 @@ from django.conf import settings
 from django.http import JsonResponse
 from functools import wraps
 from restaurant.user.models import User
+from restaurant.utils.auth_cache import decode_access_claims, get_user
 
 SECRET_KEY = settings.SECRET_KEY
 
-def jwt_required(view_func):
-    @wraps(view_func)
-    def _wrapped_view(request, *args, **kwargs): 
+def authenticate(request, token=None):
+    # sets request.user from the bearer token (or the given token), returns None or the error response.
+    if token is None:
         auth_header = request.headers.get('Authorization')
         
         if not auth_header:
@@ -21,20 +22,31 @@ def jwt_required(view_func):
             return JsonResponse({'error': 'Token not found'}, status=401)
         
         token = parts[1]
-        
-        try:
-            # Decode the access token
-            decoded = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-            if decoded.get('token_type') != 'access':  # Ensure it's an access token
-                return JsonResponse({'error': 'Invalid token type'}, status=401)
-            request.user = User.objects.get(id=decoded.get('user_id'))
-        except jwt.ExpiredSignatureError:
-            return JsonResponse({'error': 'Token expired'}, status=401)
-        except jwt.InvalidTokenError:
-            return JsonResponse({'error': 'Invalid token'}, status=401)
-        except User.DoesNotExist:
-            return JsonResponse({'error': 'User not found'}, status=404)
-        
+    
+    try:
+        # Decode the access token, claims and users are cached, see utils/auth_cache.py
+        decoded = decode_access_claims(token)
+        if decoded.get('token_type') != 'access':  # Ensure it's an access token
+            return JsonResponse({'error': 'Invalid token type'}, status=401)
+        request.user = get_user(decoded.get('user_id')) # role already loaded
+    except jwt.ExpiredSignatureError:
+        return JsonResponse({'error': 'Token expired'}, status=401)
+    except jwt.InvalidTokenError:
+        return JsonResponse({'error': 'Invalid token'}, status=401)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    if not request.user.is_active: # soft deleted
+        return JsonResponse({'error': 'User is not active'}, status=403)
+    return None
+
+
+def jwt_required(view_func):
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs): 
+        error = authenticate(request)
+        if error is not None:
+            return error
         return view_func(request, *args, **kwargs)
     
     return _wrapped_view
@@ -0,0 +1,222 @@
+import contextvars
+import cProfile
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from restaurant.utils.metrics import Counter, Histogram, LATENCY_BUCKETS, QUERY_BUCKETS
+
+'''
+    Per view request metrics, first in MIDDLEWARE so it sees the whole request:
+        - SQL queries and SQL time: one execute wrapper per connection, installed when the connection is created and never
+          removed, hands every query to the profile of the request that runs it (a contextvar, asgiref carries it into
+          sync_to_async threads). Overlapping async requests share the thread sensitive connection, each one only
+          counts its own queries.
+        - serialization time (rendering of DRF Responses, between process_template_response and the post render callback,
+          plus the blocks the views wrap in serializing(request))
+        - total latency
+    kept in the histograms of utils/metrics.py and served by GET /metrics, labeled by view name (url name, or "unmatched").
+
+    Query budgets: a view declares the most queries it should ever need,
+        @query_budget(3)
+        @api_view(['GET'])
+        def variant_detail(request, variant_id):
+    going over it counts in restaurant_query_budget_exceeded_total, and raises QueryBudgetExceeded when
+    PROFILING_ENFORCE_QUERY_BUDGETS is on (tests, see restaurant/utils/testing.py).
+
+    cProfile: PROFILING_SAMPLE_RATE of the requests (sync views only) run under cProfile, the ones slower than
+    PROFILING_SLOW_REQUEST_SECONDS are dumped to PROFILING_DUMP_DIR as <time>-<view>.prof (open with `python -m pstats` or snakeviz).
+    One profiled request at a time per process.
+
+    A StreamingHttpResponse is measured until its headers are ready, not until its last chunk.
+'''
+
+REQUESTS = Counter('restaurant_requests_total', 'Requests per view, method and status', ['view', 'method', 'status'])
+LATENCY = Histogram('restaurant_request_duration_seconds', 'Request latency per view', ['view'], LATENCY_BUCKETS)
+QUERIES = Histogram('restaurant_request_queries', 'SQL queries per request', ['view'], QUERY_BUCKETS)
+SQL_TIME = Histogram('restaurant_request_sql_seconds', 'Time spent in SQL per request', ['view'], LATENCY_BUCKETS)
+RENDER_TIME = Histogram('restaurant_request_render_seconds', 'Response serialization time per request', ['view'], LATENCY_BUCKETS)
+SLOW_REQUESTS = Counter('restaurant_slow_requests_total', 'Requests slower than PROFILING_SLOW_REQUEST_SECONDS', ['view'])
+OVER_BUDGET = Counter('restaurant_query_budget_exceeded_total', 'Requests that ran more queries than their view allows', ['view'])
+
+_profiler_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class RequestProfile:
+    def __init__(self, request):
+        self.request = request
+        self.queries = []
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+        self.started = time.perf_counter()
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_profile.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _current_profile.reset(self.token)
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - start
+            self.queries.append(sql)
+
+    def rendering(self, response):
+        self.render_started = time.perf_counter()
+        response.add_post_render_callback(self.rendered)
+
+    def rendered(self, response):
+        self.render_seconds += time.perf_counter() - self.render_started
+
+    def record(self, response):
+        elapsed = time.perf_counter() - self.started
+        view = view_name(self.request)
+        REQUESTS.inc(view=view, method=self.request.method, status=response.status_code)
+        LATENCY.observe(elapsed, view=view)
+        QUERIES.observe(len(self.queries), view=view)
+        SQL_TIME.observe(self.sql_seconds, view=view)
+        RENDER_TIME.observe(self.render_seconds, view=view)
+        if elapsed >= slow_request_seconds():
+            SLOW_REQUESTS.inc(view=view)
+
+        budget = view_budget(self.request)
+        if budget is not None and len(self.queries) > budget:
+            OVER_BUDGET.inc(view=view)
+            if getattr(settings, 'PROFILING_ENFORCE_QUERY_BUDGETS', False):
+                raise QueryBudgetExceeded(
+                    f'{view} ran {len(self.queries)} queries, its budget is {budget}:\n' +
+                    '\n'.join(f'  {i}. {sql}' for i, sql in enumerate(self.queries, 1))
+                )
+
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+
+
+def _execute(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None: # outside of a request: management commands, the audit writer thread...
+        return execute(sql, params, many, context)
+    return profile.execute(execute, sql, params, many, context)
+
+
+def install_wrapper(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+connection_created.connect(install_wrapper)
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PROFILING_ENABLED', True)
+        for connection in connections.all(initialized_only=True): # opened before this module was imported
+            install_wrapper(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        with RequestProfile(request) as profile:
+            request._profile = profile
+            profiler = start_profiler()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+                    if time.perf_counter() - profile.started >= slow_request_seconds():
+                        dump_profile(profiler, request)
+                    _profiler_lock.release()
+            profile.record(response)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        with RequestProfile(request) as profile: # the contextvar is set in this request's task, its ORM calls see it
+            request._profile = profile
+            response = await self.get_response(request)
+        profile.record(response)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            profile.rendering(response)
+        return response
+
+
+@contextmanager
+def serializing(request):
+    # serialization done inside the view (responses rendered ahead, like the menu cache), counted with the DRF renders
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            profile.render_seconds += time.perf_counter() - start
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+def view_budget(request):
+    match = getattr(request, 'resolver_match', None)
+    return getattr(match.func, 'query_budget', None) if match else None
+
+
+def slow_request_seconds():
+    return getattr(settings, 'PROFILING_SLOW_REQUEST_SECONDS', 0.5)
+
+
+def start_profiler():
+    rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+    if rate <= 0 or random.random() >= rate or not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def dump_profile(profiler, request):
+    folder = Path(getattr(settings, 'PROFILING_DUMP_DIR', Path(settings.BASE_DIR) / 'var' / 'profiles'))
+    folder.mkdir(parents=True, exist_ok=True)
+    name = view_name(request).replace(':', '-').replace('/', '-')
+    profiler.dump_stats(folder / f"{timezone.now().strftime('%Y%m%dT%H%M%S%f')}-{name}.prof")
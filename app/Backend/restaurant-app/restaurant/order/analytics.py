@@ -0,0 +1,213 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Count, DecimalField
+from django.db.models.functions import TruncHour, TruncDay
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Order, OrderItem, SalesRollup, SalesTotalRollup
+from .signals import order_status_changed
+
+try:
+    import numpy as np
+except ImportError: # optional, rebuild_rollups falls back to plain python
+    np = None
+
+'''
+    Sales rollups: units, revenue and orders per variant (SalesRollup) and overall (SalesTotalRollup), per hour and per day.
+    The reports read these tables only, never OrderItem, so a report costs the same after a year of orders.
+    Sales are bucketed by Order.created_at (when the order was paid), UTC.
+
+    - incremental: when orders are completed (order_status_changed) their items are added to the rollups with
+      UPDATE ... SET units = units + n, the database does the sum so concurrent rollups can't lose an increment.
+    - exactly once: an order is claimed by setting Order.rolled_up_at in the same transaction, an order that is
+      already claimed is skipped. Whatever was missed (a failed rollup, a crash) is caught up by
+      `python manage.py rollup_sales`, which rolls up every completed order with no rolled_up_at.
+    - rebuild: `python manage.py rollup_sales --rebuild [--since 2024-09-01]` recomputes the rollups from the orders in bulk,
+      aggregated in memory with numpy when it is installed (one pass of np.unique/np.bincount per period) or plain python.
+'''
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {
+    SalesRollup.HOUR: (TruncHour, 3600),
+    SalesRollup.DAY: (TruncDay, 86400),
+}
+REVENUE = Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+@receiver(order_status_changed)
+def _orders_changed(sender, order_ids, status, **kwargs):
+    if status != 'completed':
+        return
+    try:
+        rollup_orders(order_ids)
+    except Exception:
+        logger.exception('Sales rollup failed, rollup_sales will catch these orders up') # the orders are already completed
+
+
+def rollup_orders(order_ids=None, batch_size=500):
+    # adds completed orders that aren't rolled up yet (the given ones, or the oldest batch_size) to the rollups.
+    # returns how many orders were added.
+    with transaction.atomic():
+        pending = Order.objects.select_for_update().filter(status='completed', rolled_up_at__isnull=True)
+        if order_ids is not None:
+            pending = pending.filter(id__in=order_ids)
+        else:
+            pending = pending.order_by('id')[:batch_size]
+        claimed = list(pending.values_list('id', flat=True))
+        if not claimed:
+            return 0
+        Order.objects.filter(id__in=claimed).update(rolled_up_at=timezone.now())
+        add_to_rollups(claimed)
+    return len(claimed)
+
+
+def catch_up(batch_size=500):
+    rolled_up = 0
+    while True:
+        count = rollup_orders(batch_size=batch_size)
+        rolled_up += count
+        if count < batch_size:
+            return rolled_up
+
+
+def add_to_rollups(order_ids):
+    items = OrderItem.objects.filter(order_id__in=order_ids)
+    for period, (trunc, _) in PERIODS.items():
+        by_period = items.annotate(period_start=trunc('order__created_at', tzinfo=dt_timezone.utc))
+        for row in by_period.values('period_start', 'product_variant_id', 'product_variant__product_id').annotate(
+            units=Sum('quantity'), revenue=REVENUE, orders=Count('order_id', distinct=True),
+        ):
+            increment(
+                SalesRollup,
+                {'period': period, 'period_start': row['period_start'], 'product_variant_id': row['product_variant_id']},
+                {'units': row['units'], 'revenue': row['revenue'], 'orders': row['orders']},
+                product_id=row['product_variant__product_id'],
+            )
+        for row in by_period.values('period_start').annotate(units=Sum('quantity'), revenue=REVENUE, orders=Count('order_id', distinct=True)):
+            increment(
+                SalesTotalRollup,
+                {'period': period, 'period_start': row['period_start']},
+                {'units': row['units'], 'revenue': row['revenue'], 'orders': row['orders']},
+            )
+
+
+def increment(model, key, values, **create_fields):
+    # UPDATE model SET x = x + n WHERE key, or INSERT the row when it doesn't exist yet
+    added = {name: F(name) + value for name, value in values.items()}
+    if model.objects.filter(**key).update(**added):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **values, **create_fields)
+    except IntegrityError: # a concurrent rollup inserted it first
+        model.objects.filter(**key).update(**added)
+
+
+# --- bulk rebuild ---
+
+def rebuild_rollups(since=None, chunk_size=5000):
+    # recomputes the rollups from scratch (since: a date, only from that day on). Returns how many order items were read.
+    with transaction.atomic():
+        orders = Order.objects.filter(status='completed')
+        rollups = SalesRollup.objects.all()
+        totals = SalesTotalRollup.objects.all()
+        if since:
+            start = datetime(since.year, since.month, since.day, tzinfo=dt_timezone.utc)
+            orders = orders.filter(created_at__gte=start)
+            rollups = rollups.filter(period_start__gte=start)
+            totals = totals.filter(period_start__gte=start)
+
+        orders.update(rolled_up_at=timezone.now()) # claims them, the incremental rollup skips them from now on
+        rollups.delete()
+        totals.delete()
+
+        columns = read_items(OrderItem.objects.filter(order__in=orders), chunk_size)
+        products = dict(zip(columns['variant'], columns['product']))
+        for period, (_, seconds) in PERIODS.items():
+            by_variant, by_period = aggregate(columns, seconds)
+            SalesRollup.objects.bulk_create([
+                SalesRollup(period=period, period_start=to_datetime(bucket), product_variant_id=variant, product_id=products[variant],
+                            units=units, revenue=to_amount(cents), orders=count)
+                for (bucket, variant), (units, cents, count) in by_variant.items()
+            ], batch_size=1000)
+            SalesTotalRollup.objects.bulk_create([
+                SalesTotalRollup(period=period, period_start=to_datetime(bucket), units=units, revenue=to_amount(cents), orders=count)
+                for bucket, (units, cents, count) in by_period.items()
+            ], batch_size=1000)
+    return len(columns['order'])
+
+
+def read_items(items, chunk_size):
+    # one column per field, times as unix seconds and money as integer cents (exact sums)
+    columns = {'order': [], 'time': [], 'variant': [], 'product': [], 'quantity': [], 'cents': []}
+    for order_id, created_at, variant_id, product_id, quantity, unit_price in items.values_list(
+        'order_id', 'order__created_at', 'product_variant_id', 'product_variant__product_id', 'quantity', 'unit_price',
+    ).iterator(chunk_size=chunk_size):
+        columns['order'].append(order_id)
+        columns['time'].append(int(created_at.timestamp()))
+        columns['variant'].append(variant_id)
+        columns['product'].append(product_id)
+        columns['quantity'].append(quantity)
+        columns['cents'].append(int(unit_price * 100) * quantity)
+    return columns
+
+
+def aggregate(columns, seconds):
+    # returns ({(bucket, variant_id): (units, cents, orders)}, {bucket: (units, cents, orders)}), bucket = unix start of the period.
+    # An order has each variant once (OrderItem is unique on order + variant), so the orders of a variant are its rows.
+    if np is not None:
+        return aggregate_numpy(columns, seconds)
+    by_variant = defaultdict(lambda: [0, 0, 0])
+    by_period = defaultdict(lambda: [0, 0, set()])
+    for order_id, moment, variant_id, quantity, cents in zip(columns['order'], columns['time'], columns['variant'], columns['quantity'], columns['cents']):
+        bucket = moment - moment % seconds
+        row = by_variant[(bucket, variant_id)]
+        row[0] += quantity
+        row[1] += cents
+        row[2] += 1
+        total = by_period[bucket]
+        total[0] += quantity
+        total[1] += cents
+        total[2].add(order_id)
+    return (
+        {key: tuple(row) for key, row in by_variant.items()},
+        {bucket: (units, cents, len(orders)) for bucket, (units, cents, orders) in by_period.items()},
+    )
+
+
+def aggregate_numpy(columns, seconds):
+    if not columns['order']:
+        return {}, {}
+    order, moment, variant, quantity, cents = (np.asarray(columns[name], dtype=np.int64) for name in ('order', 'time', 'variant', 'quantity', 'cents'))
+    first = moment.min() - moment.min() % seconds
+    period = (moment - first) // seconds # 0, 1, 2... one per hour/day
+
+    # (period, variant) packed in one int64 key, np.unique on 1d keys is a plain sort
+    width = int(variant.max()) + 1
+    keys, group = np.unique(period * width + variant, return_inverse=True)
+    units = np.bincount(group, weights=quantity).round().astype(np.int64)
+    revenue = np.bincount(group, weights=cents).round().astype(np.int64)
+    orders = np.bincount(group)
+    buckets = (keys // width * seconds + first).tolist()
+    by_variant = {(b, v): (u, r, o) for b, v, u, r, o in zip(buckets, (keys % width).tolist(), units.tolist(), revenue.tolist(), orders.tolist())}
+
+    periods, group = np.unique(period, return_inverse=True)
+    units = np.bincount(group, weights=quantity).round().astype(np.int64)
+    revenue = np.bincount(group, weights=cents).round().astype(np.int64)
+    width = int(order.max()) + 1
+    _, orders = np.unique(np.unique(period * width + order) // width, return_counts=True) # distinct orders per period, same order as periods
+    buckets = (periods * seconds + first).tolist()
+    by_period = {b: (u, r, o) for b, u, r, o in zip(buckets, units.tolist(), revenue.tolist(), orders.tolist())}
+    return by_variant, by_period
+
+
+def to_datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+def to_amount(cents):
+    return (Decimal(cents) / 100).quantize(Decimal('0.01'))
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class OrderConfig(AppConfig):
+    name = 'restaurant.order'
+
+    def ready(self):
+        from . import analytics # connects the sales rollups to order_status_changed
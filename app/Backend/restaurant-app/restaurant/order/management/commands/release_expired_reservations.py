@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from restaurant.order.stock import release_expired
+
+'''
+    Gives the stock of expired holds back, see order/stock.py
+    usage: python manage.py release_expired_reservations
+    reservations already release expired holds lazily, run this from cron (e.g. every minute) so quiet periods don't keep stock locked.
+'''
+
+class Command(BaseCommand):
+    help = 'Release expired stock reservations'
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'{released} expired reservations released'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from restaurant.order.analytics import catch_up, rebuild_rollups
+
+'''
+    Sales rollups, see order/analytics.py
+    usage:
+        python manage.py rollup_sales                               # completed orders missing from the rollups (run from cron)
+        python manage.py rollup_sales --rebuild                     # recompute everything from the orders
+        python manage.py rollup_sales --rebuild --since 2024-09-01  # recompute from that day on
+'''
+
+class Command(BaseCommand):
+    help = 'Catch up or rebuild the sales rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true')
+        parser.add_argument('--since', help='YYYY-MM-DD, with --rebuild')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not options['rebuild']:
+            rolled_up = catch_up(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{rolled_up} orders rolled up'))
+            return
+
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid date: {options['since']}")
+        items = rebuild_rollups(since=since)
+        self.stdout.write(self.style.SUCCESS(f'Rollups rebuilt from {items} order items'))
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_stockreservation'),
+        ('product', '0003_variant_is_available'),
+        ('user', '0009_log_time_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesTotalRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='rolled_up_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('rolled_up_at__isnull', True), ('status', 'completed')), fields=['id'], name='order_pending_rollup'),
+        ),
+        migrations.AddField(
+            model_name='salesrollup',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='product.product'),
+        ),
+        migrations.AddField(
+            model_name='salesrollup',
+            name='product_variant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='product.productvariant'),
+        ),
+        migrations.AddConstraint(
+            model_name='salestotalrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start'), name='unique_sales_total_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'product_variant'), name='unique_sales_rollup'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0003_sales_rollups'),
+        ('user', '0010_token_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cart',
+            options={'ordering': ['-created_at']},
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', 'created_at'], name='cart_user_created'),
+        ),
+    ]
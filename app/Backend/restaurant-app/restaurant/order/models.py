@@ -1,6 +1,8 @@
 from django.db import models
-from restaurant.product.models import ProductVariant
-from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils import timezone
+from restaurant.product.models import Product, ProductVariant
+from restaurant.user.models import User
 from datetime import datetime
 
 
@@ -19,6 +21,8 @@ from datetime import datetime
     An order belongs to a user.
 
     # Once an order is "completed", it can NEVER go back to "pending" or "cancelled" <= enforce this logic.
+    status changes: pending -> completed, pending -> cancelled. completed and cancelled are final (ORDER_TRANSITIONS).
+    change it with Order.objects.filter(...).transition('completed'), one conditional UPDATE, see order/services.py
 
     An OrderItem can contain many ProductVariants that were inside of the Order at the time of purchase.
     it's basically a wrap around the ProductVariant model.
@@ -34,12 +38,12 @@ class Cart(models.Model):
     def __str__(self):
         return f'{self.user.username}\'s cart'
     
-    class meta:
+    class Meta:
         ordering = ['-created_at'] 
         indexes = [
-            models.Index(fields=['user']), 
-            models.Index(fields=['created_at']),
-            # where else does it make sns to add an index? 
+            # a user's latest cart (checkout, hold_cart): WHERE user_id = ? ORDER BY created_at DESC LIMIT 1.
+            # user alone is the foreign key's index already, nothing reads carts by created_at alone.
+            models.Index(fields=['user', 'created_at'], name='cart_user_created'),
         ]
 
 class CartItem(models.Model):
@@ -52,8 +56,24 @@ class CartItem(models.Model):
 
 
 
+# new status -> the statuses an order can move to it from
+ORDER_TRANSITIONS = {
+    'completed': ('pending',),
+    'cancelled': ('pending',),
+}
+
+
+class OrderQuerySet(models.QuerySet):
+    def transition(self, status):
+        # UPDATE ... SET status = <status> WHERE <filters> AND status IN (<allowed sources>), returns how many orders changed.
+        # The database checks the current status, two waiters can't complete and cancel the same order.
+        if status not in ORDER_TRANSITIONS:
+            raise ValueError(f'Invalid status: {status}')
+        return self.filter(status__in=ORDER_TRANSITIONS[status]).update(status=status, updated_at=timezone.now())
+
+
 class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, relatied_name='orders') # example query from the other side: user.orders.all()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders') # example query from the other side: user.orders.all()
     cart = models.OneToOneField(Cart, on_delete=models.CASCADE, related_name='order') # this takes a "snapshot" of the cart at the time of purchase.
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=[ # this could also be its own model in the future.
@@ -64,11 +84,32 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True) # this should be set when the order is created/payed.
     updated_at = models.DateTimeField(auto_now=True) # this should be updated when the status changes.
     time_to_eat = models.DateTimeField(null=True, default=datetime.now) # example: 2021-08-01 12:00:00 . if not provided, default to now.
-    
-    def save(self, *args, **kwargs):  
-        if self.status.lower() == 'completed' and self.pk and Order.objects.get(pk=self.pk).status != 'completed':
-            raise ValueError('Once an order is completed, it can not be changed.')
-        super().save(*args, **kwargs) 
+    rolled_up_at = models.DateTimeField(null=True, blank=True) # when the order was added to the sales rollups, see order/analytics.py
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # completed orders still missing from the sales rollups, for the catch up command
+            models.Index(fields=['id'], condition=Q(status='completed', rolled_up_at__isnull=True), name='order_pending_rollup'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # remember the status the order was loaded with, so save() can check the transition without querying it again
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        loaded_status = getattr(self, '_loaded_status', None)
+        if loaded_status and self.status != loaded_status:
+            if loaded_status == 'completed':
+                raise ValueError('Once an order is completed, it can not be changed.')
+            if loaded_status not in ORDER_TRANSITIONS.get(self.status, ()):
+                raise ValueError(f'An order can not go from {loaded_status} to {self.status}.')
+        super().save(*args, **kwargs)
+        self._loaded_status = self.status
 
     def __str__(self):
         return f"Order {self.id} for {self.user.first_name} - Status: {self.status}"
@@ -77,6 +118,64 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items') # example query from the other side: order.items.all()
     product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='order_items') #it's a wrap around the ProductVariant model.
     quantity = models.PositiveIntegerField(default=1) # this might need some extra validations
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2) # price of the variant at the time of purchase, the variant's price can change later
 
     class Meta:
         unique_together = ['order', 'product_variant'] # an order can have many product variants, but the same product variant can't be in the order twice. <- only change its quantity.
+
+
+class StockReservation(models.Model):
+    # ledger of every unit of stock taken from a ProductVariant, see order/stock.py
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=[
+        (HELD, 'Held'), # set aside for a cart, until expires_at
+        (COMMITTED, 'Committed'), # part of an order
+        (RELEASED, 'Released'), # expired or given back, the units went back to stock
+    ], default=HELD)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expires'), # finding expired holds
+        ]
+
+
+class SalesRollup(models.Model):
+    # units and revenue of one variant in one hour or day, kept up to date by order/analytics.py
+    HOUR = 'hour'
+    DAY = 'day'
+
+    period = models.CharField(max_length=4, choices=[(HOUR, 'Hour'), (DAY, 'Day')])
+    period_start = models.DateTimeField() # UTC, start of the hour/day
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='sales_rollups')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_rollups') # copied from the variant, product reports don't join
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0) # orders with this variant
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'product_variant'], name='unique_sales_rollup'), # also the index of the reports
+        ]
+
+
+class SalesTotalRollup(models.Model):
+    # all the sales of one hour or day
+    period = models.CharField(max_length=4, choices=[(SalesRollup.HOUR, 'Hour'), (SalesRollup.DAY, 'Day')])
+    period_start = models.DateTimeField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start'], name='unique_sales_total_rollup'),
+        ]
@@ -0,0 +1,97 @@
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Sum, Count, DecimalField
+from django.utils import timezone
+from .models import Cart, CartItem, Order, OrderItem, ORDER_TRANSITIONS
+from .signals import order_status_changed
+from .stock import commit_cart, release_orders, OutOfStock
+
+'''
+    Checkout: turns a Cart into an Order.
+
+    Everything happens in one transaction and in a fixed number of queries, whatever the size of the cart:
+        1. lock the cart row (SELECT ... FOR UPDATE on Postgres, SQLite serializes writers anyway)
+        2. total_amount, item count and unavailable items, aggregated by the database
+        3. the cart items with the current price of their variant
+        4. INSERT the order
+        5. take the stock: the cart's holds are committed, the rest is one conditional UPDATE for every line (see stock.py)
+        6. INSERT all the OrderItems at once (bulk_create)
+    A cart can only become one order (Order.cart is one to one), checking out the same cart twice fails on the constraint.
+
+    Status changes (transition_orders): one conditional UPDATE for all the orders, whatever how many there are.
+    The ids that will change are read with SELECT ... FOR UPDATE in the same transaction, so nobody can change them in
+    between (Postgres locks the rows, SQLite allows one writer), and order_status_changed is sent for them after the commit.
+    Cancelling gives the orders' committed stock back in the same transaction.
+'''
+
+class CheckoutError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def checkout(user, cart_id=None, time_to_eat=None):
+    with transaction.atomic():
+        carts = Cart.objects.select_for_update().filter(user=user)
+        if cart_id:
+            cart = carts.filter(id=cart_id).first()
+        else:
+            cart = carts.order_by('-created_at').first() # the user's latest cart
+        if not cart:
+            raise CheckoutError('Cart not found', status=404)
+
+        items = CartItem.objects.filter(cart=cart)
+        summary = items.aggregate(
+            total=Sum(F('quantity') * F('product_variant__price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            count=Count('id'),
+            unavailable=Count('id', filter=Q(product_variant__is_active=False)),
+        )
+        if not summary['count']:
+            raise CheckoutError('Cart is empty')
+        if summary['unavailable']:
+            raise CheckoutError('Some items in the cart are no longer available')
+
+        rows = list(items.values_list('product_variant_id', 'quantity', 'product_variant__price'))
+
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(
+                    user=user,
+                    cart=cart,
+                    total_amount=Decimal(summary['total']).quantize(Decimal('0.01')),
+                    time_to_eat=time_to_eat or timezone.now(),
+                )
+        except IntegrityError:
+            raise CheckoutError('Cart already checked out', status=409)
+
+        try:
+            commit_cart(cart, order, {variant_id: quantity for variant_id, quantity, _ in rows})
+        except OutOfStock as e:
+            raise CheckoutError(str(e), status=409) # rolls the order back too
+
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_variant_id=variant_id, quantity=quantity, unit_price=price)
+            for variant_id, quantity, price in rows
+        ])
+
+    return order
+
+
+def transition_orders(order_ids, status):
+    # returns (changed, rejected): rejected are the ids that don't exist or can't move to status (e.g. already completed).
+    # raises ValueError for an unknown status.
+    if status not in ORDER_TRANSITIONS:
+        raise ValueError(f'Invalid status: {status}')
+    order_ids = list(dict.fromkeys(order_ids))
+
+    with transaction.atomic():
+        movable = Order.objects.select_for_update().filter(id__in=order_ids, status__in=ORDER_TRANSITIONS[status])
+        changed = list(movable.values_list('id', flat=True))
+        if changed:
+            Order.objects.filter(id__in=changed).transition(status)
+            if status == 'cancelled':
+                release_orders(changed) # their stock is for sale again
+            transaction.on_commit(lambda: order_status_changed.send(sender=Order, order_ids=changed, status=status))
+
+    changed_ids = set(changed)
+    return changed, [order_id for order_id in order_ids if order_id not in changed_ids]
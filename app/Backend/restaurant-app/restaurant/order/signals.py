@@ -0,0 +1,12 @@
+from django.dispatch import Signal
+
+'''
+    order_status_changed is sent after the transaction that changed the status of some orders commits.
+        sender=Order, order_ids=[...] (the orders that really changed), status='completed' / 'cancelled'
+
+        @receiver(order_status_changed)
+        def on_status_changed(sender, order_ids, status, **kwargs):
+            ...
+'''
+
+order_status_changed = Signal()
@@ -0,0 +1,141 @@
+import datetime
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Case, When, Value, IntegerField, Sum
+from django.utils import timezone
+from restaurant.product.models import ProductVariant
+from restaurant.product.cache import invalidate_menu
+from .models import StockReservation
+
+'''
+    Stock reservations.
+
+    ProductVariant.stock only ever changes through a conditional UPDATE, never read-modify-write:
+        UPDATE variant SET stock = stock - n WHERE id = x AND stock >= n
+    the database checks and decrements in one step, so concurrent orders can't oversell (the row lock on Postgres,
+    the single writer on SQLite). A whole cart is one UPDATE with a CASE per variant, either every line fits or none is taken.
+
+    Every decrement is recorded in the StockReservation ledger:
+        - held: stock set aside for a cart while the customer finishes the order, expires after STOCK_RESERVATION_TTL
+        - committed: turned into an order at checkout
+        - released: expired, given back or its order was cancelled, the units went back to stock
+    Expired holds are released lazily by the next reservation and by `python manage.py release_expired_reservations`.
+
+    When stock reaches 0 the variant is flagged is_available=False (sold out), it flips back when stock comes back.
+    Every change of stock invalidates the menu cache (product/cache.py), the menu payload includes the stock.
+'''
+
+class OutOfStock(Exception):
+    pass
+
+
+def reservation_ttl():
+    return datetime.timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 600))
+
+
+def take_stock(quantities):
+    # quantities = {variant_id: units}, all or nothing, raises OutOfStock. Call inside a transaction.
+    quantities = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    units = Case(*[When(id=variant_id, then=Value(quantity)) for variant_id, quantity in quantities.items()], output_field=IntegerField())
+    taken = ProductVariant.objects.filter(id__in=quantities, is_active=True, stock__gte=units).update(stock=F('stock') - units)
+    if taken != len(quantities):
+        raise OutOfStock('Not enough stock for some items in the cart') # the caller's transaction rolls back the lines that did fit
+    sync_availability(quantities)
+
+
+def give_back_stock(quantities):
+    # quantities = {variant_id: units}, e.g. an expired hold. Call inside a transaction.
+    quantities = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    units = Case(*[When(id=variant_id, then=Value(quantity)) for variant_id, quantity in quantities.items()], output_field=IntegerField())
+    ProductVariant.objects.filter(id__in=quantities).update(stock=F('stock') + units)
+    sync_availability(quantities)
+
+
+def sync_availability(variant_ids):
+    # called after every stock change. The flag update only touches the variants whose flag is wrong, so most calls
+    # update nothing, the menu is invalidated anyway: its cached pages show the stock.
+    ProductVariant.objects.filter(id__in=variant_ids, stock__lte=0, is_available=True).update(is_available=False)
+    ProductVariant.objects.filter(id__in=variant_ids, stock__gt=0, is_available=False).update(is_available=True)
+    invalidate_menu()
+
+
+def cart_quantities(cart):
+    return dict(cart.items.values_list('product_variant_id', 'quantity'))
+
+
+def hold_cart(cart):
+    # sets the cart's stock aside until it expires, replaces an earlier hold of the same cart. Returns the expiry time.
+    release_expired()
+    expires_at = timezone.now() + reservation_ttl()
+    with transaction.atomic():
+        release_cart(cart)
+        quantities = cart_quantities(cart)
+        take_stock(quantities)
+        StockReservation.objects.bulk_create([
+            StockReservation(product_variant_id=variant_id, cart=cart, quantity=quantity, expires_at=expires_at)
+            for variant_id, quantity in quantities.items()
+        ])
+    return expires_at
+
+
+def commit_cart(cart, order, quantities):
+    # checkout: the cart's live holds become part of the order, whatever is not held is taken now. Call inside the checkout transaction.
+    now = timezone.now()
+    held = defaultdict(int)
+    holds = StockReservation.objects.filter(cart=cart, status=StockReservation.HELD, expires_at__gt=now)
+    for variant_id, quantity in holds.values_list('product_variant_id', 'quantity'):
+        held[variant_id] += quantity
+    holds.update(status=StockReservation.COMMITTED, order=order)
+
+    missing = {variant_id: quantity - held[variant_id] for variant_id, quantity in quantities.items() if quantity > held[variant_id]}
+    surplus = {variant_id: held_quantity - quantities.get(variant_id, 0) for variant_id, held_quantity in held.items() if held_quantity > quantities.get(variant_id, 0)}
+    take_stock(missing)
+    give_back_stock(surplus) # the cart shrank after the hold
+    StockReservation.objects.bulk_create([
+        StockReservation(product_variant_id=variant_id, cart=cart, order=order, quantity=quantity, status=StockReservation.COMMITTED, expires_at=now)
+        for variant_id, quantity in missing.items()
+    ])
+
+
+def release_cart(cart):
+    with transaction.atomic():
+        release(StockReservation.objects.filter(cart=cart, status=StockReservation.HELD))
+
+
+def release_orders(order_ids):
+    # the committed stock of cancelled orders goes back. Call inside the transaction that cancels them,
+    # an order is only cancelled once (conditional UPDATE on its status) so its units can't come back twice.
+    committed = StockReservation.objects.filter(order_id__in=order_ids, status=StockReservation.COMMITTED)
+    returned = dict(committed.order_by().values('product_variant_id').annotate(units=Sum('quantity')).values_list('product_variant_id', 'units'))
+    committed.update(status=StockReservation.RELEASED)
+    give_back_stock(returned)
+
+
+def release_expired(batch_size=500):
+    # returns how many holds were released
+    expired = StockReservation.objects.filter(status=StockReservation.HELD, expires_at__lte=timezone.now())
+    released = 0
+    while True:
+        with transaction.atomic():
+            count = release(expired.order_by('expires_at')[:batch_size])
+        released += count
+        if count < batch_size:
+            return released
+
+
+def release(holds):
+    # holds is a queryset of held reservations. Each one is claimed with a conditional UPDATE first, so two
+    # workers releasing the same hold can't both give its units back.
+    returned = defaultdict(int)
+    released = 0
+    for reservation_id, variant_id, quantity in list(holds.values_list('id', 'product_variant_id', 'quantity')):
+        if StockReservation.objects.filter(id=reservation_id, status=StockReservation.HELD).update(status=StockReservation.RELEASED):
+            returned[variant_id] += quantity
+            released += 1
+    give_back_stock(returned)
+    return released
@@ -0,0 +1,309 @@
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from restaurant.user.models import Role, User
+from restaurant.utils.jwt_utils import create_access_token
+from restaurant.product.cache import menu_cache
+from restaurant.product.models import Product, ProductVariant
+from .models import Cart, CartItem, Order, StockReservation, SalesRollup, SalesTotalRollup
+from .analytics import rebuild_rollups, catch_up
+from .services import checkout, CheckoutError, transition_orders
+from .signals import order_status_changed
+from .stock import hold_cart, release_expired, take_stock, OutOfStock
+
+
+def make_variant(stock, name='Lasagna'):
+    product = Product.objects.create(name=name)
+    return ProductVariant.objects.create(product=product, name='Classic', price='10.00', stock=stock, is_available=stock > 0)
+
+def make_cart(user, *lines):
+    cart = Cart.objects.create(user=user)
+    CartItem.objects.bulk_create([CartItem(cart=cart, product_variant=variant, quantity=quantity) for variant, quantity in lines])
+    return cart
+
+def auth(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {create_access_token(user.id, user.email)}'}
+
+
+class CheckoutViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com')
+
+    def post(self, body):
+        return self.client.post('/orders/checkout/', body, content_type='application/json', **auth(self.user))
+
+    def test_total_is_the_sum_of_the_items(self):
+        pizza = make_variant(stock=10, name='Pizza')
+        pasta = make_variant(stock=10)
+        ProductVariant.objects.filter(id=pasta.id).update(price='7.25')
+        cart = make_cart(self.user, (pizza, 2), (pasta, 3))
+
+        response = self.post({'cart_id': cart.id})
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(id=response.json()['order_id'])
+        self.assertEqual(order.total_amount, Decimal('41.75'))
+        self.assertEqual(order.total_amount, sum(item.unit_price * item.quantity for item in order.items.all()))
+
+    def test_a_cart_becomes_one_order(self):
+        cart = make_cart(self.user, (make_variant(stock=10), 1))
+        self.assertEqual(self.post({'cart_id': cart.id}).status_code, 201)
+        response = self.post({'cart_id': cart.id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_invalid_carts_are_rejected(self):
+        empty = make_cart(self.user)
+        self.assertEqual(self.post({'cart_id': empty.id}).status_code, 400)
+        self.assertEqual(self.post({}).status_code, 400) # the latest cart is the empty one
+        self.assertEqual(self.post({'cart_id': 'abc'}).status_code, 400)
+        self.assertEqual(self.post({'cart_id': empty.id + 1}).status_code, 404)
+        self.assertEqual(self.post({'cart_id': empty.id, 'time_to_eat': 5}).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com')
+
+    def test_checkout_takes_stock_and_flags_sold_out(self):
+        variant = make_variant(stock=3)
+        order = checkout(self.user, cart_id=make_cart(self.user, (variant, 3)).id)
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 0)
+        self.assertFalse(variant.is_available)
+        self.assertEqual(order.reservations.get().status, StockReservation.COMMITTED)
+
+    def test_checkout_without_enough_stock_changes_nothing(self):
+        plenty = make_variant(stock=10, name='Pizza')
+        scarce = make_variant(stock=1)
+        cart = make_cart(self.user, (plenty, 2), (scarce, 2))
+
+        with self.assertRaises(CheckoutError):
+            checkout(self.user, cart_id=cart.id)
+
+        self.assertEqual(ProductVariant.objects.get(id=plenty.id).stock, 10)
+        self.assertEqual(ProductVariant.objects.get(id=scarce.id).stock, 1)
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_hold_goes_back_to_stock(self):
+        variant = make_variant(stock=2)
+        cart = make_cart(self.user, (variant, 2))
+        hold_cart(cart)
+        self.assertFalse(ProductVariant.objects.get(id=variant.id).is_available)
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired(), 1)
+        self.assertEqual(release_expired(), 0)
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 2)
+        self.assertTrue(variant.is_available)
+
+    def test_stock_changes_invalidate_the_menu(self):
+        cache.clear()
+        menu_cache.clear()
+        variant = make_variant(stock=5)
+        url = f'/products/{variant.id}/'
+        self.assertEqual(self.client.get(url).json()['stock'], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout(self.user, cart_id=make_cart(self.user, (variant, 2)).id) # still available, only the stock changed
+        self.assertEqual(self.client.get(url).json()['stock'], 3)
+
+    def test_checkout_uses_the_cart_hold(self):
+        variant = make_variant(stock=2)
+        cart = make_cart(self.user, (variant, 2))
+        hold_cart(cart)
+        checkout(self.user, cart_id=cart.id)
+
+        self.assertEqual(ProductVariant.objects.get(id=variant.id).stock, 0)
+        self.assertEqual(StockReservation.objects.get().status, StockReservation.COMMITTED)
+
+
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com')
+        variant = make_variant(stock=10)
+        self.orders = [checkout(self.user, cart_id=make_cart(self.user, (variant, 1)).id) for _ in range(3)]
+
+    def test_bulk_transition_only_moves_pending_orders(self):
+        first, second, third = [order.id for order in self.orders]
+        transition_orders([first], 'completed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            changed, rejected = transition_orders([first, second, third, 999], 'cancelled')
+
+        self.assertEqual(sorted(changed), [second, third])
+        self.assertEqual(rejected, [first, 999])
+        self.assertEqual(Order.objects.get(id=first).status, 'completed')
+
+    def test_cancelling_gives_the_stock_back(self):
+        variant = ProductVariant.objects.get(id=self.orders[0].items.get().product_variant_id)
+        self.assertEqual(variant.stock, 7)
+        completed, cancelled, _ = [order.id for order in self.orders]
+        transition_orders([completed], 'completed')
+
+        transition_orders([completed, cancelled], 'cancelled')
+        transition_orders([cancelled], 'cancelled') # already cancelled, nothing comes back twice
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 8)
+        self.assertEqual(StockReservation.objects.get(order_id=cancelled).status, StockReservation.RELEASED)
+        self.assertEqual(StockReservation.objects.get(order_id=completed).status, StockReservation.COMMITTED)
+
+    def test_cancelling_restocks_sold_out_variants(self):
+        variant = make_variant(stock=1, name='Tiramisu')
+        order = checkout(self.user, cart_id=make_cart(self.user, (variant, 1)).id)
+        self.assertFalse(ProductVariant.objects.get(id=variant.id).is_available)
+
+        transition_orders([order.id], 'cancelled')
+        variant.refresh_from_db()
+        self.assertEqual((variant.stock, variant.is_available), (1, True))
+
+    def test_completed_is_final(self):
+        order = Order.objects.get(id=self.orders[0].id)
+        order.status = 'completed'
+        order.save()
+
+        order.status = 'pending'
+        with self.assertRaises(ValueError):
+            order.save()
+        self.assertEqual(Order.objects.filter(status='pending').transition('completed'), 2)
+        self.assertEqual(Order.objects.filter(id=order.id).transition('cancelled'), 0)
+
+    def test_signal_is_sent_with_the_changed_ids(self):
+        received = []
+        handler = lambda sender, order_ids, status, **kwargs: received.append((sorted(order_ids), status))
+        order_status_changed.connect(handler)
+        self.addCleanup(order_status_changed.disconnect, handler)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_orders([order.id for order in self.orders], 'completed')
+
+        self.assertEqual(received, [(sorted(order.id for order in self.orders), 'completed')])
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com')
+        self.pizza = make_variant(stock=100, name='Pizza')
+        self.pasta = make_variant(stock=100, name='Pasta')
+        noon = timezone.now().replace(year=2024, month=9, day=1, hour=12, minute=15, second=0, microsecond=0)
+        self.orders = []
+        for minutes, lines in [(0, [(self.pizza, 2)]), (10, [(self.pizza, 1), (self.pasta, 3)]), (60 * 25, [(self.pasta, 1)])]:
+            order = checkout(self.user, cart_id=make_cart(self.user, *lines).id)
+            Order.objects.filter(id=order.id).update(created_at=noon + timedelta(minutes=minutes))
+            self.orders.append(order.id)
+
+    def rollups(self):
+        return (
+            sorted(SalesRollup.objects.values_list('period', 'period_start', 'product_variant_id', 'units', 'revenue', 'orders')),
+            sorted(SalesTotalRollup.objects.values_list('period', 'period_start', 'units', 'revenue', 'orders')),
+        )
+
+    def test_completed_orders_are_rolled_up_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_orders(self.orders, 'completed')
+        self.assertEqual(catch_up(), 0)
+
+        day = SalesTotalRollup.objects.get(period=SalesRollup.DAY, period_start__day=1)
+        self.assertEqual((day.orders, day.units, day.revenue), (2, 6, 60))
+        pizza = SalesRollup.objects.get(period=SalesRollup.HOUR, product_variant=self.pizza)
+        self.assertEqual((pizza.orders, pizza.units, pizza.revenue), (2, 3, 30))
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        transition_orders(self.orders, 'completed') # no on_commit here, caught up below
+        self.assertEqual(catch_up(batch_size=2), 3)
+        incremental = self.rollups()
+
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+
+class SalesReportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com', role=Role.objects.get_or_create(name='admin')[0])
+        self.pizza = make_variant(stock=100, name='Pizza')
+        self.calzone = ProductVariant.objects.create(product=self.pizza.product, name='Calzone', price='10.00', stock=100)
+        self.pasta = make_variant(stock=100, name='Pasta')
+        orders = [
+            checkout(self.user, cart_id=make_cart(self.user, *lines).id).id
+            for lines in [[(self.pizza, 2)], [(self.pizza, 1), (self.pasta, 3)], [(self.pizza, 1), (self.calzone, 1)]]
+        ]
+        transition_orders(orders, 'completed')
+        catch_up()
+
+    def report(self, query):
+        response = self.client.get(f'/orders/reports/sales/?{query}', **auth(self.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['rows']
+
+    def test_product_rows_have_no_order_counts(self):
+        pizza = next(row for row in self.report('group=product') if row['product_id'] == self.pizza.product_id)
+        self.assertEqual((pizza['units'], Decimal(str(pizza['revenue']))), (5, 50))
+        self.assertNotIn('orders', pizza) # 3 orders had a pizza, the variant rollups would add up to 4
+        self.assertNotIn('average_ticket', pizza)
+        self.assertIn('average_ticket', self.report('group=variant')[0])
+
+    def test_limit_is_clamped(self):
+        for limit in ('0', '-1'):
+            self.assertEqual(len(self.report(f'limit={limit}')), 1)
+        self.assertEqual(len(self.report('limit=1000')), 3)
+
+
+class HotQueryIndexTests(TestCase):
+    # every query of the hot paths (menu, login history, carts, holds, reports...) has an index, see explain_queries
+    def test_hot_queries_use_indexes(self):
+        output = StringIO()
+        call_command('explain_queries', stdout=output)
+        self.assertIn('Every hot query uses an index', output.getvalue())
+
+
+@override_settings(AUDIT_BUFFERED=False)
+class StockConcurrencyTests(TransactionTestCase):
+    WORKERS = 16
+    ATTEMPTS_PER_WORKER = 5
+    STOCK = 25
+
+    def test_parallel_reservations_never_oversell(self):
+        variant = make_variant(stock=self.STOCK)
+        sold = []
+        rejected = []
+        start = threading.Barrier(self.WORKERS)
+
+        def worker():
+            start.wait()
+            try:
+                for _ in range(self.ATTEMPTS_PER_WORKER):
+                    while True:
+                        try:
+                            take_stock({variant.id: 1})
+                            sold.append(1)
+                        except OutOfStock:
+                            rejected.append(1)
+                        except OperationalError: # sqlite: another worker holds the write lock, try again
+                            time.sleep(0.001)
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        variant.refresh_from_db()
+        self.assertEqual(len(sold), self.STOCK)
+        self.assertEqual(len(rejected), self.WORKERS * self.ATTEMPTS_PER_WORKER - self.STOCK)
+        self.assertEqual(variant.stock, 0)
+        self.assertFalse(variant.is_available)
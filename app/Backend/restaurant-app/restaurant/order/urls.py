@@ -2,5 +2,9 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    
-]
\ No newline at end of file
+    path('checkout/', views.checkout_cart, name='checkout_cart'),
+    path('reserve/', views.reserve_cart, name='reserve_cart'),
+    path('status/', views.fullfil_or_cancel_order, name='fullfil_or_cancel_order'),
+    path('reports/sales/', views.sales_report, name='sales_report'),
+    path('reports/peak-hours/', views.peak_hours_report, name='peak_hours_report'),
+]
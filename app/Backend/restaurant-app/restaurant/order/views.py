@@ -1,5 +1,196 @@
+from datetime import timezone as dt_timezone
+from decimal import Decimal
 from rest_framework.decorators import api_view 
 from rest_framework.response import Response
+from django.db.models import Sum
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from restaurant.middlewares.is_authenticated import jwt_required
+from restaurant.middlewares.has_role import role_required
+from restaurant.middlewares.is_admin import admin_only
+from restaurant.middlewares.profiling import query_budget
+from restaurant.utils.db_router import replica_reads
+from restaurant.user.models import AuditLog
+from .services import checkout, CheckoutError, transition_orders
+from .stock import hold_cart, OutOfStock
+from .models import Cart, SalesRollup, SalesTotalRollup
 
+'''
+    Order routes.
+    A user checks out their cart, a waiter can mark orders as complete or cancel them.
+    Admins get sales reports, read from the rollup tables only (see analytics.py).
+'''
+
+# body (all optional): {"cart_id": 1, "time_to_eat": "2024-09-01T20:30:00Z"}, without cart_id the latest cart of the user is used.
+@api_view(['POST'])
+@jwt_required
+def checkout_cart(request):
+    data = request.data
+    cart_id = data.get('cart_id')
+    time_to_eat = data.get('time_to_eat')
+
+    if cart_id is not None:
+        try:
+            cart_id = int(cart_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'cart_id must be an integer'}, status=400)
+    if time_to_eat:
+        time_to_eat = parse_datetime(time_to_eat) if isinstance(time_to_eat, str) else None
+        if time_to_eat is None:
+            return Response({'error': 'Invalid time_to_eat'}, status=400)
+
+    try:
+        order = checkout(request.user, cart_id=cart_id, time_to_eat=time_to_eat)
+    except CheckoutError as e:
+        return Response({'error': str(e)}, status=e.status)
+
+    return Response({
+        'success': 'Order created',
+        'order_id': order.id,
+        'total_amount': order.total_amount,
+        'status': order.status,
+    }, status=201)
+
+
+# holds the stock of the cart's items for STOCK_RESERVATION_TTL seconds while the customer finishes the order.
+# body (optional): {"cart_id": 1}, without cart_id the latest cart of the user is used.
+@api_view(['POST'])
+@jwt_required
+def reserve_cart(request):
+    carts = Cart.objects.filter(user=request.user)
+    cart_id = request.data.get('cart_id')
+    cart = carts.filter(id=cart_id).first() if cart_id else carts.order_by('-created_at').first()
+    if not cart:
+        return Response({'error': 'Cart not found'}, status=404)
+
+    try:
+        expires_at = hold_cart(cart)
+    except OutOfStock as e:
+        return Response({'error': str(e)}, status=409)
+
+    return Response({'success': 'Stock reserved', 'cart_id': cart.id, 'expires_at': expires_at}, status=200)
+
+
+MAX_ORDERS_PER_REQUEST = 500
+
+# body: {"order_ids": [1, 2, 3], "status": "completed"} or {"order_id": 1, "status": "cancelled"}
+# only pending orders change, the rest come back in "rejected" (not found, already completed or cancelled).
+@api_view(['POST'])
+@jwt_required
+@role_required('admin', 'waiter')
 def fullfil_or_cancel_order(request):
-    ...
\ No newline at end of file
+    data = request.data
+    status = data.get('status')
+    order_ids = data.get('order_ids')
+    if order_ids is None and data.get('order_id') is not None:
+        order_ids = [data.get('order_id')]
+
+    if status not in ('completed', 'cancelled'):
+        return Response({'error': 'status must be completed or cancelled'}, status=400)
+    if not isinstance(order_ids, list) or not order_ids:
+        return Response({'error': 'order_ids is required'}, status=400)
+    if len(order_ids) > MAX_ORDERS_PER_REQUEST:
+        return Response({'error': f'At most {MAX_ORDERS_PER_REQUEST} orders per request'}, status=400)
+    try:
+        order_ids = [int(order_id) for order_id in order_ids]
+    except (TypeError, ValueError):
+        return Response({'error': 'order_ids must be integers'}, status=400)
+
+    changed, rejected = transition_orders(order_ids, status)
+
+    if changed:
+        AuditLog.buffered.create(
+            user=request.user,
+            action=f"Orders {status}: {len(changed)}",
+            action_ip=request.META.get('REMOTE_ADDR'),
+        )
+
+    return Response({'status': status, 'updated': changed, 'rejected': rejected}, status=200)
+
+
+def parse_range(params):
+    # ?since=&until= ISO 8601 (naive means UTC), both optional. Raises ValueError.
+    bounds = []
+    for name in ('since', 'until'):
+        value = params.get(name)
+        moment = parse_datetime(value) if value else None
+        if value and moment is None:
+            raise ValueError(f'Invalid {name}')
+        if moment is not None and timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, dt_timezone.utc)
+        bounds.append(moment)
+    return bounds
+
+
+def in_range(rollups, since, until):
+    if since:
+        rollups = rollups.filter(period_start__gte=since)
+    if until:
+        rollups = rollups.filter(period_start__lt=until)
+    return rollups
+
+
+def with_average_ticket(row):
+    row['average_ticket'] = (row['revenue'] / row['orders']).quantize(Decimal('0.01')) if row['orders'] else None
+    return row
+
+
+# ?period=day|hour (default day) &since= &until= &group=variant|product|total (default variant) &limit=50
+# variant/product: best sellers by revenue, average_ticket (variant only) is the revenue per order that had them.
+# product has no orders nor average_ticket: the rollups count orders per variant, an order with two variants of the
+# same product would count twice.
+# total: one row per hour/day, average_ticket is the average order amount.
+@query_budget(2) # the user (unless jwt_required has it cached) + the rollups
+@api_view(['GET'])
+@jwt_required
+@admin_only
+@replica_reads()
+def sales_report(request):
+    period = request.GET.get('period', SalesRollup.DAY)
+    group = request.GET.get('group', 'variant')
+    if period not in (SalesRollup.HOUR, SalesRollup.DAY):
+        return Response({'error': 'period must be hour or day'}, status=400)
+    if group not in ('variant', 'product', 'total'):
+        return Response({'error': 'group must be variant, product or total'}, status=400)
+    try:
+        since, until = parse_range(request.GET)
+        limit = max(1, min(int(request.GET.get('limit', 50)), 500))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    if group == 'total':
+        rows = in_range(SalesTotalRollup.objects.filter(period=period), since, until).order_by('period_start')
+        rows = rows.values('period_start', 'orders', 'units', 'revenue')[:limit]
+    elif group == 'variant':
+        rows = in_range(SalesRollup.objects.filter(period=period), since, until).values('product_variant_id', 'product_variant__name', 'product_id', 'product__name')
+        rows = rows.annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders')).order_by('-revenue')[:limit]
+    else:
+        rows = in_range(SalesRollup.objects.filter(period=period), since, until).values('product_id', 'product__name')
+        rows = rows.annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue')[:limit]
+
+    return Response({
+        'period': period,
+        'group': group,
+        'since': since,
+        'until': until,
+        'rows': [with_average_ticket(row) if 'orders' in row else row for row in rows],
+    }, status=200)
+
+
+# orders and revenue per hour of the day (UTC) over ?since=&until=, busiest first
+@query_budget(2)
+@api_view(['GET'])
+@jwt_required
+@admin_only
+@replica_reads()
+def peak_hours_report(request):
+    try:
+        since, until = parse_range(request.GET)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    hours = in_range(SalesTotalRollup.objects.filter(period=SalesRollup.HOUR), since, until)
+    hours = hours.annotate(hour=ExtractHour('period_start', tzinfo=dt_timezone.utc)).values('hour')
+    hours = hours.annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue')).order_by('-orders', 'hour')
+    return Response({'since': since, 'until': until, 'hours': [with_average_ticket(row) for row in hours]}, status=200)
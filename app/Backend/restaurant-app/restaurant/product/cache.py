@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from restaurant.middlewares.profiling import serializing
+from restaurant.utils.db_router import pin_to_primary, MAX_LAG_SECONDS
+from restaurant.utils.renderers import render_json, stream_json
+
+'''
+    Cache for the menu reads (get_products, variant_detail).
+
+    The catalog has a version counter that lives in Django's cache framework (shared by every worker
+    as long as CACHES points to a shared backend, the default LocMemCache is per process).
+    Every write to Product/ProductVariant/Image calls invalidate_menu() which bumps the version once the
+    transaction commits.
+
+    The already rendered json bytes of each response are kept in a per process LRU keyed by
+    (catalog version, endpoint, query params). A warm read is: 1 cache lookup for the version + 1 dict lookup,
+    no DB queries and no serialization.
+    Responses carry an ETag (version + hash of the body) and Last-Modified (time of the last bump),
+    clients that send If-None-Match/If-Modified-Since get a 304 without a body.
+
+    Bodies are written by utils/renderers.py (orjson), pages of MENU_STREAM_MIN_ROWS rows or more are streamed
+    in chunks instead and never cached (one of them would push dozens of normal pages out of the LRU), without an ETag.
+    Streaming saves the rendered copy of the body, not the rows: those are loaded whole, which is why get_products
+    caps ?limit= at MENU_MAX_PAGE_SIZE.
+
+    With read replicas (utils/db_router.py) a miss in the first DATABASE_REPLICA_MAX_LAG_SECONDS after a bump reads
+    from the primary, a lagging replica would otherwise get the old rows cached under the new version.
+'''
+
+VERSION_KEY = 'menu:version'
+MODIFIED_KEY = 'menu:modified'
+STREAM_MIN_ROWS = getattr(settings, 'MENU_STREAM_MIN_ROWS', 1000)
+
+
+def catalog_version():
+    # returns (version, last modified timestamp)
+    state = cache.get_many([VERSION_KEY, MODIFIED_KEY])
+    if VERSION_KEY not in state:
+        return _init_version()
+    return state[VERSION_KEY], state.get(MODIFIED_KEY, time.time())
+
+
+def _init_version():
+    # the counter starts from the current time so a cache restart never hands out a version
+    # (and so an ETag) that was already used for an older catalog.
+    now = time.time()
+    cache.add(VERSION_KEY, int(now * 1000), None)
+    cache.add(MODIFIED_KEY, now, None)
+    return cache.get(VERSION_KEY), cache.get(MODIFIED_KEY, now)
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError: # key missing (first write or evicted)
+        _init_version()
+        cache.incr(VERSION_KEY)
+    cache.set(MODIFIED_KEY, time.time(), None)
+
+
+def invalidate_menu():
+    # call after any write to the catalog, the bump waits for the transaction to commit
+    # so a reader can't cache the old rows under the new version.
+    transaction.on_commit(bump_catalog_version)
+
+
+class MenuCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, version, key):
+        with self.lock:
+            if version != self.version:
+                return None
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, version, key, entry):
+        with self.lock:
+            if self.version is None or version > self.version:
+                self.version = version # everything cached for an older catalog is dead, drop it at once
+                self.entries.clear()
+            elif version < self.version:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+            self.entries.clear()
+
+
+menu_cache = MenuCache(getattr(settings, 'MENU_CACHE_MAX_ENTRIES', 512))
+
+
+def cached_menu_response(request, namespace, build):
+    # build() returns (payload, status) and only runs on a miss, only 200s are cached.
+    version, modified = catalog_version()
+    key = (namespace, tuple(sorted((k, tuple(v)) for k, v in request.GET.lists())))
+
+    entry = menu_cache.get(version, key)
+    if entry is None:
+        if time.time() - modified < MAX_LAG_SECONDS:
+            pin_to_primary()
+        payload, status = build()
+        rows = payload.get('data') if status == 200 else None
+        if isinstance(rows, list) and len(rows) >= STREAM_MIN_ROWS:
+            return StreamingHttpResponse(stream_json(payload, 'data'), content_type='application/json')
+        with serializing(request):
+            body = render_json(payload)
+        etag = '"%s-%s"' % (version, hashlib.blake2b(body, digest_size=8).hexdigest())
+        entry = (status, body, etag)
+        if status == 200:
+            menu_cache.set(version, key, entry)
+
+    status, body, etag = entry
+    last_modified = http_date(modified)
+
+    if status == 200 and _not_modified(request, etag, modified):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, status=status, content_type='application/json')
+
+    if status == 200:
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Cache-Control'] = 'no-cache' # clients may keep it but must revalidate, which is a cheap 304
+    return response
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match: # If-None-Match wins over If-Modified-Since
+        etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+        return '*' in etags or etag in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(modified) <= if_modified_since
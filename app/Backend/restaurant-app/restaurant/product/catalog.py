@@ -0,0 +1,408 @@
+import codecs
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import connection, transaction
+from .models import Product, ProductVariant, Image
+from .cache import invalidate_menu
+from .search import reindex_variants
+
+'''
+    Bulk catalog import/export, one row per variant:
+        product, variant, price, stock, description, is_active, images
+    CSV with that header (images separated by "|"), or JSONL, one object per line (images as a list).
+    The export writes the same format, so an exported file can be edited and imported back.
+
+    Import is an upsert on (product name, variant name):
+        - missing products and variants are created, existing variants get the new price/stock/description/is_active
+        - images: when the row has an images field the variant's images are replaced by it, without it they are left alone
+        - optional fields that are missing or empty keep their current value (new variants: stock 0, active, no description)
+    The rows are read as a stream and written in batches of CATALOG_IMPORT_BATCH_SIZE, each batch is a few queries
+    (bulk_create, one executemany UPDATE) whatever its size, and the whole import is one transaction.
+    Invalid rows are skipped and reported with their line number, the valid ones are imported.
+
+    Batch changes (apply_variant_changes): price/stock/is_active of many variants by id, e.g. the evening sold out list,
+    in one transaction and one UPDATE statement, with a result per change.
+'''
+
+FIELDS = ['product', 'variant', 'price', 'stock', 'description', 'is_active', 'images']
+VARIANT_FIELDS = ['price', 'stock', 'description', 'is_active', 'is_available'] # what an import can change on a variant
+MAX_REPORTED_ERRORS = 1000
+TRUE = {'1', 'true', 'yes', 'y'}
+FALSE = {'0', 'false', 'no', 'n'}
+
+validate_url = URLValidator()
+
+
+class CatalogFormatError(Exception):
+    pass
+
+
+def detect_format(name=None, content_type=None, default='csv'):
+    name = (name or '').lower()
+    content_type = (content_type or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    return default
+
+
+# --- reading ---
+
+def read_rows(stream, fmt):
+    # yields (line number, dict) from a text stream or anything that iterates over utf-8 lines (a binary file,
+    # an upload, the request body), never loads the whole file
+    if not isinstance(stream, io.TextIOBase):
+        stream = decode_lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        try:
+            if not reader.fieldnames or not {'product', 'variant'} <= {name.strip() for name in reader.fieldnames}:
+                raise CatalogFormatError('CSV header must have at least product and variant columns')
+            for row in reader:
+                yield reader.line_num, {key.strip(): value for key, value in row.items() if key is not None}
+        except csv.Error as e:
+            raise CatalogFormatError(f'Invalid CSV at line {reader.line_num}: {e}')
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, None
+                continue
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise CatalogFormatError(f'Unknown format: {fmt}')
+
+
+def decode_lines(stream):
+    # a file that isn't utf-8 is the client's mistake (400), not a crash halfway through the import
+    try:
+        yield from codecs.iterdecode(stream, 'utf-8-sig')
+    except UnicodeDecodeError:
+        raise CatalogFormatError('The file is not valid UTF-8')
+
+
+def clean_row(row):
+    # returns the cleaned row, raises ValueError with what is wrong. Optional fields that are missing aren't in the result.
+    if row is None:
+        raise ValueError('Not a JSON object')
+    product = str(row.get('product') or '').strip()
+    variant = str(row.get('variant') or '').strip()
+    if not product or not variant:
+        raise ValueError('product and variant are required')
+    if len(product) > 100 or len(variant) > 100:
+        raise ValueError('product and variant names are at most 100 characters')
+    cleaned = {'product': product, 'variant': variant}
+
+    if not blank(row.get('price')):
+        cleaned['price'] = clean_price(row['price'])
+    if not blank(row.get('stock')):
+        cleaned['stock'] = clean_stock(row['stock'])
+    if not blank(row.get('description')):
+        cleaned['description'] = str(row['description']).strip()
+
+    if not blank(row.get('is_active')):
+        cleaned['is_active'] = clean_bool(row['is_active'], 'is_active')
+
+    if not blank(row.get('images')) or isinstance(row.get('images'), list):
+        images = row['images']
+        if isinstance(images, str):
+            images = [url.strip() for url in images.split('|') if url.strip()]
+        if not isinstance(images, list):
+            raise ValueError('images must be a list of URLs')
+        for url in images:
+            try:
+                validate_url(url)
+            except ValidationError:
+                raise ValueError(f'Invalid image URL: {url}')
+        cleaned['images'] = images
+    return cleaned
+
+
+def blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def clean_price(value):
+    try:
+        price = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'Invalid price: {value}')
+    if not price.is_finite() or price < 0 or price != price.quantize(Decimal('0.01')) or price >= Decimal('1e8'):
+        raise ValueError(f'Invalid price: {value}')
+    return price
+
+
+def clean_stock(value):
+    if isinstance(value, bool):
+        raise ValueError(f'Invalid stock: {value}')
+    try:
+        stock = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f'Invalid stock: {value}')
+    if stock < 0:
+        raise ValueError('stock can not be negative')
+    return stock
+
+
+def clean_bool(value, name):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in TRUE | FALSE:
+        return str(value).strip().lower() in TRUE
+    raise ValueError(f'Invalid {name}: {value}')
+
+
+# --- import ---
+
+def import_catalog(rows, dry_run=False, batch_size=None):
+    # rows: iterable of (line number, dict), e.g. read_rows(). Returns the summary (counts and errors).
+    batch_size = batch_size or getattr(settings, 'CATALOG_IMPORT_BATCH_SIZE', 500)
+    summary = {
+        'rows': 0,
+        'products_created': 0,
+        'variants_created': 0,
+        'variants_updated': 0,
+        'variants_unchanged': 0,
+        'images_created': 0,
+        'errors': [],
+        'error_count': 0,
+        'dry_run': dry_run,
+    }
+    touched = []
+
+    with transaction.atomic():
+        batch = {}
+        for line_number, row in rows:
+            summary['rows'] += 1
+            try:
+                cleaned = clean_row(row)
+            except ValueError as e:
+                report_error(summary, line_number, str(e))
+                continue
+            cleaned['line'] = line_number
+            batch[(cleaned['product'], cleaned['variant'])] = cleaned # the same variant twice: the last row wins
+            if len(batch) >= batch_size:
+                touched += write_batch(list(batch.values()), summary)
+                batch = {}
+        if batch:
+            touched += write_batch(list(batch.values()), summary)
+
+        if dry_run:
+            transaction.set_rollback(True)
+        elif touched:
+            reindex_variants(touched)
+            invalidate_menu()
+    return summary
+
+
+def write_batch(rows, summary):
+    # upserts one batch, returns the ids of the variants it touched (created, updated or their images replaced)
+    names = {row['product'] for row in rows}
+    products = dict(Product.objects.filter(name__in=names).values_list('name', 'id'))
+    for row in rows:
+        if row['product'] not in products and 'price' not in row: # checked before creating the product, not to create it for nothing
+            report_error(summary, row['line'], 'price is required for a new variant')
+    rows = [row for row in rows if row['product'] in products or 'price' in row]
+    missing = [Product(name=name) for name in {row['product'] for row in rows} if name not in products]
+    if missing:
+        Product.objects.bulk_create(missing)
+        products.update(Product.objects.filter(name__in=[product.name for product in missing]).values_list('name', 'id'))
+        summary['products_created'] += len(missing)
+
+    existing = {
+        (variant.product_id, variant.name): variant
+        for variant in ProductVariant.objects.filter(product_id__in=products.values(), name__in={row['variant'] for row in rows})
+    }
+    to_create, to_update, unchanged = [], [], []
+    for row in rows:
+        key = (products[row['product']], row['variant'])
+        variant = existing.get(key)
+        if variant is None:
+            if 'price' not in row:
+                report_error(summary, row['line'], 'price is required for a new variant')
+                continue
+            variant = ProductVariant(product_id=key[0], name=row['variant'], stock=0, is_active=True)
+            to_create.append(variant)
+        before = [getattr(variant, field) for field in VARIANT_FIELDS]
+        for field in ('price', 'stock', 'description', 'is_active'):
+            if field in row:
+                setattr(variant, field, row[field])
+        variant.is_available = variant.stock > 0
+        if variant.pk is not None:
+            # a menu reload mostly sends what is already there, only the variants that differ are written
+            (to_update if [getattr(variant, field) for field in VARIANT_FIELDS] != before else unchanged).append(variant)
+
+    ProductVariant.objects.bulk_create(to_create)
+    if to_create and to_create[0].pk is None: # backends that don't return ids from bulk inserts
+        ids = dict(
+            ((product_id, name), variant_id)
+            for product_id, name, variant_id in ProductVariant.objects.filter(
+                product_id__in={variant.product_id for variant in to_create}, name__in={variant.name for variant in to_create},
+            ).values_list('product_id', 'name', 'id')
+        )
+        for variant in to_create:
+            variant.pk = ids[(variant.product_id, variant.name)]
+    update_variants(to_update)
+    summary['variants_created'] += len(to_create)
+    summary['variants_updated'] += len(to_update)
+    summary['variants_unchanged'] += len(unchanged)
+
+    variants = {(variant.product_id, variant.name): variant for variant in to_create + to_update + unchanged}
+    with_images = {variants[key].pk: row['images'] for row in rows
+                   if 'images' in row and (key := (products[row['product']], row['variant'])) in variants}
+    current = {}
+    for variant_id, url in Image.objects.filter(product_variant_id__in=with_images).order_by('id').values_list('product_variant_id', 'url'):
+        current.setdefault(variant_id, []).append(url)
+    replaced = {variant_id: urls for variant_id, urls in with_images.items() if current.get(variant_id, []) != urls}
+    if replaced:
+        Image.objects.filter(product_variant_id__in=replaced).delete()
+        images = Image.objects.bulk_create([Image(product_variant_id=variant_id, url=url) for variant_id, urls in replaced.items() for url in urls])
+        summary['images_created'] += len(images)
+
+    return list(dict.fromkeys([variant.pk for variant in to_create + to_update] + list(replaced)))
+
+
+def apply_variant_changes(changes):
+    # changes: [{"variant_id": 1, "price": "9.50", "stock": 0, "is_active": false}, ...] any of the three fields.
+    # returns (results, updated variants), one result per change in the same order: updated, unchanged or error.
+    # Invalid changes are reported, the valid ones are applied.
+    results = [None] * len(changes)
+    cleaned = {} # index -> (variant_id, fields)
+    seen = set()
+    for index, change in enumerate(changes):
+        variant_id = change.get('variant_id') if isinstance(change, dict) else None
+        try:
+            if not isinstance(change, dict):
+                raise ValueError('Not an object')
+            unknown = set(change) - {'variant_id', 'price', 'stock', 'is_active'}
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+            try:
+                variant_id = int(variant_id)
+            except (TypeError, ValueError):
+                raise ValueError('variant_id is required')
+            if variant_id in seen:
+                raise ValueError('The same variant_id appears twice')
+            seen.add(variant_id)
+            fields = {}
+            if 'price' in change:
+                fields['price'] = clean_price(change['price'])
+            if 'stock' in change:
+                fields['stock'] = clean_stock(change['stock'])
+            if 'is_active' in change:
+                fields['is_active'] = clean_bool(change['is_active'], 'is_active')
+            if not fields:
+                raise ValueError('Nothing to change')
+            cleaned[index] = (variant_id, fields)
+        except ValueError as e:
+            results[index] = {'variant_id': variant_id, 'status': 'error', 'error': str(e)}
+
+    updated = []
+    with transaction.atomic():
+        # locked until the commit, an order taking stock meanwhile waits instead of being overwritten
+        variants = ProductVariant.objects.select_for_update().in_bulk([variant_id for variant_id, _ in cleaned.values()])
+        for index, (variant_id, fields) in cleaned.items():
+            variant = variants.get(variant_id)
+            if variant is None:
+                results[index] = {'variant_id': variant_id, 'status': 'error', 'error': 'Variant not found'}
+                continue
+            before = [getattr(variant, field) for field in VARIANT_FIELDS]
+            for field, value in fields.items():
+                setattr(variant, field, value)
+            variant.is_available = variant.stock > 0
+            if [getattr(variant, field) for field in VARIANT_FIELDS] == before:
+                results[index] = {'variant_id': variant_id, 'status': 'unchanged'}
+                continue
+            updated.append(variant)
+            results[index] = {
+                'variant_id': variant_id,
+                'status': 'updated',
+                'price': variant.price,
+                'stock': variant.stock,
+                'is_active': variant.is_active,
+                'is_available': variant.is_available,
+            }
+
+        if updated:
+            update_variants(updated)
+            reindex_variants([variant.id for variant in updated])
+            invalidate_menu()
+    return results, updated
+
+
+def update_variants(variants):
+    # same as bulk_update(variants, VARIANT_FIELDS) but bulk_update builds a CASE WHEN per field and row in python, for
+    # a big batch that costs far more than the database work. One prepared UPDATE run with executemany does the same writes.
+    if not variants:
+        return
+    quote = connection.ops.quote_name
+    fields = [ProductVariant._meta.get_field(name) for name in VARIANT_FIELDS]
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        quote(ProductVariant._meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in fields),
+        quote(ProductVariant._meta.pk.column),
+    )
+    params = [[field.get_db_prep_save(getattr(variant, field.attname), connection) for field in fields] + [variant.pk] for variant in variants]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def report_error(summary, line_number, error):
+    summary['error_count'] += 1
+    if len(summary['errors']) < MAX_REPORTED_ERRORS: # the count keeps going, the list stays small
+        summary['errors'].append({'line': line_number, 'error': error})
+
+
+# --- export ---
+
+def export_rows(chunk_size=500):
+    # yields one dict per variant, ordered by id, a chunk of variants and their images at a time
+    last_id = 0
+    while True:
+        variants = list(
+            ProductVariant.objects.filter(id__gt=last_id).order_by('id')
+            .values('id', 'product__name', 'name', 'price', 'stock', 'description', 'is_active')[:chunk_size]
+        )
+        if not variants:
+            return
+        images = {}
+        for variant_id, url in Image.objects.filter(product_variant_id__in=[variant['id'] for variant in variants]).order_by('id').values_list('product_variant_id', 'url'):
+            images.setdefault(variant_id, []).append(url)
+        for variant in variants:
+            yield {
+                'product': variant['product__name'],
+                'variant': variant['name'],
+                'price': str(variant['price']),
+                'stock': variant['stock'],
+                'description': variant['description'] or '',
+                'is_active': variant['is_active'],
+                'images': images.get(variant['id'], []),
+            }
+        last_id = variants[-1]['id']
+
+
+def export_lines(fmt):
+    # the export as text chunks (csv or jsonl), for StreamingHttpResponse or a file
+    if fmt == 'jsonl':
+        for row in export_rows():
+            yield json.dumps(row) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    for row in export_rows():
+        writer.writerow({**row, 'is_active': 'true' if row['is_active'] else 'false', 'images': '|'.join(row['images'])})
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
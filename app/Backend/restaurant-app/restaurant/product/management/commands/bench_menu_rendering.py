@@ -0,0 +1,119 @@
+import json
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+from django.views.decorators.http import require_safe
+from rest_framework.decorators import api_view
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from restaurant.utils.renderers import render_json, stream_json, stdlib_dumps
+
+'''
+    Micro-benchmark of the CPU spent per menu response, on generated pages (no database, no cache):
+        - drf response: @api_view + Response(payload), DRF negotiates the renderer and renders with JSONRenderer
+        - drf view: @api_view + JSONRenderer().render(payload), what get_products/variant_detail did before
+        - fast: plain django view + render_json (orjson), what they do now
+        - fast stdlib: the same without orjson (FAST_JSON_DUMPS = stdlib_dumps)
+        - fast streamed: stream_json, what pages of MENU_STREAM_MIN_ROWS rows or more get
+    usage: python manage.py bench_menu_rendering --rows 1,20,200,2000 --iterations 2000
+    Every path is checked to produce the same JSON as DRF before it is timed.
+'''
+
+class Command(BaseCommand):
+    help = 'CPU per menu response: DRF rendering vs the fast JSON path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='1,20,200,2000', help='variants per page, comma separated')
+        parser.add_argument('--iterations', type=int, default=1000, help='responses per path for the smallest page, fewer for bigger ones')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        factory = RequestFactory()
+
+        for rows in [int(size) for size in options['rows'].split(',')]:
+            payload = self.page(rng, rows)
+            paths = self.paths(payload)
+            expected = json.loads(paths['drf response'](factory.get('/products/', HTTP_ACCEPT='application/json')))
+            iterations = max(20, options['iterations'] * 20 // max(rows, 20))
+
+            self.stdout.write(f'{rows} rows ({iterations} responses per path)')
+            baseline = None
+            for name, respond in paths.items():
+                request = factory.get('/products/', HTTP_ACCEPT='application/json')
+                if json.loads(respond(request)) != expected:
+                    self.stdout.write(self.style.ERROR(f'  {name}: different JSON, skipped'))
+                    continue
+                cpu = self.cpu_per_response(respond, factory, iterations)
+                baseline = baseline or cpu
+                self.stdout.write(f'  {name:16} {cpu:10.1f} us cpu/response  x{baseline / cpu:5.2f}')
+
+    def paths(self, payload):
+        @api_view(['GET'])
+        def drf_response(request):
+            return Response(payload)
+
+        @api_view(['GET'])
+        def drf_view(request):
+            return HttpResponse(JSONRenderer().render(payload), content_type='application/json')
+
+        @require_safe
+        def fast(request):
+            return HttpResponse(render_json(payload), content_type='application/json')
+
+        @require_safe
+        def fast_stdlib(request):
+            return HttpResponse(stdlib_dumps(payload), content_type='application/json')
+
+        @require_safe
+        def fast_streamed(request):
+            return StreamingHttpResponse(stream_json(payload, 'data'), content_type='application/json')
+
+        def body(view):
+            def respond(request):
+                response = view(request)
+                if hasattr(response, 'render'):
+                    response.render()
+                return b''.join(response) if response.streaming else response.content
+            return respond
+
+        return {
+            'drf response': body(drf_response),
+            'drf view': body(drf_view),
+            'fast': body(fast),
+            'fast stdlib': body(fast_stdlib),
+            'fast streamed': body(fast_streamed),
+        }
+
+    def cpu_per_response(self, respond, factory, iterations):
+        requests = [factory.get('/products/', HTTP_ACCEPT='application/json') for _ in range(iterations)]
+        start = time.process_time_ns()
+        for request in requests:
+            respond(request)
+        return (time.process_time_ns() - start) / iterations / 1000
+
+    def page(self, rng, rows):
+        # same shape as build_products_page: pagination fields + serialize_variant rows
+        return {
+            'total': rows * 10,
+            'total_pages': 10,
+            'current_page': 1,
+            'data': [
+                {
+                    'id': i,
+                    'product_id': i // 10,
+                    'product_name': f'Product {i // 10}',
+                    'name': f'Variant {i} {rng.choice(["classic", "spicy", "vegan", "large"])}',
+                    'price': Decimal(rng.randint(450, 4500)) / 100,
+                    'stock': rng.randint(0, 500),
+                    'description': 'Fresh pasta layered with ragù, béchamel and parmigiano ' * rng.randint(0, 2),
+                    'is_active': True,
+                    'is_available': rng.random() > 0.1,
+                    'images': [f'https://img.example.com/{i}/{n}.jpg' for n in range(rng.randint(0, 3))],
+                }
+                for i in range(rows)
+            ],
+        }
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from restaurant.product.catalog import export_lines, detect_format
+
+'''
+    Writes the whole catalog in the import format, see product/catalog.py
+    usage: python manage.py export_catalog menu.csv
+           python manage.py export_catalog --format jsonl > menu.jsonl
+'''
+
+class Command(BaseCommand):
+    help = 'Export products, variants and images as CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='defaults to stdout')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        if not options['path']:
+            for chunk in export_lines(fmt):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['path'], 'w', encoding='utf-8', newline='') as out:
+            out.writelines(export_lines(fmt))
+        self.stdout.write(self.style.SUCCESS(f"Catalog exported to {options['path']}"))
@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from restaurant.product.catalog import read_rows, import_catalog, detect_format, CatalogFormatError
+from restaurant.user.models import AuditLog
+
+'''
+    Bulk catalog import from a CSV or JSONL file, see product/catalog.py for the format.
+    usage: python manage.py import_catalog menu.csv [--format jsonl] [--dry-run]
+'''
+
+class Command(BaseCommand):
+    help = 'Import (upsert) products, variants and images from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--dry-run', action='store_true', help='validate and report, save nothing')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        try:
+            with open(options['path'], 'rb') as stream:
+                summary = import_catalog(read_rows(stream, fmt), dry_run=options['dry_run'])
+        except (OSError, CatalogFormatError) as e:
+            raise CommandError(str(e))
+
+        if not options['dry_run']:
+            AuditLog.buffered.create(
+                action=(f"Catalog import: {summary['rows']} rows, {summary['variants_created']} variants created, "
+                        f"{summary['variants_updated']} updated, {summary['error_count']} errors"),
+                action_ip=None,
+            )
+        for error in summary.pop('errors'):
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(json.dumps(summary)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from restaurant.product.search import rebuild_index, get_backend
+from restaurant.product.cache import bump_catalog_version
+
+'''
+    Rebuilds the menu search index from scratch.
+    usage: python manage.py rebuild_search_index
+    Only needed after loading data behind the app's back (raw SQL, loaddata...), the views keep the index up to date.
+'''
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of the menu'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if not backend:
+            self.stdout.write(self.style.WARNING('This database backend has no search index, searches use icontains.'))
+            return
+
+        indexed = rebuild_index()
+        bump_catalog_version() # cached search results may be stale
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} active variants ({backend.__class__.__name__}).'))
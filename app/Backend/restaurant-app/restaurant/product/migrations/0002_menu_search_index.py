@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+# The search index is a backend specific side table (FTS5 on SQLite, tsvector + trigram on Postgres), see restaurant/product/search.py
+
+def create_search_index(apps, schema_editor):
+    from restaurant.product.search import create_index, rebuild_index
+    create_index(schema_editor.connection)
+    rebuild_index(schema_editor.connection) # picks up the variants that already exist
+
+def drop_search_index(apps, schema_editor):
+    from restaurant.product.search import drop_index
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:57
+
+from django.db import migrations, models
+
+
+def flag_sold_out(apps, schema_editor):
+    ProductVariant = apps.get_model('product', 'ProductVariant')
+    ProductVariant.objects.filter(stock__lte=0).update(is_available=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0002_menu_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='is_available',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(flag_sold_out, migrations.RunPython.noop),
+    ]
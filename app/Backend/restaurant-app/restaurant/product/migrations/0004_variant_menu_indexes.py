@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_variant_is_available'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['name', 'id'], name='variant_active_name'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['product', 'price'], name='variant_active_product_price'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['price'], name='variant_active_price'),
+        ),
+    ]
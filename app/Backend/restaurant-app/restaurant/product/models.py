@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 
 '''
     This is the product/food model, this is a base model for each plate,
@@ -22,9 +23,21 @@ class ProductVariant(models.Model):
     stock = models.IntegerField(default=0) 
     description = models.TextField(blank=True, null=True) 
     is_active = models.BooleanField(default=True) # if the variant is active or not, example if out of stock: False
+    is_available = models.BooleanField(default=True) # False while stock is 0 (sold out), maintained by order/stock.py, unlike is_active it comes back on restock
 
     class Meta:
         unique_together = ['product', 'name'] # A product can have many variants but the name of the variant should be unique for that product
+        # the menu (product/queries.py) only ever reads active variants, so the indexes are partial (WHERE is_active):
+        # smaller, and the only form SQLite matches, Django writes the filter as WHERE "is_active", not is_active = 1.
+        #   (name, id): the default page and the cursor pages, ORDER BY name, id (+ LIMIT) walks the index, no sort
+        #   (product, price): ?product_id= with ?min_price=/?max_price= (?product_id= alone has the unique (product, name))
+        #   (price): ?min_price=/?max_price= alone
+        # check them with `python manage.py explain_queries`
+        indexes = [
+            models.Index(fields=['name', 'id'], condition=Q(is_active=True), name='variant_active_name'),
+            models.Index(fields=['product', 'price'], condition=Q(is_active=True), name='variant_active_product_price'),
+            models.Index(fields=['price'], condition=Q(is_active=True), name='variant_active_price'),
+        ]
 
 class Image(models.Model):
     product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='images') # One to many relationship
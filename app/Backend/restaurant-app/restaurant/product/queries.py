@@ -0,0 +1,130 @@
+from django.db.models import Q
+from .models import ProductVariant, Image
+from .search import search_filter, order_by_relevance
+from restaurant.utils.cursor import encode_cursor, decode_cursor
+
+'''
+    Query layer for the menu/catalog.
+    Every read of variants goes through here so a page of the menu always costs the same
+    small, fixed number of queries no matter how many rows are on it:
+        1. the variants joined with their base Product (one SELECT with a JOIN)
+        2. the Image rows for every variant on the page (one SELECT ... WHERE product_variant_id IN (...))
+    (+1 COUNT when the caller asks for the total)
+
+    Two pagination modes:
+        - page/limit: OFFSET based, what the old clients use. Every page runs a COUNT and deep pages get slower.
+        - cursor: keyset based on (name, id), no OFFSET and no COUNT unless asked for.
+          WHERE (name, id) > (last_name, last_id) ORDER BY name, id LIMIT n, the cost is the same for page 1 and page 1000.
+
+    variant_name is a full text search (name, description and product name, prefix matches), see search.py.
+    order=relevance ranks the matches instead of sorting them by name.
+
+    Rows are read with .values() so we skip building model instances, the views only need plain dicts anyway.
+'''
+
+VARIANT_FIELDS = (
+    'id',
+    'product_id',
+    'product__name',
+    'name',
+    'price',
+    'stock',
+    'description',
+    'is_active',
+    'is_available',
+)
+
+
+def build_menu_query(filters):
+    # filters is a dict-like object (request.query_params works), same filters get_products always supported.
+    query = ProductVariant.objects.filter(is_active=True) # Base query: Only active variants should be shown.
+
+    product_id = filters.get('product_id')
+    variant_id = filters.get('variant_id')
+    min_price = filters.get('min_price')
+    max_price = filters.get('max_price')
+    variant_name = filters.get('variant_name')
+
+    if product_id:
+        query = query.filter(product_id=product_id)
+    if variant_id:
+        query = query.filter(id=variant_id)
+    if min_price:
+        query = query.filter(price__gte=min_price)
+    if max_price:
+        query = query.filter(price__lte=max_price)
+    if variant_name:
+        query = query.filter(search_filter(variant_name))
+
+    order = filters.get('order', 'asc')
+    if order == 'relevance':
+        if variant_name:
+            return order_by_relevance(query, variant_name)
+        return query.order_by('name', 'id') # nothing to rank without a search term
+    if order == 'asc':
+        return query.order_by('name', 'id') # id breaks ties so pages never overlap
+    return query.order_by('-name', '-id')
+
+
+def fetch_variants(query):
+    # query can be sliced already (pagination), it is evaluated exactly once here.
+    rows = list(query.values(*VARIANT_FIELDS))
+    images = images_for([row['id'] for row in rows])
+    return [serialize_variant(row, images.get(row['id'], [])) for row in rows]
+
+
+def fetch_variants_after(query, cursor, limit, order='asc'):
+    # keyset page: returns (rows, next_cursor), next_cursor is None on the last page.
+    # cursor is the opaque string from the previous page, empty/None for the first one. Raises ValueError if invalid.
+    if order == 'relevance':
+        raise ValueError('order=relevance does not support cursor pagination, use page/limit')
+    if cursor:
+        name, variant_id = decode_cursor(cursor, 2)
+        if not isinstance(name, str) or not isinstance(variant_id, int):
+            raise ValueError('Invalid cursor')
+        if order == 'asc':
+            query = query.filter(Q(name__gt=name) | Q(name=name, id__gt=variant_id))
+        else:
+            query = query.filter(Q(name__lt=name) | Q(name=name, id__lt=variant_id))
+
+    rows = fetch_variants(query[:limit + 1]) # one extra row tells us if there is a next page without a COUNT
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1]['name'], rows[-1]['id']])
+
+
+def fetch_variant(variant_id):
+    # single variant (active or not) with its images, None if it does not exist.
+    row = ProductVariant.objects.filter(id=variant_id).values(*VARIANT_FIELDS).first()
+    if not row:
+        return None
+    return serialize_variant(row, images_for([row['id']]).get(row['id'], []))
+
+
+def images_for(variant_ids):
+    # {variant_id: [url, url, ...]} for all the given variants in one query.
+    images = {}
+    if not variant_ids:
+        return images
+
+    rows = Image.objects.filter(product_variant_id__in=variant_ids).order_by('id').values_list('product_variant_id', 'url')
+    for variant_id, url in rows:
+        images.setdefault(variant_id, []).append(url)
+    return images
+
+
+def serialize_variant(row, images):
+    return {
+        'id': row['id'],
+        'product_id': row['product_id'],
+        'product_name': row['product__name'],
+        'name': row['name'],
+        'price': row['price'],
+        'stock': row['stock'],
+        'description': row['description'],
+        'is_active': row['is_active'],
+        'is_available': row['is_available'],
+        'images': images,
+    }
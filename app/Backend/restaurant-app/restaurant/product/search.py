@@ -0,0 +1,227 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Case, When, IntegerField
+from django.db.models.expressions import RawSQL
+from .models import Product, ProductVariant
+
+'''
+    Full text search over the menu: variant name, variant description and the base product name.
+    Replaces the old name__icontains scan, which could not use an index and only looked at the variant name.
+
+    The index is a side table holding one row per active variant:
+        - SQLite: an FTS5 virtual table (rowid = variant id), ranked with bm25().
+        - Postgres: a table with a weighted tsvector (GIN index) plus a trigram index for typos, ranked with ts_rank + similarity.
+        - any other backend: falls back to icontains over the three fields.
+
+    Queries are tokenized and every token is a prefix match, "lasa chee" finds "Lasagna with extra cheese".
+    Writes keep it up to date incrementally by calling reindex_variants()/reindex_product() in the same transaction as the change,
+    `python manage.py rebuild_search_index` rebuilds it from scratch.
+'''
+
+TABLE = 'product_menusearch'
+MAX_RANKED_RESULTS = getattr(settings, 'MENU_SEARCH_MAX_RESULTS', 500) # how many matches order=relevance ranks
+TOKEN_RE = re.compile(r'\w+')
+CHUNK_SIZE = 500 # ids per statement, stays far below the sqlite variable limit
+
+VARIANT_TABLE = ProductVariant._meta.db_table
+PRODUCT_TABLE = Product._meta.db_table
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class SQLiteSearchBackend:
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "name, description, product_name, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def delete(self, cursor, where, params):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN (SELECT v.id FROM {VARIANT_TABLE} v WHERE {where})', params)
+
+    def insert(self, cursor, where, params):
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, name, description, product_name) "
+            f"SELECT v.id, v.name, COALESCE(v.description, ''), p.name FROM {VARIANT_TABLE} v "
+            f"JOIN {PRODUCT_TABLE} p ON p.id = v.product_id WHERE v.is_active AND {where}",
+            params
+        )
+
+    def clear(self, cursor):
+        cursor.execute(f'DELETE FROM {TABLE}')
+
+    def match_sql(self, tokens):
+        # '"lasa"* "chee"*' every token must match (implicit AND) as a prefix, quotes keep FTS5 operators out of user input.
+        expression = ' '.join('"%s"*' % token.replace('"', '""') for token in tokens)
+        return f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', [expression]
+
+    def ranked_sql(self, tokens, limit, within=None):
+        sql, params = restrict(*self.match_sql(tokens), 'rowid', within)
+        # bm25 is "lower is better", weights: variant name 10, description 1, product name 5
+        return f'{sql} ORDER BY bm25({TABLE}, 10.0, 1.0, 5.0) LIMIT %s', params + [limit]
+
+
+class PostgresSearchBackend:
+    DOCUMENT = (
+        "setweight(to_tsvector('simple', v.name), 'A') || "
+        "setweight(to_tsvector('simple', p.name), 'B') || "
+        "setweight(to_tsvector('simple', COALESCE(v.description, '')), 'C')"
+    )
+    BODY = "lower(v.name || ' ' || p.name || ' ' || COALESCE(v.description, ''))"
+
+    def create(self, cursor):
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+            f'variant_id bigint PRIMARY KEY REFERENCES {VARIANT_TABLE} (id) ON DELETE CASCADE, '
+            'document tsvector NOT NULL, body text NOT NULL)'
+        )
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING gin (document)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_body_trgm ON {TABLE} USING gin (body gin_trgm_ops)')
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def delete(self, cursor, where, params):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE variant_id IN (SELECT v.id FROM {VARIANT_TABLE} v WHERE {where})', params)
+
+    def insert(self, cursor, where, params):
+        cursor.execute(
+            f'INSERT INTO {TABLE} (variant_id, document, body) '
+            f'SELECT v.id, {self.DOCUMENT}, {self.BODY} FROM {VARIANT_TABLE} v '
+            f'JOIN {PRODUCT_TABLE} p ON p.id = v.product_id WHERE v.is_active AND {where} '
+            'ON CONFLICT (variant_id) DO UPDATE SET document = EXCLUDED.document, body = EXCLUDED.body',
+            params
+        )
+
+    def clear(self, cursor):
+        cursor.execute(f'TRUNCATE {TABLE}')
+
+    def tsquery(self, tokens):
+        return ' & '.join(f'{token}:*' for token in tokens) # prefix match on every token
+
+    def match_sql(self, tokens):
+        # full text match, or close enough for the trigram index (typos: "lazagna")
+        return (
+            f"SELECT variant_id FROM {TABLE} WHERE (document @@ to_tsquery('simple', %s) OR body %% %s)",
+            [self.tsquery(tokens), ' '.join(tokens)]
+        )
+
+    def ranked_sql(self, tokens, limit, within=None):
+        sql, params = restrict(*self.match_sql(tokens), 'variant_id', within)
+        return (
+            f"{sql} ORDER BY ts_rank(document, to_tsquery('simple', %s)) + similarity(body, %s) DESC LIMIT %s",
+            params + [self.tsquery(tokens), ' '.join(tokens), limit]
+        )
+
+
+def restrict(sql, params, column, within):
+    # match_sql narrowed down to the ids of the queryset within (its filters run inside the ranking, before the LIMIT)
+    if within is None:
+        return sql, params
+    within_sql, within_params = within.order_by().values('id').query.sql_with_params()
+    return f'{sql} AND {column} IN ({within_sql})', params + list(within_params)
+
+
+def get_backend(conn=None):
+    vendor = (conn or connection).vendor
+    if vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    if vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return None
+
+
+# --- index maintenance ---
+
+def create_index(conn):
+    backend = get_backend(conn)
+    if backend:
+        with conn.cursor() as cursor:
+            backend.create(cursor)
+
+def drop_index(conn):
+    backend = get_backend(conn)
+    if backend:
+        with conn.cursor() as cursor:
+            backend.drop(cursor)
+
+def reindex_variants(variant_ids):
+    # call with the ids of every variant that was created, changed or disabled.
+    # inactive variants are dropped from the index, active ones are (re)inserted.
+    backend = get_backend()
+    if not backend:
+        return
+    variant_ids = list(variant_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(variant_ids), CHUNK_SIZE):
+            chunk = variant_ids[start:start + CHUNK_SIZE]
+            where = 'v.id IN (%s)' % ', '.join(['%s'] * len(chunk))
+            backend.delete(cursor, where, chunk)
+            backend.insert(cursor, where, chunk)
+
+def reindex_product(product_id):
+    # the product name is part of every variant document, a rename touches all of them.
+    backend = get_backend()
+    if not backend:
+        return
+    with connection.cursor() as cursor:
+        backend.delete(cursor, 'v.product_id = %s', [product_id])
+        backend.insert(cursor, 'v.product_id = %s', [product_id])
+
+def rebuild_index(conn=None):
+    # returns the number of indexed variants
+    conn = conn or connection
+    backend = get_backend(conn)
+    if not backend:
+        return 0
+    with conn.cursor() as cursor:
+        backend.create(cursor)
+        backend.clear(cursor)
+        backend.insert(cursor, '1 = 1', [])
+        cursor.execute(f'SELECT COUNT(*) FROM {TABLE}')
+        return cursor.fetchone()[0]
+
+
+# --- queries ---
+
+def search_filter(text):
+    # Q to narrow a ProductVariant queryset down to the variants matching text, the match runs as a subquery on the index.
+    tokens = tokenize(text)
+    if not tokens:
+        return Q(pk__in=[])
+
+    backend = get_backend()
+    if not backend:
+        condition = Q()
+        for token in tokens:
+            condition &= Q(name__icontains=token) | Q(description__icontains=token) | Q(product__name__icontains=token)
+        return condition
+
+    sql, params = backend.match_sql(tokens)
+    return Q(id__in=RawSQL(sql, params))
+
+def ranked_variant_ids(text, limit=MAX_RANKED_RESULTS, within=None):
+    # ids of the best matches, best first. within: a ProductVariant queryset, only its variants are ranked.
+    tokens = tokenize(text)
+    backend = get_backend()
+    if not tokens or not backend:
+        return []
+    sql, params = backend.ranked_sql(tokens, limit, within)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+def order_by_relevance(query, text):
+    # keeps only the MAX_RANKED_RESULTS best matches of query (its filters apply before the cut) and orders them by rank.
+    ids = ranked_variant_ids(text, MAX_RANKED_RESULTS, within=query)
+    if not ids:
+        return query.order_by('name', 'id')
+    rank = Case(*[When(id=variant_id, then=position) for position, variant_id in enumerate(ids)], output_field=IntegerField())
+    return query.filter(id__in=ids).order_by(rank, 'id')
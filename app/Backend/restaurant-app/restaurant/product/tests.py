@@ -0,0 +1,339 @@
+import datetime
+import decimal
+import json
+from unittest import mock
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.utils.http import http_date
+from restaurant.user.models import Role, User
+from restaurant.utils.auth_cache import user_cache
+from restaurant.utils.jwt_utils import create_access_token
+from restaurant.utils import renderers
+from restaurant.utils.testing import enforce_query_budgets
+from . import search
+from . import views
+from .cache import menu_cache, catalog_version
+from .models import Image, Product, ProductVariant
+
+
+def make_variant(name='Classic', product='Lasagna', price='10.00', stock=5, description=None):
+    product, _ = Product.objects.get_or_create(name=product)
+    return ProductVariant.objects.create(product=product, name=name, price=price, stock=stock, description=description)
+
+def auth(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {create_access_token(user.id, user.email)}'}
+
+
+class MenuTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        menu_cache.clear()
+        user_cache.clear()
+        self.admin = User.objects.create(first_name='Admin', email='boss@example.com', role=Role.objects.get_or_create(name='admin')[0])
+
+
+class MenuCacheTests(MenuTestCase):
+    def setUp(self):
+        super().setUp()
+        self.variant = make_variant()
+
+    def test_etag_revalidation_returns_304(self):
+        response = self.client.get('/products/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        self.assertEqual(self.client.get('/products/', HTTP_IF_NONE_MATCH='"0-stale"').status_code, 200)
+        self.assertEqual(self.client.get('/products/?min_price=50', HTTP_IF_NONE_MATCH=etag).status_code, 200) # other filters, other body
+
+    def test_last_modified_revalidation(self):
+        response = self.client.get(f'/products/{self.variant.id}/')
+        self.assertEqual(response.status_code, 200)
+        _, modified = catalog_version()
+        self.assertEqual(response['Last-Modified'], http_date(modified))
+
+        self.assertEqual(self.client.get(f'/products/{self.variant.id}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(f'/products/{self.variant.id}/', HTTP_IF_MODIFIED_SINCE=http_date(modified - 60)).status_code, 200)
+
+    def test_errors_are_not_cached_or_revalidated(self):
+        response = self.client.get('/products/999999/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+    def test_catalog_writes_invalidate_the_menu(self):
+        etag = self.client.get('/products/').headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/products/update-product/', {'product_id': self.variant.product_id, 'name': 'Lasagne'},
+                                       content_type='application/json', **auth(self.admin))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['data'][0]['product_name'], 'Lasagne')
+
+    def test_page_size_is_capped(self):
+        make_variant('Spinach')
+        make_variant('Bolognese')
+        with mock.patch.object(views, 'MAX_PAGE_SIZE', 2):
+            body = self.client.get('/products/?limit=100').json()
+            self.assertEqual((len(body['data']), body['total_pages']), (2, 2))
+            self.assertEqual(len(self.client.get('/products/?cursor=&limit=100').json()['data']), 2)
+        self.assertEqual(self.client.get('/products/?limit=0').json()['total_pages'], 3) # at least one row per page
+        self.assertEqual(self.client.get('/products/?limit=ten').status_code, 400)
+
+    @mock.patch('restaurant.product.cache.STREAM_MIN_ROWS', 2)
+    def test_big_pages_are_streamed_and_not_cached(self):
+        make_variant('Spinach')
+        response = self.client.get('/products/?limit=10')
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))['data']), 2)
+        self.assertIsNone(menu_cache.get(catalog_version()[0], ('products', (('limit', ('10',)),))))
+
+
+@override_settings(AUDIT_BUFFERED=False) # the create/disable views write audit rows
+class MenuSearchTests(MenuTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cheese = make_variant('Extra cheese', description='With a crust of parmesan', price='12.00')
+        self.veggie = make_variant('Veggie', description='Spinach and ricotta', price='9.00')
+        self.pepperoni = make_variant('Pepperoni', product='Pizza', description='Cheese and pepperoni', price='11.00')
+        search.rebuild_index()
+
+    def names(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()['data']]
+
+    def test_matches_name_description_and_product_name(self):
+        self.assertEqual(self.names('/products/?variant_name=cheese'), ['Extra cheese', 'Pepperoni'])
+        self.assertEqual(self.names('/products/?variant_name=ricotta'), ['Veggie'])
+        self.assertEqual(self.names('/products/?variant_name=lasagna'), ['Extra cheese', 'Veggie'])
+        self.assertEqual(self.names('/products/?variant_name=lasagna%20cheese'), ['Extra cheese']) # every word has to match
+        self.assertEqual(self.names('/products/?variant_name=sushi'), [])
+
+    def test_prefix_search(self):
+        self.assertEqual(self.names('/products/?variant_name=lasa%20chee'), ['Extra cheese'])
+        self.assertEqual(self.names('/products/?variant_name=parm'), ['Extra cheese'])
+
+    def test_relevance_ranks_name_matches_first(self):
+        self.assertEqual(self.names('/products/?variant_name=cheese&order=relevance'), ['Extra cheese', 'Pepperoni'])
+
+    @enforce_query_budgets
+    def test_relevance_search_stays_within_the_budget(self):
+        for query in ('variant_name=cheese&order=relevance', 'variant_name=cheese&cursor=', 'variant_name=cheese'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/products/?{query}').status_code, 200) # a miss
+
+    def test_filters_apply_before_the_ranking_cut(self):
+        # the best match (Extra cheese) is filtered out by price, the next one still fills the page
+        with mock.patch.object(search, 'MAX_RANKED_RESULTS', 1):
+            self.assertEqual(self.names('/products/?variant_name=cheese&order=relevance&max_price=11.50'), ['Pepperoni'])
+            self.assertEqual(self.names(f'/products/?variant_name=lasagna&order=relevance&product_id={self.veggie.product_id}&min_price=5&max_price=10'), ['Veggie'])
+
+    def test_writes_reindex_the_variants(self):
+        headers = auth(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/products/create-variant/', {'product_id': self.veggie.product_id, 'name': 'Bolognese', 'price': '10.50', 'description': 'Slow cooked ragu'},
+                             content_type='application/json', **headers)
+        self.assertEqual(self.names('/products/?variant_name=ragu'), ['Bolognese'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/products/update-product/', {'product_id': self.veggie.product_id, 'name': 'Cannelloni'}, content_type='application/json', **headers)
+        self.assertEqual(self.names('/products/?variant_name=cannel'), ['Bolognese', 'Extra cheese', 'Veggie'])
+        self.assertEqual(self.names('/products/?variant_name=lasagna'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/products/delete-variant/', {'variant_id': self.veggie.id}, content_type='application/json', **headers)
+        self.assertEqual(self.names('/products/?variant_name=ricotta'), [])
+
+
+CATALOG_CSV = """product,variant,price,stock,description,is_active,images
+Lasagna,Classic,10.50,4,The original,true,https://example.com/a.jpg|https://example.com/b.jpg
+Lasagna,Veggie,9.00,0,,true,
+Pizza,Margherita,8.00,10,"Tomato, mozzarella",false,
+"""
+
+
+@override_settings(AUDIT_BUFFERED=False)
+class CatalogImportTests(MenuTestCase):
+    def upload(self, body, content_type='text/csv', query=''):
+        response = self.client.post(f'/products/import/{query}', body, content_type=content_type, **auth(self.admin))
+        return response.status_code, response.json()
+
+    def export(self, fmt):
+        response = self.client.get(f'/products/export/?type={fmt}', **auth(self.admin))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_import_creates_the_catalog(self):
+        status, summary = self.upload(CATALOG_CSV)
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            {key: summary[key] for key in ('rows', 'products_created', 'variants_created', 'images_created', 'error_count')},
+            {'rows': 3, 'products_created': 2, 'variants_created': 3, 'images_created': 2, 'error_count': 0},
+        )
+        classic = ProductVariant.objects.get(name='Classic')
+        self.assertEqual((str(classic.price), classic.stock, classic.description, classic.is_available), ('10.50', 4, 'The original', True))
+        self.assertFalse(ProductVariant.objects.get(name='Veggie').is_available)
+        self.assertFalse(ProductVariant.objects.get(name='Margherita').is_active)
+        self.assertEqual(list(Image.objects.filter(product_variant=classic).values_list('url', flat=True)), ['https://example.com/a.jpg', 'https://example.com/b.jpg'])
+
+    def test_export_imports_back_unchanged(self):
+        self.upload(CATALOG_CSV)
+        for fmt, content_type in (('csv', 'text/csv'), ('jsonl', 'application/x-ndjson')):
+            exported = self.export(fmt)
+            status, summary = self.upload(exported, content_type)
+            self.assertEqual(status, 200)
+            self.assertEqual((summary['rows'], summary['variants_unchanged'], summary['variants_updated'], summary['images_created'], summary['error_count']), (3, 3, 0, 0, 0))
+            self.assertEqual(self.export(fmt), exported)
+
+    def test_image_only_changes_invalidate_the_menu(self):
+        self.upload(CATALOG_CSV)
+        etag = self.client.get('/products/?variant_name=classic').headers['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            status, summary = self.upload('product,variant,images\nLasagna,Classic,https://example.com/c.jpg\n')
+        self.assertEqual((status, summary['variants_unchanged'], summary['images_created']), (200, 1, 1))
+
+        response = self.client.get('/products/?variant_name=classic', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'][0]['images'], ['https://example.com/c.jpg'])
+
+    def test_every_invalid_row_is_reported_with_its_line(self):
+        status, summary = self.upload(
+            'product,variant,price,stock,images\n'
+            'Lasagna,Classic,10.00,2,\n'
+            'Lasagna,Nan,NaN,1,\n'
+            'Lasagna,Cheap,-1,1,\n'
+            'Lasagna,Half,1.005,1,\n'
+            'Lasagna,Minus,5,-3,\n'
+            ',Nameless,5,1,\n'
+            'Lasagna,Broken,5,1,not a url\n'
+            'Pizza,Unpriced,,1,\n'
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(summary['variants_created'], 1)
+        self.assertEqual(summary['error_count'], 7)
+        self.assertEqual([(error['line'], error['error']) for error in summary['errors']], [
+            (3, 'Invalid price: NaN'),
+            (4, 'Invalid price: -1'),
+            (5, 'Invalid price: 1.005'),
+            (6, 'stock can not be negative'),
+            (7, 'product and variant are required'),
+            (8, 'Invalid image URL: not a url'),
+            (9, 'price is required for a new variant'),
+        ])
+        self.assertFalse(Product.objects.filter(name='Pizza').exists())
+
+    def test_jsonl_lines_that_are_not_objects(self):
+        status, summary = self.upload('{"product": "Pizza", "variant": "Diavola", "price": 9, "images": []}\n[1, 2]\nnot json\n', 'application/x-ndjson')
+        self.assertEqual(status, 200)
+        self.assertEqual(summary['variants_created'], 1)
+        self.assertEqual([error['line'] for error in summary['errors']], [2, 3])
+
+    def test_dry_run_saves_nothing(self):
+        status, summary = self.upload(CATALOG_CSV, query='?dry_run=true')
+        self.assertEqual((status, summary['variants_created']), (200, 3))
+        self.assertFalse(ProductVariant.objects.exists())
+
+    def test_unreadable_files_are_rejected(self):
+        status, body = self.upload(b'product,variant,price\nLasagna,Caf\xe9,5\n')
+        self.assertEqual((status, body), (400, {'error': 'The file is not valid UTF-8'}))
+        self.assertEqual(self.upload('name,price\nLasagna,5\n')[0], 400)
+        self.assertFalse(ProductVariant.objects.exists())
+
+
+@override_settings(AUDIT_BUFFERED=False)
+class BatchUpdateTests(MenuTestCase):
+    def setUp(self):
+        super().setUp()
+        self.classic = make_variant('Classic', stock=5)
+        self.veggie = make_variant('Veggie', price='9.00', stock=2)
+
+    def post(self, body):
+        return self.client.post('/products/batch-update/', body, content_type='application/json', **auth(self.admin))
+
+    def test_every_change_gets_a_result(self):
+        response = self.post({'changes': [
+            {'variant_id': self.classic.id, 'price': '11.00', 'stock': 0},
+            {'variant_id': self.veggie.id, 'price': '9.00'},
+            {'variant_id': 999999, 'stock': 1},
+            {'variant_id': self.veggie.id, 'stock': 1},
+            {'variant_id': self.classic.id + self.veggie.id, 'colour': 'red'},
+            {'price': 'NaN'},
+            'not an object',
+        ]})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['updated'], body['unchanged'], body['error']), (1, 1, 5))
+        self.assertEqual([result['status'] for result in body['results']], ['updated', 'unchanged', 'error', 'error', 'error', 'error', 'error'])
+        self.assertEqual(body['results'][0], {'variant_id': self.classic.id, 'status': 'updated', 'price': 11.0, 'stock': 0, 'is_active': True, 'is_available': False})
+        self.assertEqual([result.get('error') for result in body['results'][2:4]], ['Variant not found', 'The same variant_id appears twice'])
+
+        self.classic.refresh_from_db()
+        self.assertEqual((str(self.classic.price), self.classic.stock, self.classic.is_available), ('11.00', 0, False))
+        self.assertEqual(ProductVariant.objects.get(id=self.veggie.id).stock, 2) # its second change was rejected
+
+    def test_changes_invalidate_the_menu(self):
+        etag = self.client.get('/products/').headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post({'changes': [{'variant_id': self.veggie.id, 'is_active': False}]})
+        response = self.client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['name'] for row in response.json()['data']], ['Classic'])
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.post({'changes': [{'variant_id': self.classic.id, 'price': '10.00'}]}) # unchanged, nothing to invalidate
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.client.get('/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_body_shape_is_validated(self):
+        for body in ([{'variant_id': self.classic.id, 'stock': 1}], {'changes': []}, {'changes': {'variant_id': 1}}, 'changes'):
+            self.assertEqual(self.post(body).status_code, 400)
+        self.assertEqual(self.post({'changes': [{'variant_id': self.classic.id, 'stock': 1}] * 501}).status_code, 400)
+
+
+class RenderJsonTests(TestCase):
+    payload = {
+        'price': decimal.Decimal('12.50'),
+        'when': datetime.datetime(2024, 9, 1, 20, 30, tzinfo=datetime.timezone.utc),
+        'name': 'Crème brûlée',
+        'data': [{'id': n, 'price': decimal.Decimal(n) / 4} for n in range(7)],
+    }
+
+    def setUp(self):
+        renderers._dumps = None
+        self.addCleanup(setattr, renderers, '_dumps', None)
+
+    def test_decimals_are_numbers_only_when_a_float_keeps_them(self):
+        for dumps in (renderers.orjson_dumps, renderers.stdlib_dumps):
+            with self.subTest(dumps=dumps.__name__):
+                encoded = json.loads(dumps({'short': decimal.Decimal('12345678901.25'), 'long': decimal.Decimal('1234567890123.456')}))
+                self.assertEqual(encoded, {'short': 12345678901.25, 'long': '1234567890123.456'}) # 14 and 17 characters
+                self.assertEqual(json.loads(dumps([decimal.Decimal('1E+400')])), ['1E+400']) # out of the float range
+
+    def test_nan_and_infinity_raise(self):
+        for dumps in (renderers.orjson_dumps, renderers.stdlib_dumps):
+            for value in ('NaN', 'Infinity', '-Infinity'):
+                with self.subTest(dumps=dumps.__name__, value=value), self.assertRaises(ValueError):
+                    dumps({'price': decimal.Decimal(value)})
+            with self.subTest(dumps=dumps.__name__), self.assertRaises(TypeError):
+                dumps({'not json': object()})
+
+    def test_stream_is_the_same_document(self):
+        for path in ('restaurant.utils.renderers.orjson_dumps', 'restaurant.utils.renderers.stdlib_dumps'):
+            with self.subTest(path=path), override_settings(FAST_JSON_DUMPS=path):
+                renderers._dumps = None
+                expected = json.loads(renderers.render_json(self.payload))
+                self.assertEqual(json.loads(b''.join(renderers.stream_json(self.payload, 'data', chunk_size=3))), expected)
+                self.assertEqual(json.loads(b''.join(renderers.stream_json({'data': []}, 'data'))), {'data': []})
+                self.assertEqual(expected['when'], '2024-09-01T20:30:00Z') # the way DRF writes it
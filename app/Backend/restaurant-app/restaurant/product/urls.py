@@ -2,5 +2,13 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
+   path('', views.get_products, name='get_products'),
+   path('<int:variant_id>/', views.variant_detail, name='variant_detail'),
    path('create-product/', views.create_product, name='create_product'),
+   path('update-product/', views.update_product, name='update_product'),
+   path('create-variant/', views.create_product_variant, name='create_product_variant'),
+   path('delete-variant/', views.delete_variant, name='delete_variant'),
+   path('batch-update/', views.batch_update_variants, name='batch_update_variants'),
+   path('import/', views.import_products, name='import_products'),
+   path('export/', views.export_products, name='export_products'),
 ]
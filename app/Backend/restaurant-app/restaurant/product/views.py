@@ -1,10 +1,19 @@
+from django.conf import settings
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from .models import Product, ProductVariant, Image
 from restaurant.user.models import AuditLog, User
 from restaurant.utils.jwt_utils import create_access_token, create_refresh_token, get_user_from_jwt, verify_refresh_token, verify_access_token, decode_access_token, decode_refresh_token
 from restaurant.middlewares.is_authenticated import jwt_required 
-from restaurant.middlewares import is_authenticated, is_admin, is_waiter
+from restaurant.middlewares.is_admin import admin_only
+from restaurant.middlewares.profiling import query_budget
+from restaurant.utils.db_router import replica_reads
+from .queries import build_menu_query, fetch_variants, fetch_variants_after, fetch_variant
+from .cache import cached_menu_response, invalidate_menu
+from .search import reindex_variants, reindex_product
+from .catalog import read_rows, import_catalog, export_lines, detect_format, apply_variant_changes, CatalogFormatError
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import require_safe
 from math import ceil
 
 '''
@@ -14,7 +23,7 @@ from math import ceil
 
 @api_view(['POST'])
 @jwt_required
-@is_admin
+@admin_only
 def create_product(request):
     data = request.data
     name = data.get('name') # base plate name, not the variant name
@@ -25,13 +34,14 @@ def create_product(request):
     
     try:
         product = Product.objects.create(name=name)
+        invalidate_menu()
         return Response({'success': 'Product created'}, status=201)
     except Exception as e:
         return Response({'error': str(e)}, status=400)
     
 @api_view(['PUT'])
 @jwt_required
-@is_admin
+@admin_only
 def update_product(request):
     data = request.data
     product_id = data.get('product_id')
@@ -51,19 +61,22 @@ def update_product(request):
     try:
         product.name = name
         product.save()
+        reindex_product(product.id)
+        invalidate_menu()
         return Response({'success': 'Product updated'}, status=200)
     except Exception as e:
         return Response({'error': str(e)}, status=400)
     
 @api_view(['POST'])
 @jwt_required
-@is_admin
+@admin_only
 def create_product_variant(request):
     data = request.data
     product_id = data.get('product_id')  # base plate id
     description = data.get('description')  # optional example: the best lasagna in town
     name = data.get('name')  # variant name, e.g., large pepperoni pizza
     price = data.get('price')
+    stock = data.get('stock', 0)  # optional, units that can be sold
     images = data.get('images')  # list of image URLs, array
 
     if not all([name, price]):
@@ -85,6 +98,8 @@ def create_product_variant(request):
             product=base_product,
             name=name,
             price=price,
+            stock=stock,
+            is_available=int(stock) > 0,
             description=description if description else None
         )
 
@@ -94,8 +109,10 @@ def create_product_variant(request):
                     product_variant=product_variant,
                     url=image_url
                 )
+        reindex_variants([product_variant.id])
+        invalidate_menu()
 
-        AuditLog.objects.create(
+        AuditLog.buffered.create(
             user=request.user,
             action=f"Product variant created: {name}",
             action_ip=request.META.get('REMOTE_ADDR'),
@@ -107,71 +124,65 @@ def create_product_variant(request):
 
     
 
+MAX_PAGE_SIZE = getattr(settings, 'MENU_MAX_PAGE_SIZE', 1000)
+
 # route in which a user can all all the variants, images and their base plate as 'categories'
 # this combines all filters as well, and pagination.
 # if no filters are provided, return all in a list of pagination.
 # this dynamically constrcuts the query based on the filters provided.
 # example URL : http://127.0.0.1:8000/products?product_id=1&variant_id=1&min_price=10&max_price=20&variant_name=pepperoni&order=asc
-@api_view(['GET'])
+# variant_name is a full text search over variant name, description and product name, order=relevance ranks the matches.
+# cursor pagination: send cursor= (empty for the first page) and then the next_cursor of each response,
+# example URL : http://127.0.0.1:8000/products?cursor=&limit=20&include_total=true
+# plain django view, no DRF request/negotiation: the menu is always json, written by utils/renderers.py
+# limit is capped at MENU_MAX_PAGE_SIZE, a page is built in memory before it is written.
+@query_budget(4) # a miss: count + variants + images (+ the ranked ids with order=relevance), a hit: none
+@require_safe
+@replica_reads()
     # FOR NOW:
 def get_products(request):
-    data = request.query_params
-    page = int(data.get('page', 1))  # Default to page 1 if not provided
-    limit = int(data.get('limit', 5))  # Default to 5 items per page if not provided
-    product_id = data.get('product_id')
-    variant_id = data.get('variant_id')
-    min_price = data.get('min_price')
-    max_price = data.get('max_price')
-    variant_name = data.get('variant_name')
-    order = data.get('order', 'asc')  
-
-    # Base query: Only active variants should be shown.
-    query = ProductVariant.objects.filter(is_active=True)
-
-
-    if product_id:
-        query = query.filter(product_id=product_id)
-    if variant_id:
-        query = query.filter(id=variant_id)
-    if min_price:
-        query = query.filter(price__gte=min_price)
-    if max_price:
-        query = query.filter(price__lte=max_price)
-    if variant_name:
-        query = query.filter(name__icontains=variant_name)
-
-
-    if order == 'asc':
-        query = query.order_by('name')
-    else:
-        query = query.order_by('-name')
+    # the whole response is cached per filter set until the catalog changes, see cache.py
+    return cached_menu_response(request, 'products', lambda: build_products_page(request.GET))
 
+def build_products_page(data):
+    try:
+        page = max(int(data.get('page', 1)), 1)  # Default to page 1 if not provided
+        limit = max(1, min(int(data.get('limit', 5)), MAX_PAGE_SIZE))  # Default to 5 items per page if not provided
+    except ValueError:
+        return {'error': 'page and limit must be integers'}, 400
+
+    # Base query + filters (product_id, variant_id, min_price, max_price, variant_name, order), see queries.py
+    query = build_menu_query(data)
+
+    if 'cursor' in data: # keyset pagination, the total is only computed if the client asks for it.
+        try:
+            variants, next_cursor = fetch_variants_after(query, data.get('cursor'), limit, data.get('order', 'asc'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        response_data = {
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None,
+            'data': variants
+        }
+        if data.get('include_total', '').lower() in ['1', 'true']:
+            response_data['total'] = query.count()
+        return response_data, 200
 
     total = query.count()
     total_pages = ceil(total / limit)
     offset = (page - 1) * limit
-    query = query[offset:offset + limit]
 
-
-    data = [{
-        'id': variant.id,
-        'product_id': variant.product.id,
-        'product_name': variant.product.name,
-        'name': variant.name,
-        'price': variant.price,
-        'stock': variant.stock,
-        'description': variant.description,
-        'is_active': variant.is_active,
-        'images': [image.url for image in variant.images.all()]
-    } for variant in query]
+    # one query for the variants (joined with their base product) and one for all of their images.
+    data = fetch_variants(query[offset:offset + limit])
 
     # Response structure with pagination info
-    return Response({
+    return {
         'total': total,
         'total_pages': total_pages,
         'current_page': page,
         'data': data
-    }, status=200)
+    }, 200
 
 
 
@@ -179,7 +190,7 @@ def get_products(request):
 
 @api_view(['DELETE']) 
 @jwt_required
-@is_admin
+@admin_only
 def delete_variant(request):
     data = request.data
     variant_id = data.get('variant_id')
@@ -195,9 +206,12 @@ def delete_variant(request):
         return Response({'error': 'Variant already disabled'}, status=400)
     
     try:
-        variant.is_active = True # soft delete
+        variant.is_active = False # soft delete
+        variant.save(update_fields=['is_active'])
+        reindex_variants([variant.id])
+        invalidate_menu()
 
-        AuditLog.objects.create(
+        AuditLog.buffered.create(
             user=request.user,
             action=f"Product variant disabled: {variant.name}",
             action_ip=request.META.get('REMOTE_ADDR'),
@@ -208,28 +222,97 @@ def delete_variant(request):
         return Response({'error': str(e)}, status=400)
     
 
-@api_view(['GET'])
+@query_budget(2)
+@require_safe
+@replica_reads()
 def variant_detail(request, variant_id):
-    variant = ProductVariant.objects.filter(id=variant_id).first()
+    return cached_menu_response(request, f'variant:{variant_id}', lambda: build_variant_detail(variant_id))
+
+def build_variant_detail(variant_id):
+    variant = fetch_variant(variant_id)
     if not variant:
-        return Response({'error': 'Variant not found'}, status=404)
+        return {'error': 'Variant not found'}, 404
     
-    if variant.is_active == False:
-        return Response({'error': 'Variant is disabled'}, status=400)
-    
-    images = []
-    for image in variant.images.all():
-        images.append(image.url)
-    
-    return Response({
-        'id': variant.id,
-        'product_id': variant.product.id,
-        'product_name': variant.product.name,
-        'name': variant.name,
-        'price': variant.price,
-        'stock': variant.stock,
-        'description': variant.description,
-        'is_active': variant.is_active,
-        'images': images
-    }, status=200)
+    if variant['is_active'] == False:
+        return {'error': 'Variant is disabled'}, 400
+    
+    return variant, 200
+
 
+MAX_BATCH_CHANGES = 500
+
+# many variant changes in one request, one transaction and one UPDATE.
+# body: {"changes": [{"variant_id": 1, "price": "9.50"}, {"variant_id": 2, "stock": 0}, {"variant_id": 3, "is_active": false}]}
+# every change gets a result (updated / unchanged / error), the valid ones are applied even if others fail.
+@api_view(['POST'])
+@jwt_required
+@admin_only
+def batch_update_variants(request):
+    if not isinstance(request.data, dict): # e.g. the list of changes without the {"changes": ...} around it
+        return Response({'error': 'Body must be an object with a changes list'}, status=400)
+    changes = request.data.get('changes')
+    if not isinstance(changes, list) or not changes:
+        return Response({'error': 'changes must be a non empty list'}, status=400)
+    if len(changes) > MAX_BATCH_CHANGES:
+        return Response({'error': f'At most {MAX_BATCH_CHANGES} changes per request'}, status=400)
+
+    results, updated = apply_variant_changes(changes)
+
+    if updated:
+        AuditLog.buffered.create(
+            user=request.user,
+            action=f"Product variants batch updated: {len(updated)}",
+            action_ip=request.META.get('REMOTE_ADDR'),
+        )
+    counts = {status: sum(1 for result in results if result['status'] == status) for status in ('updated', 'unchanged', 'error')}
+    return Response({**counts, 'results': results}, status=200)
+
+
+# bulk upsert of the catalog from a CSV or JSONL file, see catalog.py for the format.
+# multipart with a "file" field, or the file as the raw body (Content-Type: text/csv or application/x-ndjson).
+# ?type=csv|jsonl overrides the detection (?format= is taken by DRF), ?dry_run=true validates and reports without saving.
+@api_view(['POST'])
+@jwt_required
+@admin_only
+def import_products(request):
+    content_type = request.content_type or ''
+    if content_type.startswith('multipart/form-data'):
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'Missing file'}, status=400)
+        stream, name = upload, upload.name
+    else:
+        stream, name = request.stream, None
+    if stream is None:
+        return Response({'error': 'Missing file'}, status=400)
+
+    fmt = request.query_params.get('type') or detect_format(name, content_type)
+    dry_run = request.query_params.get('dry_run', '').lower() in ['1', 'true']
+    try:
+        summary = import_catalog(read_rows(stream, fmt), dry_run=dry_run)
+    except CatalogFormatError as e:
+        return Response({'error': str(e)}, status=400)
+
+    if not dry_run:
+        AuditLog.buffered.create(
+            user=request.user,
+            action=(f"Catalog import: {summary['rows']} rows, {summary['variants_created']} variants created, "
+                    f"{summary['variants_updated']} updated, {summary['error_count']} errors"),
+            action_ip=request.META.get('REMOTE_ADDR'),
+        )
+    return Response(summary, status=200)
+
+
+# the whole catalog in the import format, streamed. ?type=csv (default) or jsonl
+@api_view(['GET'])
+@jwt_required
+@admin_only
+def export_products(request):
+    fmt = request.query_params.get('type', 'csv')
+    if fmt not in ['csv', 'jsonl']:
+        return Response({'error': 'type must be csv or jsonl'}, status=400)
+
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_lines(fmt), content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="catalog.{fmt}"'
+    return response
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from restaurant.utils.db_profiles import load_databases, replica_aliases
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,10 +43,15 @@ INSTALLED_APPS = [
     'restaurant',
     'restaurant.user',  
     'restaurant.product', # add more apps as you create them
+    'restaurant.order',
+    'restaurant.waiter',
+    'restaurant.table',
     'rest_framework',  
 ]
 
 MIDDLEWARE = [
+    'restaurant.middlewares.profiling.ProfilingMiddleware', # first, so it measures everything below it
+    'restaurant.middlewares.db_routing.DatabaseRoutingMiddleware', # read your writes with DATABASE_REPLICAS
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,23 +85,11 @@ WSGI_APPLICATION = 'restaurant.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
-
-'''DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'restaurant',
-        'USER': 'postgres',      
-        'PASSWORD': '12241530',  
-        'HOST': 'localhost',          
-        'PORT': '5432',               
-    }
-}'''
+# Database profiles, DB_PROFILE=sqlite (default) | sqlite-default | sqlite-replicas | postgres | postgres-persistent | postgres-replicas, see restaurant/utils/db_profiles.py
+# the files are in config/database/, passwords and hosts come from the environment (DB_PASSWORD, DB_HOST...)
+DATABASE_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+DATABASE_PROFILE_DIR = Path(os.environ.get('DB_PROFILE_DIR', BASE_DIR.parent.parent.parent / 'config' / 'database'))
+DATABASES = load_databases(DATABASE_PROFILE, DATABASE_PROFILE_DIR, BASE_DIR)
 
 
 # Password validation
@@ -138,4 +133,73 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Menu cache, see restaurant/product/cache.py
+# the catalog version lives in the default cache, use a shared backend (memcached/redis) when running more than one worker.
+MENU_CACHE_MAX_ENTRIES = 512 # rendered menu responses kept in memory per process (LRU)
+MENU_SEARCH_MAX_RESULTS = 500 # matches ranked by get_products?order=relevance, see restaurant/product/search.py
+CATALOG_IMPORT_BATCH_SIZE = 500 # rows per bulk_create/bulk_update of a catalog import, see restaurant/product/catalog.py
+MENU_STREAM_MIN_ROWS = 1000 # menu pages with this many rows or more are streamed instead of cached
+MENU_MAX_PAGE_SIZE = 1000 # largest ?limit= of get_products, the rows of a page are all loaded before it is written
+
+# JSON writer of the menu endpoints, see restaurant/utils/renderers.py
+FAST_JSON_DUMPS = 'restaurant.utils.renderers.orjson_dumps' # or 'restaurant.utils.renderers.stdlib_dumps' (no orjson)
+
+# jwt_required cache, see restaurant/utils/auth_cache.py
+AUTH_CACHE_MAX_ENTRIES = 10000 # per cache (claims and users), LRU
+AUTH_CACHE_CLAIMS_TTL = 300 # seconds, a cached token never outlives its own exp
+AUTH_CACHE_USER_TTL = 60 # seconds, saves to User/Role invalidate earlier
+
+# Refresh token store (rotation, revocation), see restaurant/user/tokens.py
+REFRESH_REVOCATION_CACHE_MAX_ENTRIES = 10000 # revoked tokens remembered per process, LRU
+
+# Password hashing pool used by the async auth views, see restaurant/utils/hashing.py
+PASSWORD_HASHING_WORKERS = 4 # hashes running at the same time, ~ number of cores that can go to hashing
+PASSWORD_HASHING_MAX_QUEUE = 32 # hashes waiting for a worker, past this signup/login/change-password answer 503
+
+# AuditLog/LoginHistory buffered writer, see restaurant/user/audit.py
+AUDIT_BUFFERED = True # False = every row is inserted right away
+AUDIT_FLUSH_SIZE = 200 # rows, flush as soon as this many are waiting
+AUDIT_FLUSH_INTERVAL = 2.0 # seconds, flush at least this often
+AUDIT_MAX_PENDING = 10000 # rows in memory before the callers have to flush themselves (backpressure)
+AUDIT_SPOOL_DIR = BASE_DIR / 'var' / 'audit-spool' # rows not yet in the database, replayed after a crash
+AUDIT_SPOOL_FSYNC = False # True survives power loss too, at the cost of an fsync per row
+
+# AuditLog/LoginHistory retention, `python manage.py archive_logs` moves older months to gzip'd jsonl files, see restaurant/user/retention.py
+LOG_RETENTION_DAYS = {
+    'auditlog': 365,
+    'loginhistory': 90,
+}
+LOG_ARCHIVE_DIR = BASE_DIR / 'var' / 'log-archive'
+
+# Stock holds while a customer checks out, see restaurant/order/stock.py
+STOCK_RESERVATION_TTL = 600 # seconds, expired holds go back to stock
+
+# Live order feed for the waiters, see restaurant/waiter/feed.py
+ORDER_FEED_BROKER = 'restaurant.waiter.feed.InProcessBroker' # clients of this process only, swap for a shared broker with more workers
+ORDER_FEED_BACKLOG = 1000 # events kept for clients that reconnect
+ORDER_FEED_QUEUE_SIZE = 100 # events waiting for one client before it is disconnected
+ORDER_FEED_HEARTBEAT = 15 # seconds between keep-alive comments
+
+# Table reservations, see restaurant/table/services.py
+TABLE_RESERVATION_MAX_DURATION = 240 # minutes, also bounds the overlap queries
+
+# Request metrics (GET /metrics) and profiling, see restaurant/middlewares/profiling.py
+PROFILING_ENABLED = True # queries, SQL time, serialization time and latency per view
+PROFILING_ENFORCE_QUERY_BUDGETS = False # True = going over a view's @query_budget raises (tests, see restaurant/utils/testing.py)
+PROFILING_SLOW_REQUEST_SECONDS = 0.5 # counted in restaurant_slow_requests_total, and dumped when profiled
+PROFILING_SAMPLE_RATE = 0.0 # share of the requests run under cProfile, e.g. 0.01
+PROFILING_DUMP_DIR = BASE_DIR / 'var' / 'profiles' # .prof files of the slow profiled requests
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1'] # who can scrape /metrics, [] = anyone
+
+# API benchmark (`python manage.py bench_api`), see restaurant/benchmark/runner.py
+BENCH_RESULTS_DIR = BASE_DIR / 'var' / 'bench' # JSON results, one file per run
+
+# Read replicas, see restaurant/utils/db_router.py
+# jwt clients that just wrote are pinned to the primary through the default cache: with replicas CACHES must be shared
+# by every worker (memcached/redis), the default LocMemCache is per process (system check db_router.E001).
+DATABASE_ROUTERS = ['restaurant.utils.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICAS = replica_aliases(DATABASES) # aliases of the profile with "TEST": {"MIRROR": "default"}
+DATABASE_REPLICA_MAX_LAG_SECONDS = 5 # clients that wrote read from the primary that long
+DATABASE_REPLICA_RETRY_SECONDS = 30 # a replica that failed to connect is skipped that long
+
 #APPEND_SLASH = False # example.com/user/login instead of example.com/user/login/ this removes the slash "/" at the end of the url
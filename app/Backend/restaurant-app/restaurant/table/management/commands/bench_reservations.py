@@ -0,0 +1,117 @@
+import datetime
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from restaurant.table.models import Table, Reservation
+from restaurant.table.services import free_tables, book_any_table, overlapping, ReservationError
+
+'''
+    Benchmark of the availability query and of booking, on generated tables and reservations.
+    usage: python manage.py bench_reservations --reservations 20000 --tables 60 --queries 500
+    Everything runs in a transaction that is rolled back at the end, the database is left as it was.
+
+    Prints the timings of free_tables() (bounded overlap query) next to the same query without the
+    lower bound on starts_at (what a plain "starts before end and ends after start" filter costs), and the query plan.
+'''
+
+class Rollback(Exception):
+    pass
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+    return {'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'mean': statistics.fmean(samples)}
+
+
+def timed(fn, runs):
+    samples = []
+    for args in runs:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark table availability and booking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reservations', type=int, default=10000)
+        parser.add_argument('--tables', type=int, default=60)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--bookings', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def run(self, options):
+        first_day = (timezone.now() + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        start = time.perf_counter()
+        number = (Table.objects.order_by('-number').values_list('number', flat=True).first() or 0) + 1
+        tables = Table.objects.bulk_create([
+            Table(number=number + i, seats=self.random.choice([2, 2, 4, 4, 4, 6, 8])) for i in range(options['tables'])
+        ])
+        reservations = self.generate(tables, first_day, options['reservations'])
+        Reservation.objects.bulk_create(reservations, batch_size=1000)
+        days = (reservations[-1].starts_at - first_day).days + 1 if reservations else 1
+        self.stdout.write(f'{len(tables)} tables, {len(reservations)} reservations over {days} days, created in {time.perf_counter() - start:.2f}s')
+
+        slots = []
+        for _ in range(options['queries']):
+            slot_start = first_day + datetime.timedelta(days=self.random.randrange(days), hours=self.random.randint(11, 21), minutes=self.random.choice([0, 30]))
+            slots.append((slot_start, slot_start + datetime.timedelta(hours=2), self.random.choice([2, 4, 6])))
+
+        indexed = timed(lambda start, end, party: list(free_tables(start, end, party).values_list('id', flat=True)), slots)
+        unbounded = timed(lambda start, end, party: list(
+            Table.objects.filter(is_active=True, seats__gte=party)
+            .exclude(id__in=Reservation.objects.filter(status=Reservation.BOOKED, starts_at__lt=end, ends_at__gt=start).values('table_id'))
+            .values_list('id', flat=True)
+        ), slots)
+        self.report('availability (bounded overlap)', indexed)
+        self.report('availability (unbounded overlap)', unbounded)
+
+        slot_start, slot_end, _ = slots[0]
+        self.stdout.write('plan:\n' + overlapping(slot_start, slot_end).explain())
+
+        bookings = slots[:options['bookings']]
+        rejected = []
+        def book(start, end, party):
+            try:
+                book_any_table(start, end, party)
+            except ReservationError:
+                rejected.append(1)
+        self.report('book_any_table', timed(book, bookings))
+        self.stdout.write(f'{len(bookings) - len(rejected)} booked, {len(rejected)} rejected (full)')
+
+    def generate(self, tables, first_day, count):
+        # every table gets back to back sittings of 1 to 3 hours between 11:00 and 23:00, day after day
+        reservations = []
+        day = 0
+        while len(reservations) < count:
+            for table in tables:
+                moment = first_day + datetime.timedelta(days=day, hours=11)
+                closing = first_day + datetime.timedelta(days=day, hours=23)
+                while len(reservations) < count:
+                    moment += datetime.timedelta(minutes=self.random.choice([0, 0, 30, 60]))
+                    end = moment + datetime.timedelta(minutes=self.random.choice([60, 90, 120, 180]))
+                    if end > closing:
+                        break
+                    reservations.append(Reservation(table=table, party_size=min(table.seats, self.random.randint(1, 8)), starts_at=moment, ends_at=end))
+                    moment = end
+            day += 1
+        return reservations
+
+    def report(self, name, stats):
+        self.stdout.write(f"{name:34} p50 {stats['p50']:7.3f}ms  p95 {stats['p95']:7.3f}ms  p99 {stats['p99']:7.3f}ms")
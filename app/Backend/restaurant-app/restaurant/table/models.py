@@ -0,0 +1,52 @@
+from django.db import models
+from django.db.models import Q
+from restaurant.user.models import User
+
+'''
+    Tables and their reservations.
+    A reservation holds one table from starts_at to ends_at, two booked reservations of the same table can't overlap:
+        a.starts_at < b.ends_at and b.starts_at < a.ends_at
+    see table/services.py for how that is checked and enforced.
+'''
+
+class Table(models.Model):
+    number = models.PositiveIntegerField(unique=True) # the number on the table
+    seats = models.PositiveSmallIntegerField()
+    is_active = models.BooleanField(default=True) # tables out of service can't be reserved
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True) # also bumped by every booking, see services.book_table
+
+    def __str__(self):
+        return f'Table {self.number} ({self.seats} seats)'
+
+
+class Reservation(models.Model):
+    BOOKED = 'booked'
+    COMPLETED = 'completed'
+    CANCELLED = 'cancelled'
+
+    table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='reservations') # table.reservations.all()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations') # null: booked by a waiter (walk in, phone)
+    party_size = models.PositiveSmallIntegerField()
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=[
+        (BOOKED, 'Booked'), # holds the table
+        (COMPLETED, 'Completed'), # the guests came and left, frees the table
+        (CANCELLED, 'Cancelled'), # frees the table
+    ], default=BOOKED)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # overlap queries only look at booked reservations, starting in a window of TABLE_RESERVATION_MAX_DURATION
+            models.Index(fields=['starts_at', 'ends_at'], condition=Q(status='booked'), name='reservation_booked_time'),
+            models.Index(fields=['table', 'starts_at'], condition=Q(status='booked'), name='reservation_booked_table'),
+            models.Index(fields=['user', 'starts_at'], name='reservation_user_time'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=Q(ends_at__gt=models.F('starts_at')), name='reservation_ends_after_start'),
+        ]
+
+    def __str__(self):
+        return f'Reservation {self.id} of table {self.table_id} {self.starts_at:%Y-%m-%d %H:%M} - {self.ends_at:%H:%M}'
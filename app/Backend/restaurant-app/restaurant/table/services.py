@@ -0,0 +1,87 @@
+import datetime
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Table, Reservation
+
+'''
+    Availability and booking.
+
+    Overlap query: a booked reservation [s, e) collides with [start, end) when s < end and e > start.
+    On its own "e > start" can't use an index well (every reservation that ends later matches), but no reservation
+    is longer than TABLE_RESERVATION_MAX_DURATION, so a colliding one also starts after start - max duration:
+        status = 'booked' AND starts_at > start - max AND starts_at < end AND ends_at > start
+    that is a range scan of the partial (starts_at, ends_at) index, a few hours of reservations whatever the size of the table.
+
+    Double booking: book_table bumps the table row (UPDATE tables SET updated_at = now WHERE id = x) before checking
+    for collisions, in the same transaction. The UPDATE locks the row on Postgres and takes the write lock on SQLite,
+    so two bookings of the same table run one after the other and the second one sees the first one's reservation.
+'''
+
+class ReservationError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_duration():
+    return datetime.timedelta(minutes=getattr(settings, 'TABLE_RESERVATION_MAX_DURATION', 240))
+
+
+def overlapping(start, end, reservations=None):
+    # booked reservations that collide with [start, end)
+    reservations = Reservation.objects.all() if reservations is None else reservations
+    return reservations.filter(
+        status=Reservation.BOOKED,
+        starts_at__gt=start - max_duration(),
+        starts_at__lt=end,
+        ends_at__gt=start,
+    )
+
+
+def free_tables(start, end, party_size=1):
+    # active tables with enough seats and no booked reservation in [start, end), smallest first. One query.
+    busy = overlapping(start, end).values('table_id')
+    return Table.objects.filter(is_active=True, seats__gte=party_size).exclude(id__in=busy).order_by('seats', 'number')
+
+
+def validate_slot(start, end, party_size):
+    if end <= start:
+        raise ReservationError('ends_at must be after starts_at')
+    if end - start > max_duration():
+        raise ReservationError(f'A reservation can last at most {int(max_duration().total_seconds() // 60)} minutes')
+    if start < timezone.now():
+        raise ReservationError('starts_at is in the past')
+    if party_size < 1:
+        raise ReservationError('party_size must be at least 1')
+
+
+def book_table(table_id, start, end, party_size, user=None):
+    # raises ReservationError (404 unknown table, 409 already booked)
+    with transaction.atomic():
+        # lock the table first, see the module docstring
+        if not Table.objects.filter(id=table_id, is_active=True, seats__gte=party_size).update(updated_at=timezone.now()):
+            raise ReservationError('Table not found or too small', status=404)
+        if overlapping(start, end).filter(table_id=table_id).exists():
+            raise ReservationError('Table is already booked at that time', status=409)
+        return Reservation.objects.create(table_id=table_id, user=user, party_size=party_size, starts_at=start, ends_at=end)
+
+
+def book_any_table(start, end, party_size, user=None):
+    # the smallest free table that fits, tries the next one if another booking took it meanwhile
+    for table_id in list(free_tables(start, end, party_size).values_list('id', flat=True)[:10]):
+        try:
+            return book_table(table_id, start, end, party_size, user=user)
+        except ReservationError as e:
+            if e.status != 409:
+                raise
+    raise ReservationError('No table available at that time', status=409)
+
+
+def set_reservation_status(reservation_id, status, user=None):
+    # booked -> completed / cancelled, one conditional UPDATE. user limits it to that user's reservations.
+    # returns False when the reservation doesn't exist (for that user) or isn't booked anymore.
+    reservations = Reservation.objects.filter(id=reservation_id, status=Reservation.BOOKED)
+    if user is not None:
+        reservations = reservations.filter(user=user)
+    return bool(reservations.update(status=status))
@@ -0,0 +1,97 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from restaurant.middlewares.profiling import QueryBudgetExceeded, QUERIES
+from restaurant.utils.testing import enforce_query_budgets
+from . import views
+from .models import Table, Reservation
+from .services import book_table, book_any_table, free_tables, ReservationError
+
+
+def slot(hours_from_now, hours=2):
+    start = (timezone.now() + timedelta(days=1)).replace(minute=0, second=0, microsecond=0) + timedelta(hours=hours_from_now)
+    return start, start + timedelta(hours=hours)
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.small = Table.objects.create(number=1, seats=2)
+        self.large = Table.objects.create(number=2, seats=6)
+
+    def test_overlapping_booking_is_rejected(self):
+        book_table(self.large.id, *slot(0), party_size=4)
+
+        with self.assertRaises(ReservationError) as error:
+            book_table(self.large.id, *slot(1), party_size=4)
+        self.assertEqual(error.exception.status, 409)
+        book_table(self.large.id, *slot(2), party_size=4) # starts when the first one ends
+
+    def test_free_tables_fit_the_party_and_skip_booked_ones(self):
+        start, end = slot(0)
+        self.assertEqual(list(free_tables(start, end, 2)), [self.small, self.large])
+        self.assertEqual(list(free_tables(start, end, 4)), [self.large])
+
+        book_any_table(start, end, 2)
+        self.assertEqual(list(free_tables(start, end, 2)), [self.large])
+        Reservation.objects.update(status=Reservation.CANCELLED)
+        self.assertEqual(list(free_tables(start, end, 2)), [self.small, self.large])
+
+
+@enforce_query_budgets
+class AvailabilityQueryBudgetTests(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, seats=4)
+        start, end = slot(0)
+        self.url = f"/tables/availability/?party_size=2&starts_at={start.isoformat().replace('+', '%2B')}&ends_at={end.isoformat().replace('+', '%2B')}"
+
+    def test_availability_stays_within_its_budget(self):
+        before = QUERIES.snapshot(view='table_availability')['count']
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['tables']), 1)
+        self.assertEqual(QUERIES.snapshot(view='table_availability')['count'], before + 1)
+
+    def test_going_over_the_budget_fails(self):
+        with mock.patch.object(views.availability, 'query_budget', 0):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(self.url)
+
+
+class DoubleBookingTests(TransactionTestCase):
+    WORKERS = 8
+
+    def test_parallel_bookings_of_one_table_book_it_once(self):
+        table = Table.objects.create(number=1, seats=4)
+        start, end = slot(0)
+        booked = []
+        rejected = []
+        barrier = threading.Barrier(self.WORKERS)
+
+        def worker():
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        booked.append(book_table(table.id, start, end, party_size=2))
+                    except ReservationError:
+                        rejected.append(1)
+                    except OperationalError: # sqlite: another worker holds the write lock, try again
+                        time.sleep(0.001)
+                        continue
+                    break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(booked), 1)
+        self.assertEqual(len(rejected), self.WORKERS - 1)
+        self.assertEqual(Reservation.objects.count(), 1)
@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('availability/', views.availability, name='table_availability'),
+    path('reserve/', views.reserve_table, name='reserve_table'),
+    path('reservations/', views.list_reservations, name='list_reservations'),
+    path('reservations/<int:reservation_id>/', views.update_reservation, name='update_reservation'),
+    path('create-table/', views.create_table, name='create_table'),
+]
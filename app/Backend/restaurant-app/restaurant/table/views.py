@@ -1,3 +1,16 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from restaurant.middlewares.is_authenticated import jwt_required
+from restaurant.middlewares.has_role import role_required, get_role_name
+from restaurant.middlewares.is_admin import admin_only
+from restaurant.middlewares.profiling import query_budget
+from restaurant.user.models import AuditLog
+from .models import Table, Reservation
+from .services import free_tables, book_table, book_any_table, set_reservation_status, validate_slot, ReservationError
 
 '''
     This would include of all of the resturant's tables logic.
@@ -5,4 +18,134 @@
     A waiter can see all reservations, a waiter can mark a reservation as "completed".
     An admin can do everything including: CRUD tables, CRUD reservations.
     A waiter can free up a table if needed.
-'''
\ No newline at end of file
+
+    Availability and double booking are handled in services.py.
+'''
+
+STAFF_ROLES = ('admin', 'waiter')
+
+
+def parse_moment(value, name):
+    # ISO 8601, naive means UTC
+    moment = parse_datetime(value) if value else None
+    if moment is None:
+        raise ReservationError(f'Invalid or missing {name}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+
+def parse_slot(data):
+    starts_at = parse_moment(data.get('starts_at'), 'starts_at')
+    ends_at = parse_moment(data.get('ends_at'), 'ends_at')
+    try:
+        party_size = int(data.get('party_size', 1))
+    except (TypeError, ValueError):
+        raise ReservationError('party_size must be a number')
+    validate_slot(starts_at, ends_at, party_size)
+    return starts_at, ends_at, party_size
+
+
+def serialize_reservation(reservation):
+    return {
+        'id': reservation.id,
+        'table_id': reservation.table_id,
+        'user_id': reservation.user_id,
+        'party_size': reservation.party_size,
+        'starts_at': reservation.starts_at,
+        'ends_at': reservation.ends_at,
+        'status': reservation.status,
+    }
+
+
+# which tables are free for a party in a slot, smallest table first.
+# example URL : http://127.0.0.1:8000/tables/availability/?party_size=4&starts_at=2024-09-01T19:00:00Z&ends_at=2024-09-01T21:00:00Z
+@query_budget(1)
+@api_view(['GET'])
+def availability(request):
+    try:
+        starts_at, ends_at, party_size = parse_slot(request.GET)
+    except ReservationError as e:
+        return Response({'error': str(e)}, status=e.status)
+
+    tables = list(free_tables(starts_at, ends_at, party_size).values('id', 'number', 'seats'))
+    return Response({'starts_at': starts_at, 'ends_at': ends_at, 'party_size': party_size, 'tables': tables}, status=200)
+
+
+# body: {"party_size": 4, "starts_at": "...", "ends_at": "...", "table_id": 3}, without table_id the smallest free table that fits is booked.
+@api_view(['POST'])
+@jwt_required
+def reserve_table(request):
+    data = request.data
+    try:
+        starts_at, ends_at, party_size = parse_slot(data)
+        table_id = data.get('table_id')
+        if table_id:
+            reservation = book_table(int(table_id), starts_at, ends_at, party_size, user=request.user)
+        else:
+            reservation = book_any_table(starts_at, ends_at, party_size, user=request.user)
+    except ReservationError as e:
+        return Response({'error': str(e)}, status=e.status)
+    except (TypeError, ValueError):
+        return Response({'error': 'table_id must be a number'}, status=400)
+
+    return Response({'success': 'Table reserved', 'reservation': serialize_reservation(reservation)}, status=201)
+
+
+# body: {"status": "cancelled"} (the user who booked it or staff) or {"status": "completed"} (staff)
+@api_view(['POST'])
+@jwt_required
+def update_reservation(request, reservation_id):
+    status = request.data.get('status')
+    staff = get_role_name(request) in STAFF_ROLES
+    if status not in (Reservation.CANCELLED, Reservation.COMPLETED):
+        return Response({'error': 'status must be cancelled or completed'}, status=400)
+    if status == Reservation.COMPLETED and not staff:
+        return Response({'error': 'Unauthorized access'}, status=403)
+
+    if not set_reservation_status(reservation_id, status, user=None if staff else request.user):
+        return Response({'error': 'Reservation not found or no longer booked'}, status=404)
+    return Response({'success': f'Reservation {status}'}, status=200)
+
+
+# the reservations of one day, ?date=2024-09-01 (default today, UTC) and optional &status=booked
+@api_view(['GET'])
+@jwt_required
+@role_required(*STAFF_ROLES)
+def list_reservations(request):
+    day = parse_date(request.GET.get('date', '')) if request.GET.get('date') else timezone.now().date()
+    if day is None:
+        return Response({'error': 'Invalid date'}, status=400)
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+    reservations = Reservation.objects.filter(starts_at__gte=start, starts_at__lt=start + timedelta(days=1)).order_by('starts_at', 'table_id')
+    if request.GET.get('status'):
+        reservations = reservations.filter(status=request.GET['status'])
+    return Response({'date': day, 'reservations': [serialize_reservation(reservation) for reservation in reservations]}, status=200)
+
+
+# body: {"number": 12, "seats": 4}
+@api_view(['POST'])
+@jwt_required
+@admin_only
+def create_table(request):
+    try:
+        number = int(request.data.get('number'))
+        seats = int(request.data.get('seats'))
+    except (TypeError, ValueError):
+        return Response({'error': 'number and seats are required'}, status=400)
+    if seats < 1:
+        return Response({'error': 'seats must be at least 1'}, status=400)
+
+    try:
+        with transaction.atomic():
+            table = Table.objects.create(number=number, seats=seats)
+    except IntegrityError:
+        return Response({'error': 'Table number already exists'}, status=409)
+
+    AuditLog.buffered.create(
+        user=request.user,
+        action=f"Table created: {number}",
+        action_ip=request.META.get('REMOTE_ADDR'),
+    )
+    return Response({'success': 'Table created', 'table_id': table.id}, status=201)
@@ -16,9 +16,15 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from restaurant.utils.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('restaurant.user.urls')),  
+    path('products/', include('restaurant.product.urls')),
+    path('orders/', include('restaurant.order.urls')),
+    path('waiter/', include('restaurant.waiter.urls')),
+    path('tables/', include('restaurant.table.urls')),
+    path('metrics', metrics_view, name='metrics'), # Prometheus
 ]
 
@@ -0,0 +1,266 @@
+import atexit
+import datetime
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction, close_old_connections, IntegrityError
+from restaurant.utils.metrics import register_collector
+
+'''
+    Buffered writer for AuditLog and LoginHistory.
+
+    Instead of one INSERT per admin action/login on the request path (and under SQLite one more writer fighting for the lock)
+    the rows are buffered in process and written with bulk_create by a background thread when either
+    AUDIT_FLUSH_SIZE rows are waiting or AUDIT_FLUSH_INTERVAL seconds went by.
+
+    usage, same as objects.create but returns nothing:
+        AuditLog.buffered.create(user=request.user, action='Plate created', action_ip=ip)
+        await LoginHistory.buffered.acreate(...) # async views: the spool write, a backpressure flush or the write
+                                                 # through (AUDIT_BUFFERED = False) run in a thread, not on the event loop
+
+    - durability: every row is appended to a local spool file (one json line) before it is buffered, the spool is emptied
+      after the rows are in the database. A process that dies with rows in memory leaves its spool behind and the next
+      process picks it up (at least once, a crash right after a flush can write a row twice).
+    - backpressure: when AUDIT_MAX_PENDING rows are waiting the caller flushes them itself before adding more,
+      so memory stays bounded if the database is slow.
+    - metrics: audit_writer().stats()
+
+    AUDIT_BUFFERED = False writes straight through (tests that read the rows back use it with override_settings).
+'''
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class AuditWriter:
+    def __init__(self, spool_dir):
+        self.pending = [] # [{'model': 'user.auditlog', 'fields': {...}}]
+        self.lock = threading.Lock() # pending + spool file
+        self.flush_lock = threading.Lock() # one flush at a time
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.spool_dir = Path(spool_dir)
+        self.spool_path = self.spool_dir / f'audit-{os.getpid()}.jsonl'
+        self.counters = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'backpressure_flushes': 0,
+            'recovered': 0,
+        }
+        self.last_flush_seconds = 0.0
+        self.recover()
+
+    # --- producer side ---
+
+    def enqueue(self, model, fields):
+        record = {'model': model._meta.label_lower, 'fields': self.snapshot(model, fields)}
+        line = json.dumps(record, default=str) + '\n'
+
+        if len(self.pending) >= _setting('AUDIT_MAX_PENDING', 10000):
+            self.counters['backpressure_flushes'] += 1
+            self.flush()
+
+        with self.lock:
+            with open(self.spool_path, 'a') as spool:
+                spool.write(line)
+                if _setting('AUDIT_SPOOL_FSYNC', False):
+                    spool.flush()
+                    os.fsync(spool.fileno())
+            self.pending.append(record)
+            self.counters['enqueued'] += 1
+            full = len(self.pending) >= _setting('AUDIT_FLUSH_SIZE', 200)
+
+        self.start()
+        if full:
+            self.wakeup.set()
+
+    def snapshot(self, model, fields):
+        # plain json values, relations become ids and defaults (timestamps) are taken now, not at flush time.
+        data = {}
+        for name, value in fields.items():
+            field = model._meta.get_field(name)
+            if isinstance(value, models.Model):
+                data[field.attname] = value.pk
+            else:
+                data[field.attname] = _encode(value)
+        for field in model._meta.concrete_fields:
+            if not field.primary_key and field.attname not in data and field.has_default():
+                data[field.attname] = _encode(field.get_default())
+        return data
+
+    # --- consumer side ---
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, name='audit-writer', daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(_setting('AUDIT_FLUSH_INTERVAL', 2.0))
+            self.wakeup.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                pass # counted in failed_flushes, the rows stay pending for the next round
+
+    def flush(self):
+        # writes everything pending, returns how many rows were written.
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                written = self.write(batch)
+            except Exception:
+                with self.lock:
+                    self.pending[:0] = batch # keep the order, retry next time
+                self.counters['failed_flushes'] += 1
+                raise
+
+            with self.lock:
+                self.rewrite_spool()
+            self.counters['flushes'] += 1
+            self.counters['written'] += written
+            self.counters['dropped'] += len(batch) - written
+            self.last_flush_seconds = time.perf_counter() - start
+            return written
+
+    def write(self, batch):
+        by_model = {}
+        for record in batch:
+            model = apps.get_model(record['model'])
+            by_model.setdefault(model, []).append(self.build(model, record['fields']))
+
+        written = 0
+        for model, objs in by_model.items():
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(objs, batch_size=500)
+                written += len(objs)
+            except IntegrityError:
+                # e.g. the user was deleted meanwhile, don't let one bad row block the rest forever
+                for obj in objs:
+                    try:
+                        with transaction.atomic():
+                            obj.save(force_insert=True)
+                        written += 1
+                    except IntegrityError:
+                        pass
+        return written
+
+    def build(self, model, fields):
+        return model(**{name: model._meta.get_field(name).to_python(value) for name, value in fields.items()})
+
+    # --- spool ---
+
+    def rewrite_spool(self):
+        # called with self.lock held: what is in the spool is exactly what is still pending.
+        if not self.pending:
+            self.spool_path.unlink(missing_ok=True)
+            return
+        tmp_path = self.spool_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as spool:
+            spool.writelines(json.dumps(record, default=str) + '\n' for record in self.pending)
+        os.replace(tmp_path, self.spool_path)
+
+    def recover(self):
+        # adopt the spools of processes that are gone (crashed) and our own leftover from a previous run with the same pid.
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        for path in sorted(self.spool_dir.glob('audit-*.jsonl')):
+            try:
+                pid = int(path.stem.split('-', 1)[1])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _process_alive(pid):
+                continue
+            with open(path) as spool:
+                for line in spool:
+                    try:
+                        self.pending.append(json.loads(line))
+                        self.counters['recovered'] += 1
+                    except ValueError:
+                        pass # half written line from the crash
+            if path != self.spool_path:
+                path.unlink(missing_ok=True)
+        with self.lock:
+            self.rewrite_spool()
+        if self.pending:
+            self.start()
+
+    def stats(self):
+        return {
+            **self.counters,
+            'pending': len(self.pending),
+            'last_flush_seconds': round(self.last_flush_seconds, 4),
+        }
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def audit_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter(_setting('AUDIT_SPOOL_DIR', Path(settings.BASE_DIR) / 'var' / 'audit-spool'))
+                atexit.register(_flush_at_exit)
+    return _writer
+
+@register_collector
+def _writer_metrics():
+    if _writer is None:
+        return []
+    stats = _writer.stats()
+    return [
+        ('restaurant_audit_pending_rows', 'Audit/login rows waiting to be written', stats['pending'], None),
+        ('restaurant_audit_last_flush_seconds', 'Duration of the last audit flush', stats['last_flush_seconds'], None),
+    ]
+
+def _flush_at_exit():
+    try:
+        _writer.flush()
+    except Exception:
+        pass # the spool still has the rows
+
+
+class BufferedManager(models.Manager):
+    def create(self, **kwargs):
+        if not _setting('AUDIT_BUFFERED', True):
+            return super().create(**kwargs)
+        audit_writer().enqueue(self.model, kwargs)
+
+    async def acreate(self, **kwargs):
+        return await sync_to_async(self.create)(**kwargs)
@@ -0,0 +1,28 @@
+import hashlib
+from django.utils import timezone
+from .models import KnownDevice
+
+'''
+    Known devices of a user, used by login to detect logins from a new device (suspicious login).
+    A device is the (ip, user agent) pair of a login, see KnownDevice.
+'''
+
+def user_agent_hash(user_agent):
+    return hashlib.sha256((user_agent or '').encode()).hexdigest()
+
+async def is_new_device(user, ip, user_agent):
+    # records the login and tells if the device was never seen before for this user.
+    ip = ip or '0.0.0.0'
+    agent_hash = user_agent_hash(user_agent)
+    now = timezone.now()
+
+    # one statement on the unique index, bumps last_seen when the device is known.
+    seen = await KnownDevice.objects.filter(user=user, ip=ip, user_agent_hash=agent_hash).aupdate(last_seen=now)
+    if seen:
+        return False
+
+    await KnownDevice.objects.abulk_create(
+        [KnownDevice(user=user, ip=ip, user_agent_hash=agent_hash, first_seen=now, last_seen=now)],
+        ignore_conflicts=True, # two logins from the same new device at the same time
+    )
+    return True
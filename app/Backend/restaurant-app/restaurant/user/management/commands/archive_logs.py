@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from restaurant.user.retention import LOG_MODELS, archive_logs, retention_cutoff
+
+'''
+    Moves the AuditLog/LoginHistory months older than the retention period into gzip'd jsonl archives, see user/retention.py
+    usage: python manage.py archive_logs [--log auditlog] [--days 90] [--dry-run]
+    meant to run daily from cron, a run with nothing to archive is a couple of index lookups.
+'''
+
+class Command(BaseCommand):
+    help = 'Archive and delete old AuditLog/LoginHistory rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', choices=list(LOG_MODELS), action='append', help='only this log, repeatable (default: all)')
+        parser.add_argument('--days', type=int, help='override LOG_RETENTION_DAYS')
+        parser.add_argument('--archive-dir', help='override LOG_ARCHIVE_DIR')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='only show what would be archived')
+
+    def handle(self, *args, **options):
+        retention = getattr(settings, 'LOG_RETENTION_DAYS', {})
+        for name in options['log'] or list(LOG_MODELS):
+            days = options['days'] or retention.get(name, 365)
+            cutoff = retention_cutoff(days)
+            archived = 0
+            for month in archive_logs(name, cutoff, options['archive_dir'], options['batch_size'], options['dry_run']):
+                archived += month['rows']
+                self.stdout.write(f"{name} {month['month']}: {month['rows']} rows -> {month['path']}")
+            verb = 'would be archived' if options['dry_run'] else 'archived'
+            self.stdout.write(self.style.SUCCESS(f'{name}: {archived} rows older than {cutoff:%Y-%m-%d} {verb}'))
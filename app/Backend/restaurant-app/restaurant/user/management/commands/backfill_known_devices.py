@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min, Max
+from restaurant.user.models import LoginHistory, KnownDevice
+from restaurant.user.devices import user_agent_hash
+
+'''
+    Builds the KnownDevice table from the existing LoginHistory.
+    usage: python manage.py backfill_known_devices [--batch-size 1000]
+    Safe to run more than once, devices that already exist only get their last_seen moved forward.
+'''
+
+class Command(BaseCommand):
+    help = 'Fill KnownDevice from LoginHistory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # the grouping happens in the database, python only sees one row per (user, ip, user agent)
+        rows = (
+            LoginHistory.objects
+            .values('user_id', 'login_ip', 'user_agent')
+            .annotate(first_seen=Min('login_time'), last_seen=Max('login_time'))
+            .order_by()
+            .iterator(chunk_size=batch_size)
+        )
+
+        batch = {}
+        total = 0
+        for row in rows:
+            key = (row['user_id'], row['login_ip'] or '0.0.0.0', user_agent_hash(row['user_agent']))
+            if key in batch: # e.g. a NULL and an empty user agent hash the same
+                device = batch[key]
+                device.first_seen = min(device.first_seen, row['first_seen'])
+                device.last_seen = max(device.last_seen, row['last_seen'])
+                continue
+            batch[key] = KnownDevice(user_id=key[0], ip=key[1], user_agent_hash=key[2], first_seen=row['first_seen'], last_seen=row['last_seen'])
+            if len(batch) >= batch_size:
+                total += self.save(batch)
+
+        total += self.save(batch)
+        self.stdout.write(self.style.SUCCESS(f'{total} known devices written'))
+
+    def save(self, batch):
+        # new devices in one INSERT, known ones only when the backfill moves last_seen forward
+        # (an upsert would overwrite a more recent last_seen with the older one from the history)
+        with transaction.atomic():
+            KnownDevice.objects.bulk_create(batch.values(), ignore_conflicts=True)
+            for device in batch.values():
+                KnownDevice.objects.filter(
+                    user_id=device.user_id, ip=device.ip, user_agent_hash=device.user_agent_hash, last_seen__lt=device.last_seen,
+                ).update(last_seen=device.last_seen)
+        count = len(batch)
+        batch.clear()
+        return count
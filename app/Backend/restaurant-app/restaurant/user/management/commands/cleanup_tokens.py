@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from restaurant.user.tokens import delete_expired
+
+'''
+    Deletes the expired refresh tokens from the store (Token), see user/tokens.py
+    usage: python manage.py cleanup_tokens [--batch-size 1000] [--pause 0.05]
+    meant to run daily from cron, every batch is a range scan on the expires_at index + a DELETE by id.
+'''
+
+class Command(BaseCommand):
+    help = 'Delete expired refresh tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        deleted = delete_expired(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} expired refresh tokens deleted'))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_alter_loginhistory_login_ip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=255)),
+                ('action_time', models.DateTimeField(auto_now_add=True)),
+                ('action_ip', models.GenericIPAddressField(default='0.0.0.0', null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='audit_logs', to='user.user')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0005_auditlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+    ]
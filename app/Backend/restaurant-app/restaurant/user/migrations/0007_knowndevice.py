@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0006_user_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnownDevice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip', models.GenericIPAddressField(default='0.0.0.0')),
+                ('user_agent_hash', models.CharField(max_length=64)),
+                ('first_seen', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='known_devices', to='user.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'ip', 'user_agent_hash'), name='unique_known_device')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_knowndevice'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='loginhistory',
+            name='login_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
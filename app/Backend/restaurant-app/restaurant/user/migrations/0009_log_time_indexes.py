@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_buffered_log_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['user', 'action_time'], name='auditlog_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action_time'], name='auditlog_time'),
+        ),
+        migrations.AddIndex(
+            model_name='loginhistory',
+            index=models.Index(fields=['user', 'login_time'], name='loginhistory_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='loginhistory',
+            index=models.Index(fields=['login_time'], name='loginhistory_time'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_log_time_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['token'], name='token_token'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0010_token_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='token',
+            name='token_token',
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='revoked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='rotated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['expires_at'], name='token_expires'),
+        ),
+        migrations.AddConstraint(
+            model_name='token',
+            constraint=models.UniqueConstraint(fields=('token',), name='unique_token'),
+        ),
+    ]
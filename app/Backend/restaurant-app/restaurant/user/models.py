@@ -26,6 +26,8 @@ Along with a few default users of each role.
 from django.db import models
 from django.contrib.auth.hashers import make_password, check_password 
 from django.core.validators import EmailValidator 
+from django.utils import timezone
+from .audit import BufferedManager
 
 class Role(models.Model):
     name = models.CharField(max_length=50, unique=True)
@@ -39,6 +41,7 @@ class User(models.Model):
     email = models.EmailField(unique=True, validators=[EmailValidator()])
     password_hash = models.CharField(max_length=128)
     role = models.ForeignKey(Role, on_delete=models.SET_NULL, null=True, blank=True, related_name="users")
+    is_active = models.BooleanField(default=True) # False = deactivated/soft deleted, can't log in or use its tokens
 
     def set_password(self, password):
         self.password_hash = make_password(password)
@@ -64,27 +67,74 @@ class User(models.Model):
 class LoginHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_histories')
     login_ip = models.GenericIPAddressField(null=True, default='0.0.0.0')
-    login_time = models.DateTimeField(auto_now_add=True)
+    login_time = models.DateTimeField(default=timezone.now) # not auto_now_add, buffered rows keep the time of the login
     user_agent = models.CharField(max_length=255)
 
+    objects = models.Manager()
+    buffered = BufferedManager() # LoginHistory.buffered.create(...), written in batches, see audit.py
+
+    class Meta:
+        # (user, time): a user's history newest first is an index range scan, (time): retention moves old months out, see retention.py
+        indexes = [
+            models.Index(fields=['user', 'login_time'], name='loginhistory_user_time'),
+            models.Index(fields=['login_time'], name='loginhistory_time'),
+        ]
+
     def __str__(self):
         return f"LoginHistory of {self.user.email} at {self.login_time}"
     
+class KnownDevice(models.Model):
+    # every (ip, user agent) a user has logged in from, one row per device instead of one per login.
+    # "is this a new device?" is a single lookup on the unique index instead of a scan of the whole LoginHistory.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='known_devices')
+    ip = models.GenericIPAddressField(default='0.0.0.0')
+    user_agent_hash = models.CharField(max_length=64) # sha256 of the user agent, user agents can be longer than any sane index key
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ip', 'user_agent_hash'], name='unique_known_device'), # also the lookup index
+        ]
+
+    def __str__(self):
+        return f"KnownDevice of {self.user_id}: {self.ip}"
+
 class AuditLog(models.Model): 
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='audit_logs')  # user.audit_logs.all()
     action = models.CharField(max_length=255) # example: User created, User updated, User deleted, Plate created, Plate updated, Plate deleted
-    action_time = models.DateTimeField(auto_now_add=True)
+    action_time = models.DateTimeField(default=timezone.now) # not auto_now_add, buffered rows keep the time of the action
     action_ip = models.GenericIPAddressField(null=True, default='0.0.0.0') 
 
+    objects = models.Manager()
+    buffered = BufferedManager() # AuditLog.buffered.create(...), written in batches, see audit.py
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'action_time'], name='auditlog_user_time'),
+            models.Index(fields=['action_time'], name='auditlog_time'),
+        ]
+
     def __str__(self):
         return f"AuditLog: {self.action} by {self.user.email} at {self.action_time}"
 
 class Token(models.Model):
+    # the refresh token store, see tokens.py
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tokens')
-    token = models.CharField(max_length=255)
+    token = models.CharField(max_length=255) # sha256 of the token's jti, never the token itself
     token_type = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
+    revoked_at = models.DateTimeField(null=True, blank=True) # rotated, logged out or revoked with the other tokens of the user
+    rotated = models.BooleanField(default=False) # traded for a new one, using it again is a reuse
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['token'], name='unique_token'), # also the lookup index
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='token_expires'), # cleanup_tokens
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.token_type} token"
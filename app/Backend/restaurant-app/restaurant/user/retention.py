@@ -0,0 +1,100 @@
+import datetime
+import gzip
+import json
+import os
+from pathlib import Path
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from django.utils import timezone
+from .models import AuditLog, LoginHistory
+
+'''
+    Retention for the log tables (AuditLog, LoginHistory), so the hot tables only hold recent rows.
+
+    Rows are bucketed by calendar month (UTC) of their timestamp. Every month that is entirely older than the
+    retention period is moved out of the database into a gzip'd jsonl archive:
+        <LOG_ARCHIVE_DIR>/auditlog/2024-01.jsonl.gz
+    and then deleted in batches. Reading a month is a range scan on the (time) index.
+
+    The archive is written (and fsync'd) before any row is deleted. A run that died between two delete batches left
+    the month's file complete and some of its rows in the table: the next run keeps the file, appends only the rows
+    after the last id in it (rows arrive in id order) and deletes the rest, so no row is archived twice.
+
+    usage: python manage.py archive_logs (see the command for the options)
+'''
+
+LOG_MODELS = {
+    'auditlog': (AuditLog, 'action_time'),
+    'loginhistory': (LoginHistory, 'login_time'),
+}
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(moment):
+    return (moment + datetime.timedelta(days=32)).replace(day=1)
+
+def retention_cutoff(days, now=None):
+    # rows before this are archived, rounded down to a month boundary so only whole months leave the table.
+    now = now or timezone.now()
+    return month_start((now - datetime.timedelta(days=days)).astimezone(datetime.timezone.utc))
+
+
+def archive_logs(name, cutoff, archive_dir=None, batch_size=1000, dry_run=False):
+    # yields one dict per archived month: {'month': '2024-01', 'rows': 1234, 'path': ...}
+    model, time_field = LOG_MODELS[name]
+    archive_dir = Path(archive_dir or getattr(settings, 'LOG_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'var' / 'log-archive')) / name
+
+    old_rows = model.objects.filter(**{f'{time_field}__lt': cutoff})
+    oldest = old_rows.order_by(time_field).values_list(time_field, flat=True).first()
+    if oldest is None:
+        return
+
+    start = month_start(oldest.astimezone(datetime.timezone.utc))
+    while start < cutoff:
+        end = next_month(start)
+        bucket = model.objects.filter(**{f'{time_field}__gte': start, f'{time_field}__lt': end})
+        rows = bucket.aggregate(rows=Count('id'))['rows']
+        if rows:
+            path = archive_dir / f'{start:%Y-%m}.jsonl.gz'
+            if not dry_run:
+                write_archive(bucket, path, batch_size)
+                delete_in_batches(bucket, batch_size)
+            yield {'month': f'{start:%Y-%m}', 'rows': rows, 'path': str(path)}
+        start = end
+
+
+def write_archive(bucket, path, batch_size):
+    # the month's earlier archive (from a run that died while deleting) is copied over, then the rows not in it yet
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    archived = 0
+    with gzip.open(tmp_path, 'wt') as archive:
+        if path.exists():
+            with gzip.open(path, 'rt') as previous:
+                for line in previous:
+                    archive.write(line)
+                    archived = max(archived, json.loads(line)['id'])
+        for row in bucket.filter(id__gt=archived).order_by('id').values().iterator(chunk_size=batch_size):
+            archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+    with open(tmp_path, 'rb') as archive:
+        os.fsync(archive.fileno())
+    os.replace(tmp_path, path)
+
+
+def delete_in_batches(bucket, batch_size):
+    # small DELETEs so the table is never locked for long
+    while True:
+        ids = list(bucket.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        bucket.model.objects.filter(id__in=ids).delete()
+
+
+def read_archive(path):
+    with gzip.open(path, 'rt') as archive:
+        for line in archive:
+            yield json.loads(line)
+
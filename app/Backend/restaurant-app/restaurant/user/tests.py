@@ -0,0 +1,544 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, OperationalError
+from django.http import HttpResponse
+from django.contrib.auth.hashers import check_password, make_password
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from restaurant.middlewares.has_role import role_required
+from restaurant.middlewares.profiling import ProfilingMiddleware, QUERIES, _execute
+from restaurant.utils import hashing
+from restaurant.utils.testing import enforce_query_budgets
+from restaurant.utils.cursor import encode_cursor
+from restaurant.utils.auth_cache import get_user, invalidate_user, user_cache
+from restaurant.utils.db_profiles import load_databases, expand, replica_aliases
+from restaurant.utils.db_router import check_shared_cache, PrimaryReplicaRouter, replica_reads, start_request, finish_request, pin_key, PIN_COOKIE, FAILOVERS
+from restaurant.utils.jwt_utils import create_access_token, create_refresh_token
+from .devices import user_agent_hash
+from . import retention
+from .retention import archive_logs, read_archive, retention_cutoff
+from .models import KnownDevice, LoginHistory, Role, Token, User
+from .tokens import issue_refresh_token, rotate_refresh_token, revoke_refresh_token, delete_expired, revoked, InvalidRefreshToken
+
+
+def auth(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {create_access_token(user.id, user.email)}'}
+
+
+def connect(alias):
+    # replica_down refuses connections, the other aliases are up
+    if alias == 'replica_down':
+        raise OperationalError('unable to open database file')
+
+
+@mock.patch.object(PrimaryReplicaRouter, 'connect', staticmethod(connect))
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.clear()
+
+    def read(self, router):
+        return router.db_for_read(LoginHistory)
+
+    def test_only_replica_reads_go_to_a_replica(self):
+        router = PrimaryReplicaRouter(replicas=['replica_up'])
+        self.assertEqual(self.read(router), 'default')
+        with replica_reads():
+            self.assertEqual(self.read(router), 'replica_up')
+        self.assertEqual(router.db_for_write(LoginHistory), 'default')
+
+    def test_a_request_that_wrote_reads_its_writes_from_the_primary(self):
+        router = PrimaryReplicaRouter(replicas=['replica_up'])
+        token = start_request(self.factory.get('/'))
+        with replica_reads():
+            self.assertEqual(self.read(router), 'replica_up')
+            router.db_for_write(LoginHistory)
+            self.assertEqual(self.read(router), 'default')
+        response = HttpResponse()
+        finish_request(token, response)
+        self.assertIn(PIN_COOKIE, response.cookies) # and the next requests of the client too
+
+    def test_pinned_clients_read_from_the_primary(self):
+        router = PrimaryReplicaRouter(replicas=['replica_up'])
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        token = start_request(request)
+        with replica_reads():
+            self.assertEqual(self.read(router), 'default')
+        finish_request(token, HttpResponse())
+
+        # jwt clients don't keep cookies, they are pinned by user once jwt_required has set it
+        cache.set(pin_key(7), True)
+        request = self.factory.get('/')
+        token = start_request(request)
+        with replica_reads():
+            self.assertEqual(self.read(router), 'replica_up')
+            request.user = SimpleNamespace(pk=7)
+            self.assertEqual(self.read(router), 'default')
+        finish_request(token, HttpResponse())
+
+    def test_reads_fail_over_when_a_replica_is_down(self):
+        failovers = FAILOVERS.values.get(('replica_down',), 0)
+        router = PrimaryReplicaRouter(replicas=['replica_down', 'replica_up'])
+        with replica_reads():
+            self.assertEqual(self.read(router), 'replica_up')
+
+        router = PrimaryReplicaRouter(replicas=['replica_down'])
+        with replica_reads():
+            self.assertEqual(self.read(router), 'default')
+        with replica_reads():
+            self.assertEqual(self.read(router), 'default') # skipped for a while, not retried on every read
+        self.assertEqual(FAILOVERS.values[('replica_down',)], failovers + 2)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_replicas_need_a_shared_cache(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}}
+        with override_settings(DATABASE_REPLICAS=['replica'], CACHES=local):
+            self.assertEqual([error.id for error in check_shared_cache()], ['db_router.E001'])
+        with override_settings(DATABASE_REPLICAS=['replica'], CACHES=shared):
+            self.assertEqual(check_shared_cache(), [])
+        with override_settings(DATABASE_REPLICAS=[], CACHES=local):
+            self.assertEqual(check_shared_cache(), [])
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    def load(self, profile, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return load_databases(profile, settings.DATABASE_PROFILE_DIR, '/srv/app')
+
+    @mock.patch('restaurant.utils.db_profiles.check_connection', return_value=len) # psycopg_pool is optional
+    def test_placeholders_read_the_environment(self, check_connection):
+        default = self.load('postgres', DB_HOST='db.internal', DB_PASSWORD='hunter2', DB_POOL_MAX_SIZE='50')['default']
+        self.assertEqual((default['HOST'], default['PASSWORD'], default['USER']), ('db.internal', 'hunter2', 'postgres'))
+        self.assertEqual((default['PORT'], default['OPTIONS']['pool']['min_size'], default['OPTIONS']['pool']['max_size']), (5432, 2, 50))
+        self.assertIs(default['OPTIONS']['pool']['check'], len)
+
+    def test_only_numeric_settings_become_ints(self):
+        default = self.load('postgres-persistent', DB_PASSWORD='123456', DB_NAME='2024', DB_PORT='6432', DB_CONN_MAX_AGE='60')['default']
+        self.assertEqual((default['PASSWORD'], default['NAME']), ('123456', '2024'))
+        self.assertEqual((default['PORT'], default['CONN_MAX_AGE']), (6432, 60))
+
+        self.assertEqual(expand({'PORT': '${UNSET_PORT}', 'OPTIONS': {'options': '${UNSET_OPTIONS:-42}'}}), {'PORT': '', 'OPTIONS': {'options': '42'}})
+        with self.assertRaises(ImproperlyConfigured):
+            expand({'CONN_MAX_AGE': '${UNSET_AGE:-forever}'})
+
+    def test_sqlite_paths_are_relative_to_the_project(self):
+        databases = self.load('sqlite-replicas', DB_NAME='data/menu.db')
+        self.assertEqual(databases['default']['NAME'], Path('/srv/app/data/menu.db'))
+        self.assertEqual(databases['replica']['NAME'], 'file:/srv/app/db.sqlite3?mode=ro')
+        self.assertEqual(replica_aliases(databases), ['replica'])
+
+    def test_unknown_profiles_list_the_available_ones(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'postgres-persistent'):
+            self.load('mysql')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ChangePasswordTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com', password_hash=make_password('secret'))
+
+    def test_json_and_form_bodies(self):
+        bodies = [
+            ('application/json', '{"old_password": "secret", "new_password": "json"}'),
+            ('application/x-www-form-urlencoded', 'old_password=json&new_password=form'),
+            (MULTIPART_CONTENT, encode_multipart(BOUNDARY, {'old_password': 'form', 'new_password': 'multipart'})),
+        ]
+        for content_type, body in bodies:
+            with self.subTest(content_type=content_type):
+                response = self.client.put('/user/change-password/', body, content_type=content_type, **auth(self.user))
+                self.assertEqual(response.status_code, 200, response.content)
+        self.user.refresh_from_db()
+        self.assertTrue(check_password('multipart', self.user.password_hash))
+
+    def test_missing_fields(self):
+        response = self.client.put('/user/change-password/', 'old_password=secret', content_type='text/plain', **auth(self.user))
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Missing required fields'}))
+
+
+@override_settings(AUDIT_BUFFERED=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']) # fast hashes
+class LoginTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com', password_hash=make_password('secret'))
+
+    def login(self, password='secret'):
+        return self.client.post('/user/login/', {'email': 'ana@example.com', 'password': password}, content_type='application/json', HTTP_USER_AGENT='Firefox')
+
+    def test_login_writes_its_history_through(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'access', 'refresh'})
+        history = LoginHistory.objects.get(user=self.user)
+        self.assertEqual(history.user_agent, 'Firefox')
+        self.assertTrue(KnownDevice.objects.filter(user=self.user).exists())
+
+    def test_wrong_password_writes_nothing(self):
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertFalse(LoginHistory.objects.exists())
+
+
+class LoginHistoryTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com')
+        now = timezone.now()
+        # two logins at the same instant, the id breaks the tie between pages
+        times = [now - timedelta(hours=hours) for hours in (1, 2, 2, 3, 48)]
+        self.history = [LoginHistory.objects.create(user=self.user, login_time=moment, user_agent=f'agent {i}') for i, moment in enumerate(times)]
+        LoginHistory.objects.create(user=User.objects.create(first_name='Bo', email='bo@example.com'), user_agent='not hers')
+
+    def get(self, query=''):
+        return self.client.get(f'/user/login-history/{query}', **auth(self.user))
+
+    def test_cursor_pages_walk_the_history_once(self):
+        agents, cursor, pages = [], None, 0
+        while True:
+            response = self.get('?limit=2' + (f'&cursor={cursor}' if cursor else ''))
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            agents += [row['user_agent'] for row in body['login_history']]
+            cursor, pages = body['next_cursor'], pages + 1
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(agents, ['agent 0', 'agent 2', 'agent 1', 'agent 3', 'agent 4'])
+
+    def test_time_range(self):
+        since = (timezone.now() - timedelta(hours=24)).isoformat().replace('+', '%2B')
+        response = self.get(f'?since={since}')
+        self.assertEqual([row['user_agent'] for row in response.json()['login_history']], ['agent 0', 'agent 2', 'agent 1', 'agent 3'])
+        self.assertEqual(self.get('?since=yesterday').status_code, 400)
+
+    def test_limit_is_clamped(self):
+        for limit in ('0', '-1'):
+            response = self.get(f'?limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['login_history']), 1)
+        self.assertEqual(self.get('?limit=ten').status_code, 400)
+
+    def test_invalid_cursors_are_rejected(self):
+        self.assertEqual(self.get('?cursor=garbage').status_code, 400)
+        now = timezone.now().isoformat()
+        for values in ([now, 'abc'], [None, 1], ['', 1], [now, 1.5], [1, 1]):
+            with self.subTest(cursor=values):
+                self.assertEqual(self.get(f'?cursor={encode_cursor(values)}').status_code, 400)
+
+
+class LogRetentionTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        user = User.objects.create(first_name='Ana', email='ana@example.com')
+        for month, day in [(1, 5), (1, 31), (3, 1), (6, 15)]:
+            LoginHistory.objects.create(user=user, user_agent=f'{month}-{day}', login_time=datetime(2024, month, day, 12, tzinfo=dt_timezone.utc))
+
+    def test_cutoff_is_a_month_boundary(self):
+        now = datetime(2024, 6, 20, 15, tzinfo=dt_timezone.utc)
+        self.assertEqual(retention_cutoff(90, now), datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+
+    def test_old_months_move_to_archives(self):
+        cutoff = datetime(2024, 4, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual([month['rows'] for month in archive_logs('loginhistory', cutoff, self.archive_dir, dry_run=True)], [2, 1])
+        self.assertEqual(LoginHistory.objects.count(), 4)
+
+        months = list(archive_logs('loginhistory', cutoff, self.archive_dir, batch_size=1))
+        self.assertEqual([(month['month'], month['rows']) for month in months], [('2024-01', 2), ('2024-03', 1)])
+        self.assertEqual([row['user_agent'] for row in read_archive(months[0]['path'])], ['1-5', '1-31'])
+        self.assertEqual(list(LoginHistory.objects.values_list('user_agent', flat=True)), ['6-15'])
+        self.assertEqual(list(archive_logs('loginhistory', cutoff, self.archive_dir)), []) # nothing left to do
+
+    def test_a_run_that_dies_while_deleting_archives_each_row_once(self):
+        cutoff = datetime(2024, 2, 1, tzinfo=dt_timezone.utc)
+
+        def die_after_one_batch(bucket, batch_size):
+            bucket.model.objects.filter(id__in=list(bucket.order_by('id').values_list('id', flat=True)[:1])).delete()
+            raise OperationalError('killed')
+
+        with mock.patch.object(retention, 'delete_in_batches', die_after_one_batch), self.assertRaises(OperationalError):
+            list(archive_logs('loginhistory', cutoff, self.archive_dir))
+        self.assertEqual(LoginHistory.objects.filter(login_time__lt=cutoff).count(), 1)
+
+        late = LoginHistory.objects.create(user=LoginHistory.objects.first().user, user_agent='late', login_time=datetime(2024, 1, 20, tzinfo=dt_timezone.utc))
+        months = list(archive_logs('loginhistory', cutoff, self.archive_dir))
+        self.assertEqual([(month['month'], month['rows']) for month in months], [('2024-01', 2)])
+        self.assertEqual([row['user_agent'] for row in read_archive(months[0]['path'])], ['1-5', '1-31', 'late'])
+        self.assertEqual([row['id'] for row in read_archive(months[0]['path'])][-1], late.id)
+        self.assertEqual(os.listdir(Path(self.archive_dir) / 'loginhistory'), ['2024-01.jsonl.gz'])
+        self.assertFalse(LoginHistory.objects.filter(login_time__lt=cutoff).exists())
+
+    def test_command(self):
+        output = StringIO()
+        call_command('archive_logs', log=['loginhistory'], days=30, archive_dir=self.archive_dir, stdout=output)
+        self.assertIn('loginhistory: 4 rows older than', output.getvalue())
+        self.assertFalse(LoginHistory.objects.exists())
+
+
+@enforce_query_budgets
+@override_settings(AUDIT_BUFFERED=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserViewQueryBudgetTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com', password_hash=make_password('secret'))
+
+    def post(self, url, body, **headers):
+        return self.client.post(url, body, content_type='application/json', **headers)
+
+    def test_every_view_stays_within_its_budget(self):
+        # the worst case of each view: new device, write-through audit rows, a reused refresh token, a cold user cache
+        requests = [
+            ('signup', lambda: self.post('/user/signup/', {'first_name': 'Bo', 'email': 'bo@example.com', 'password': 'secret'}), 201),
+            ('login', lambda: self.post('/user/login/', {'email': 'ana@example.com', 'password': 'secret'}, HTTP_USER_AGENT='Firefox'), 200),
+            ('login', lambda: self.post('/user/login/', {'email': 'ana@example.com', 'password': 'secret'}, HTTP_USER_AGENT='Safari'), 200),
+            ('view_login_history', lambda: self.client.get('/user/login-history/', **auth(self.user)), 200),
+            ('hello', lambda: (user_cache.clear(), self.client.get('/user/hello', **auth(self.user)))[1], 200),
+        ]
+        token = issue_refresh_token(self.user.id, self.user.email)
+        requests += [
+            ('refresh_access_token', lambda: self.post('/user/refresh-token/', {'refresh_token': token}), 200),
+            ('refresh_access_token', lambda: self.post('/user/refresh-token/', {'refresh_token': token}), 401),
+            ('logout', lambda: self.post('/user/logout/', {'refresh_token': issue_refresh_token(self.user.id, self.user.email)}), 200),
+            ('change_password', lambda: self.client.put('/user/change-password/', {'old_password': 'secret', 'new_password': 'better'}, content_type='application/json', **auth(self.user)), 200),
+        ]
+        for view, request, status in requests:
+            before = QUERIES.snapshot(view=view)['count']
+            self.assertEqual(request().status_code, status, view)
+            self.assertEqual(QUERIES.snapshot(view=view)['count'], before + 1, view) # measured, so checked against the budget
+
+
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.waiter = Role.objects.get_or_create(name='waiter')[0]
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com', role=self.waiter)
+
+    def test_cached_users_are_loaded_once(self):
+        get_user(self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user(self.user.id).role.name, 'waiter')
+
+    def test_every_request_gets_its_own_user_and_role(self):
+        first = get_user(self.user.id)
+        first.first_name = 'Changed'
+        first.role.name = 'changed'
+        second = get_user(self.user.id)
+        self.assertEqual((second.first_name, second.role.name), ('Ana', 'waiter'))
+
+    def test_role_changes_are_seen_by_the_next_request(self):
+        get_user(self.user.id)
+        self.user.role = Role.objects.get_or_create(name='admin')[0]
+        self.user.save()
+        self.assertEqual(get_user(self.user.id).role.name, 'admin')
+
+        self.user.role.name = 'manager' # renaming the role drops every user that has it
+        self.user.role.save()
+        self.assertEqual(get_user(self.user.id).role.name, 'manager')
+
+    def test_deactivated_users_are_rejected_at_once(self):
+        self.assertEqual(self.client.get('/user/hello', **auth(self.user)).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/user/hello', **auth(self.user)).status_code, 403)
+
+        User.objects.filter(id=self.user.id).update(is_active=True) # no signal, invalidate_user by hand
+        invalidate_user(self.user.id)
+        self.assertEqual(self.client.get('/user/hello', **auth(self.user)).status_code, 200)
+
+
+@role_required('admin', 'waiter')
+@role_required('waiter')
+def waiter_view(request):
+    return HttpResponse('ok')
+
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingMiddlewareTests(TestCase):
+    async def test_overlapping_async_requests_count_their_own_queries(self):
+        first_ran, second_done = asyncio.Event(), asyncio.Event()
+        run_queries = sync_to_async(lambda count: [User.objects.count() for _ in range(count)])
+
+        async def view(request):
+            if request.path == '/first/':
+                await run_queries(1)
+                first_ran.set()
+                await second_done.wait() # the second request runs while this one is open
+                await run_queries(1)
+            else:
+                await first_ran.wait()
+                await run_queries(3)
+                second_done.set()
+            return HttpResponse('ok')
+
+        middleware = ProfilingMiddleware(view)
+        first, second = RequestFactory().get('/first/'), RequestFactory().get('/second/')
+        await asyncio.gather(middleware(first), middleware(second))
+
+        self.assertEqual((len(first._profile.queries), len(second._profile.queries)), (2, 3))
+        wrappers = await sync_to_async(lambda: list(connection.execute_wrappers))() # the connection of the ORM thread
+        self.assertEqual(wrappers.count(_execute), 1) # installed once, never pushed per request
+
+
+class RoleRequiredTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.factory = RequestFactory()
+        self.waiter = User.objects.create(first_name='Ana', email='ana@example.com', role=Role.objects.get_or_create(name='Waiter')[0])
+
+    def call(self, user):
+        request = self.factory.get('/')
+        request.user = user
+        return waiter_view(request)
+
+    def test_stacked_guards_resolve_the_role_once(self):
+        user = User.objects.get(id=self.waiter.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.call(user).status_code, 200) # role not loaded
+        user = get_user(self.waiter.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.call(user).status_code, 200) # loaded by jwt_required
+
+    def test_other_roles_are_rejected(self):
+        customer = User.objects.create(first_name='Bo', email='bo@example.com')
+        admin = User.objects.create(first_name='Cy', email='cy@example.com', role=Role.objects.get_or_create(name='admin')[0])
+        for user in (customer, admin, AnonymousUser()):
+            response = self.call(user)
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(response.content, b'{"error": "Unauthorized access"}')
+
+    def test_admin_views_reject_waiters(self):
+        response = self.client.post('/products/create-product/', {'name': 'Pizza'}, content_type='application/json', **auth(self.waiter))
+        self.assertEqual(response.status_code, 403)
+
+
+class HashingPoolTests(TestCase):
+    def saturate(self, pool):
+        # occupies every worker and queue slot until the returned event is set
+        release = threading.Event()
+        self.addCleanup(pool.executor.shutdown)
+        self.addCleanup(release.set)
+        futures = [pool.submit(release.wait) for _ in range(pool.workers + pool.max_queue)]
+        return release, futures
+
+    def test_a_full_pool_rejects_and_counts(self):
+        pool = hashing.HashingPool(workers=1, max_queue=1)
+        release, futures = self.saturate(pool)
+        with self.assertRaises(hashing.HashingPoolOverloaded):
+            pool.submit(release.wait)
+        self.assertEqual(pool.stats(), {
+            'workers': 1, 'max_queue': 1, 'running': 1, 'queue_depth': 1, 'completed': 0, 'rejected': 1, 'busy_seconds': 0.0,
+        })
+
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        stats = pool.stats()
+        self.assertEqual((stats['running'], stats['queue_depth'], stats['completed'], stats['rejected']), (0, 0, 2, 1))
+        pool.submit(len, 'room again').result(timeout=5)
+
+    def test_auth_views_answer_503_when_the_pool_is_full(self):
+        pool = hashing.HashingPool(workers=1, max_queue=0)
+        self.saturate(pool)
+        with mock.patch.object(hashing, 'hashing_pool', pool):
+            response = self.client.post('/user/signup/', {'first_name': 'Ana', 'email': 'ana@example.com', 'password': 'secret'}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(User.objects.filter(email='ana@example.com').exists())
+
+
+class BackfillKnownDevicesTests(TestCase):
+    def test_backfill_only_moves_last_seen_forward(self):
+        user = User.objects.create(first_name='Ana', email='ana@example.com')
+        now = timezone.now()
+        for ip, days_ago in [('10.0.0.1', 10), ('10.0.0.1', 5), ('10.0.0.2', 10), ('10.0.0.2', 8), ('10.0.0.3', 3)]:
+            LoginHistory.objects.create(user=user, login_ip=ip, user_agent='Firefox', login_time=now - timedelta(days=days_ago))
+        agent = user_agent_hash('Firefox')
+        KnownDevice.objects.create(user=user, ip='10.0.0.1', user_agent_hash=agent, first_seen=now - timedelta(days=10), last_seen=now) # seen since
+        KnownDevice.objects.create(user=user, ip='10.0.0.2', user_agent_hash=agent, first_seen=now - timedelta(days=10), last_seen=now - timedelta(days=9))
+
+        call_command('backfill_known_devices', batch_size=2, stdout=StringIO())
+
+        last_seen = dict(KnownDevice.objects.values_list('ip', 'last_seen'))
+        self.assertEqual(last_seen, {
+            '10.0.0.1': now,
+            '10.0.0.2': now - timedelta(days=8),
+            '10.0.0.3': now - timedelta(days=3),
+        })
+
+
+class RefreshTokenStoreTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(first_name='Ana', email='ana@example.com')
+        revoked.clear()
+
+    def test_refresh_rotates_the_token(self):
+        token = issue_refresh_token(self.user.id, self.user.email)
+        response = self.client.post('/user/refresh-token/', {'refresh_token': token}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        new_token = response.json()['refresh_token']
+        self.assertNotEqual(new_token, token)
+        self.assertEqual(Token.objects.filter(user=self.user, revoked_at__isnull=True).count(), 1)
+
+        # the old one is spent, the new one works once
+        self.assertEqual(self.client.post('/user/refresh-token/', {'refresh_token': new_token}, content_type='application/json').status_code, 200)
+
+    def test_reusing_a_rotated_token_revokes_every_session(self):
+        token = issue_refresh_token(self.user.id, self.user.email)
+        other_session = issue_refresh_token(self.user.id, self.user.email)
+        _, _, new_token = rotate_refresh_token(token)
+
+        revoked.clear() # another process, only the database knows
+        with self.assertRaises(InvalidRefreshToken):
+            rotate_refresh_token(token)
+        for spent in (new_token, other_session):
+            with self.assertRaises(InvalidRefreshToken):
+                rotate_refresh_token(spent)
+        self.assertFalse(Token.objects.filter(user=self.user, revoked_at__isnull=True).exists())
+
+    def test_deactivated_users_cant_refresh(self):
+        token = issue_refresh_token(self.user.id, self.user.email)
+        other_session = issue_refresh_token(self.user.id, self.user.email)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+
+        with self.assertRaisesMessage(InvalidRefreshToken, 'User is inactive'):
+            rotate_refresh_token(token)
+        self.assertFalse(Token.objects.filter(user=self.user, revoked_at__isnull=True).exists()) # every session goes
+
+        User.objects.filter(id=self.user.id).update(is_active=True) # reactivated: logs in again, the old tokens stay dead
+        with self.assertRaises(InvalidRefreshToken):
+            rotate_refresh_token(other_session)
+
+    def test_revoked_tokens_are_rejected_from_memory(self):
+        token = issue_refresh_token(self.user.id, self.user.email)
+        revoke_refresh_token(token)
+        with self.assertNumQueries(0):
+            with self.assertRaises(InvalidRefreshToken):
+                rotate_refresh_token(token)
+
+    def test_tokens_outside_the_store_are_rejected(self):
+        with self.assertRaises(InvalidRefreshToken):
+            rotate_refresh_token(create_refresh_token(self.user.id, self.user.email)) # no jti, issued before the store
+
+    def test_expired_tokens_are_deleted_in_batches(self):
+        now = timezone.now()
+        Token.objects.bulk_create([
+            Token(user=self.user, token=str(i), token_type='refresh', expires_at=now + timedelta(days=-1 if i < 5 else 1))
+            for i in range(8)
+        ])
+        self.assertEqual(delete_expired(batch_size=2), 5)
+        self.assertEqual(Token.objects.count(), 3)
@@ -0,0 +1,130 @@
+import hashlib
+import time
+import uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from restaurant.utils.auth_cache import TTLCache
+from restaurant.utils.jwt_utils import create_refresh_token, decode_refresh_token, REFRESH_TOKEN_LIFETIME
+from .models import Token, User
+
+'''
+    Refresh token store. Every refresh token carries a jti, the Token table keeps sha256(jti) (unique index) with its
+    expiry, so a token can be rotated and revoked. A leaked table has no usable ids in it.
+
+    Rotation: refresh_access_token trades the refresh token for a new one. The old one is claimed with one UPDATE
+        UPDATE user_token SET revoked_at = now, rotated = true WHERE token = sha256(jti) AND revoked_at IS NULL AND expires_at > now
+    (AND user_id IN (SELECT id FROM user WHERE is_active), a deactivated user's tokens are never claimed)
+    1 row: valid and revoked in the same statement (two refreshes racing with the same token, only one wins),
+    then the new token is INSERTed in the same transaction. The "is it revoked?" check costs no query of its own.
+    0 rows: unknown, expired, logged out or already rotated. A rotated token that comes back means someone else has
+    it too, every refresh token of the user is revoked (reuse detection, the user logs in again). So are the tokens of
+    a deactivated user that come back.
+
+    revoked: in process LRU (max REFRESH_REVOCATION_CACHE_MAX_ENTRIES) of the hashes this process revoked, until the
+    token would expire anyway. A logged out token, or one of a user whose sessions were revoked, is rejected from memory
+    without touching the database (replays come in bursts). It only knows what this process revoked, the database
+    stays the source of truth for everything else.
+
+    Expired rows are deleted by `python manage.py cleanup_tokens` (delete_expired, in batches), revoked rows are
+    kept until they expire for the reuse detection.
+'''
+
+REFRESH = 'refresh'
+ROTATED = 'rotated' # revoked by a rotation, coming back = reuse
+REVOKED = 'revoked' # logged out, or all tokens of the user revoked
+
+revoked = TTLCache(getattr(settings, 'REFRESH_REVOCATION_CACHE_MAX_ENTRIES', 10000), REFRESH_TOKEN_LIFETIME.total_seconds())
+
+
+class InvalidRefreshToken(Exception):
+    pass
+
+
+def hash_jti(jti):
+    return hashlib.sha256(jti.encode()).hexdigest()
+
+
+def issue_refresh_token(user_id, email):
+    # a new refresh token, saved in the store
+    jti = uuid.uuid4().hex
+    expires_at = timezone.now() + REFRESH_TOKEN_LIFETIME
+    Token.objects.create(user_id=user_id, token=hash_jti(jti), token_type=REFRESH, expires_at=expires_at)
+    return create_refresh_token(user_id, email, jti, expires_at)
+
+
+aissue_refresh_token = sync_to_async(issue_refresh_token)
+
+
+def read_refresh_token(refresh_token):
+    # (claims, hash of the jti) of a validly signed refresh token from the store, raises InvalidRefreshToken
+    payload = decode_refresh_token(refresh_token)
+    if not isinstance(payload, dict): # the error message
+        raise InvalidRefreshToken(payload)
+    if payload.get('token_type') != REFRESH or not payload.get('jti'):
+        raise InvalidRefreshToken('Invalid refresh token')
+    return payload, hash_jti(payload['jti'])
+
+
+def rotate_refresh_token(refresh_token):
+    # returns (user_id, email, new refresh token), raises InvalidRefreshToken
+    payload, key = read_refresh_token(refresh_token)
+    state = revoked.get(key)
+    if state == REVOKED:
+        raise InvalidRefreshToken('Refresh token revoked')
+
+    now = timezone.now()
+    if state is None:
+        with transaction.atomic():
+            claimed = Token.objects.filter(
+                token=key, token_type=REFRESH, revoked_at__isnull=True, expires_at__gt=now,
+                user_id__in=User.objects.filter(is_active=True).values('id'),
+            ).update(revoked_at=now, rotated=True)
+            if claimed:
+                new_token = issue_refresh_token(payload['user_id'], payload['email'])
+        if claimed:
+            revoked.set(key, ROTATED, payload['exp'])
+            return payload['user_id'], payload['email'], new_token
+
+    # rotated already (here or in another process), or its user was deactivated, or revoked, expired, not in the store
+    user_id, rotated, user_is_active = Token.objects.filter(token=key).values_list('user_id', 'rotated', 'user__is_active').first() or (None, False, True)
+    if rotated:
+        revoke_user_tokens(user_id)
+        raise InvalidRefreshToken('Refresh token already used, every session of the user was revoked')
+    if not user_is_active:
+        revoke_user_tokens(user_id)
+        raise InvalidRefreshToken('User is inactive')
+    raise InvalidRefreshToken('Invalid refresh token')
+
+
+def revoke_refresh_token(refresh_token):
+    # logout, raises InvalidRefreshToken if the token isn't one of ours
+    payload, key = read_refresh_token(refresh_token)
+    Token.objects.filter(token=key, revoked_at__isnull=True).update(revoked_at=timezone.now())
+    revoked.set(key, REVOKED, payload['exp'])
+
+
+def revoke_user_tokens(user_id):
+    # every refresh token of the user (password change, reuse of a rotated token)
+    now = timezone.now()
+    tokens = Token.objects.filter(user_id=user_id, token_type=REFRESH, expires_at__gt=now)
+    for key, expires_at in tokens.values_list('token', 'expires_at'):
+        revoked.set(key, REVOKED, expires_at.timestamp())
+    return tokens.filter(revoked_at__isnull=True).update(revoked_at=now)
+
+
+arevoke_user_tokens = sync_to_async(revoke_user_tokens)
+
+
+def delete_expired(batch_size=1000, pause=0.0, now=None):
+    # small DELETEs on the expires_at index so the table is never locked for long, returns how many rows went
+    expired = Token.objects.filter(expires_at__lte=now or timezone.now())
+    deleted = 0
+    while True:
+        ids = list(expired.order_by('expires_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Token.objects.filter(id__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause) # room for the other writers between batches
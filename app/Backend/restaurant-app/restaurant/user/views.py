@@ -1,5 +1,9 @@
 from rest_framework.decorators import api_view #, permission_classes
 from rest_framework.response import Response
+from django.http import JsonResponse, QueryDict
+from django.http.multipartparser import MultiPartParserError
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_http_methods
 #from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth.hashers import make_password
 from .models import User, LoginHistory, Role
@@ -7,110 +11,168 @@ from django.utils import timezone
 #from rest_framework.exceptions import NotFound, AuthenticationFailed
 from restaurant.utils.jwt_utils import create_access_token, create_refresh_token, get_user_from_jwt, verify_refresh_token, verify_access_token, decode_access_token, decode_refresh_token
 from restaurant.middlewares.is_authenticated import jwt_required 
-from datetime import timedelta
+from restaurant.middlewares.profiling import query_budget
+from .devices import is_new_device
+from .tokens import aissue_refresh_token, arevoke_user_tokens, rotate_refresh_token, revoke_refresh_token, InvalidRefreshToken
+from restaurant.utils.hashing import hash_password, verify_password, HashingPoolOverloaded
+from restaurant.utils.cursor import encode_cursor, decode_cursor
+from restaurant.utils.db_router import replica_reads
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta, timezone as dt_timezone
+import json
+from io import BytesIO
 
 '''
     Here we only have user routes which are general user routes.
     Such as login, signup, change password, view login history, and refresh access token.
 '''
 
-@api_view(['POST'])
-def signup(request):
-    data = request.data
+def request_data(request):
+    # request.data for the plain async views: json body or form data. Django only parses forms on POST,
+    # a PUT form (change_password) is parsed here like DRF's FormParser/MultiPartParser did.
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    if request.method == 'POST':
+        return request.POST
+    if request.content_type == 'application/x-www-form-urlencoded':
+        return QueryDict(request.body, encoding=request.encoding)
+    if request.content_type == 'multipart/form-data':
+        try:
+            return request.parse_file_upload(request.META, BytesIO(request.body))[0]
+        except MultiPartParserError:
+            return None
+    return QueryDict()
+
+def overloaded_response():
+    response = JsonResponse({'error': 'Too many requests, please try again shortly'}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+
+# signup, login and change_password hash passwords, they are async so the hashing runs on the bounded
+# hashing pool (utils/hashing.py) instead of pinning a worker. Served by asgi.py, they also work under wsgi.
+@query_budget(2) # email taken? + insert
+@csrf_exempt
+@require_POST
+async def signup(request):
+    data = request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid request body'}, status=400)
     first_name = data.get('first_name')
     email = data.get('email')
     password = data.get('password')
 
     if not all([first_name, email, password]):
-        return Response({'error': 'Missing required fields'}, status=400)
+        return JsonResponse({'error': 'Missing required fields'}, status=400)
 
    
-    if User.objects.filter(email=email).exists():
-        return Response({'error': 'User already exists'}, status=400)
+    if await User.objects.filter(email=email).aexists():
+        return JsonResponse({'error': 'User already exists'}, status=400)
 
     try:
         new_user = User(first_name=first_name, email=email)
-        new_user.set_password(password)  
-        new_user.save()
-        return Response({'message': 'User created successfully'}, status=201)
+        new_user.password_hash = await hash_password(password)
+        await new_user.asave()
+        return JsonResponse({'message': 'User created successfully'}, status=201)
+    except HashingPoolOverloaded:
+        return overloaded_response()
     except Exception as e:
-        return Response({'error': str(e)}, status=500)
+        return JsonResponse({'error': str(e)}, status=500)
 
 
-@api_view(['POST'])
-def login(request):
-    data = request.data
+@query_budget(6) # the user, the login history (0 when buffered), the device (+ insert and count for a new one), the refresh token
+@csrf_exempt
+@require_POST
+async def login(request):
+    data = request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid request body'}, status=400)
     email = data.get('email')
     password = data.get('password')
     ip = request.META.get('REMOTE_ADDR')
     user_agent = request.META.get('HTTP_USER_AGENT')
     
     if not all([email, password]):
-        return Response({'error': 'Missing required fields'}, status=400)
+        return JsonResponse({'error': 'Missing required fields'}, status=400)
     
-    user = User.objects.filter(email=email).first()
+    user = await User.objects.filter(email=email).afirst()
     if not user:
-        return Response({'error': 'User not found'}, status=404)    
+        return JsonResponse({'error': 'User not found'}, status=404)    
     
-    if not user.check_password(password):
-        return Response({'error': 'Invalid password'}, status=401)
+    try:
+        if not await verify_password(password, user.password_hash):
+            return JsonResponse({'error': 'Invalid password'}, status=401)
+    except HashingPoolOverloaded:
+        return overloaded_response()
     
     try:
-        login_history = LoginHistory(
+        await LoginHistory.buffered.acreate( # no INSERT on the request path, see audit.py
             user=user, 
             login_ip=request.META.get('REMOTE_ADDR'), 
-            user_agent=request.META.get('HTTP_USER_AGENT'), 
+            user_agent=request.META.get('HTTP_USER_AGENT', ''), 
             login_time=timezone.now()  
         )
-        login_history.save()
     except Exception as e:
-        return Response({'error': str(e)}, status=500)
+        return JsonResponse({'error': str(e)}, status=500)
     
     if not user.is_active:
-        return Response({'error': 'User is not active'}, status=401)
+        return JsonResponse({'error': 'User is not active'}, status=401)
     
 
-    login_history = LoginHistory.objects.filter(user=user) # array of loginhistory objects.
-    for history in login_history:
-        if history.login_ip != ip or history.user_agent != user_agent:
-            print('SUSPICIOUS LOGIN DETECTED')
-            #send_email_to_user(user, 'Suspicious login detected', 'There was a login from an unknown device, if this was not you, please reset your password.')
+    # a device (ip + user agent) this user never logged in from, the very first login of an account doesn't count.
+    if await is_new_device(user, ip, user_agent) and await user.known_devices.acount() > 1:
+        print('SUSPICIOUS LOGIN DETECTED')
+        #send_email_to_user(user, 'Suspicious login detected', 'There was a login from an unknown device, if this was not you, please reset your password.')
 
     access_token = create_access_token(user.id, user.email)  
-    refresh_token = create_refresh_token(user.id, user.email)  
+    refresh_token = await aissue_refresh_token(user.id, user.email) # saved in the refresh token store, see tokens.py
     
-    return Response({
+    return JsonResponse({
         'refresh': refresh_token,
         'access': access_token,
     })
 
-@api_view(['PUT'])
-def change_password(request):
+@query_budget(4) # the user, save, the user's refresh tokens (read + revoke)
+@csrf_exempt
+@require_http_methods(['PUT'])
+async def change_password(request):
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     user_id, _ = get_user_from_jwt(token)
-    user = User.objects.filter(id=user_id).first()
+    user = await User.objects.filter(id=user_id).afirst()
 
     if not user:
-        return Response({'error': 'User not found'}, status=404)
+        return JsonResponse({'error': 'User not found'}, status=404)
     
-    data = request.data
+    data = request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid request body'}, status=400)
     old_password = data.get('old_password')
     new_password = data.get('new_password')
     
     if not all([old_password, new_password]):
-        return Response({'error': 'Missing required fields'}, status=400)
-    
-    if not user.check_password(old_password):
-        return Response({'error': 'Invalid old password'}, status=401)
+        return JsonResponse({'error': 'Missing required fields'}, status=400)
     
     try:
-        user.set_password(new_password)
-        user.save()
-        return Response({'message': 'Password changed successfully'}, status=200)
+        if not await verify_password(old_password, user.password_hash):
+            return JsonResponse({'error': 'Invalid old password'}, status=401)
+
+        user.password_hash = await hash_password(new_password)
+        await user.asave()
+        await arevoke_user_tokens(user.id) # every session has to log in again with the new password
+        return JsonResponse({'message': 'Password changed successfully'}, status=200)
+    except HashingPoolOverloaded:
+        return overloaded_response()
     except Exception as e:
-        return Response({'error': str(e)}, status=500)
+        return JsonResponse({'error': str(e)}, status=500)
     
 
+# the refresh token is rotated: the response has a new one, the one sent can't be used again.
+@query_budget(4) # claim + the new token in a transaction, a reused token: the lookup + revoking the user's tokens
 @api_view(['POST'])
 def refresh_access_token(request):
     data = request.data
@@ -118,10 +180,11 @@ def refresh_access_token(request):
     if not refresh_token:
         return Response({'error': 'Refresh token required'}, status=400)
     
-    # Verify the refresh token
-    user_id, email = verify_refresh_token(refresh_token)
-    if not user_id or not email:
-        return Response({'error': 'Invalid refresh token'}, status=401)
+    # Verify the refresh token against the store and trade it for a new one, see tokens.py
+    try:
+        user_id, email, new_refresh_token = rotate_refresh_token(refresh_token)
+    except InvalidRefreshToken as e:
+        return Response({'error': str(e)}, status=401)
     
     # Create a new access token
     access_token = create_access_token(user_id, email)
@@ -129,26 +192,91 @@ def refresh_access_token(request):
     
     return Response({
         'access_token': access_token,
-        'access_token_expiration': access_token_expiration.isoformat()
+        'access_token_expiration': access_token_expiration.isoformat(),
+        'refresh_token': new_refresh_token,
     }, status=200)
 
 
+# revokes the refresh token, the access tokens it gave expire on their own
+@query_budget(1)
+@api_view(['POST'])
+def logout(request):
+    refresh_token = request.data.get('refresh_token')
+    if not refresh_token:
+        return Response({'error': 'Refresh token required'}, status=400)
+    try:
+        revoke_refresh_token(refresh_token)
+    except InvalidRefreshToken as e:
+        return Response({'error': str(e)}, status=401)
+    return Response({'success': 'Logged out'}, status=200)
+
+
     
+def parse_time_param(value):
+    # ?since=/?until= query params, ISO 8601, naive means UTC
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(f'Invalid date: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+# newest first, paginated with a cursor on (login_time, id) so every page is a range scan on the (user, login_time) index.
+# example URL : http://127.0.0.1:8000/user/login-history/?limit=50&since=2024-09-01T00:00:00Z&until=2024-10-01T00:00:00Z
+# next page: same URL plus &cursor=<next_cursor>
+@query_budget(2) # the user (unless jwt_required has it cached) + the page
 @api_view(['GET'])
 @jwt_required
+@replica_reads()
 def view_login_history(request):
+    data = request.query_params
+    try:
+        limit = max(1, min(int(data.get('limit', 50)), 500))
+        since = parse_time_param(data.get('since'))
+        until = parse_time_param(data.get('until'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
     user_login_history = LoginHistory.objects.filter(user=request.user) 
-    if not user_login_history or len(user_login_history) == 0:
+    if since:
+        user_login_history = user_login_history.filter(login_time__gte=since)
+    if until:
+        user_login_history = user_login_history.filter(login_time__lt=until)
+
+    cursor = data.get('cursor')
+    if cursor:
+        try:
+            login_time, history_id = decode_cursor(cursor, 2)
+            if not isinstance(login_time, str) or not isinstance(history_id, int):
+                raise ValueError('Invalid cursor')
+            login_time = parse_time_param(login_time)
+            if login_time is None:
+                raise ValueError('Invalid cursor')
+        except (ValueError, TypeError):
+            return Response({'error': 'Invalid cursor'}, status=400)
+        user_login_history = user_login_history.filter(Q(login_time__lt=login_time) | Q(login_time=login_time, id__lt=history_id))
+
+    rows = list(user_login_history.order_by('-login_time', '-id').values('id', 'login_time', 'user_agent')[:limit + 1])
+    if not rows and not cursor:
         return Response({'error': 'No login history found'}, status=404)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['login_time'].isoformat(), rows[-1]['id']])
+
     response_data = []
-    for history in user_login_history:
+    for history in rows:
         response_data.append({
-            'login_time': history.login_time,
-            'user_agent': history.user_agent
+            'login_time': history['login_time'],
+            'user_agent': history['user_agent']
         })
 
-    return Response({'login_history': response_data}, status=200)
+    return Response({'login_history': response_data, 'next_cursor': next_cursor}, status=200)
 
+@query_budget(1)
 @api_view(['GET'])
 @jwt_required
 def hello(request):
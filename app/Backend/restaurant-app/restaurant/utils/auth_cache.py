@@ -0,0 +1,118 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import jwt
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from restaurant.user.models import User, Role
+
+'''
+    In process cache for jwt_required.
+    Without it every authenticated request runs a full HMAC jwt.decode and a User query (plus one more for user.role).
+
+        - claims: sha256(token) -> decoded claims of a token that was already verified.
+          kept until the token's own exp (never longer), so an expired token is never served from here.
+        - users: user id -> User with its role already loaded (select_related), kept for a short TTL.
+          post_save/post_delete on User and Role drop the affected entries at once, so a role change
+          or a deactivation is seen by the next request of this process.
+          QuerySet.update() does not send signals, call invalidate_user()/invalidate_role() after one.
+
+    Both are bounded LRUs, the limits are in settings.py (AUTH_CACHE_*).
+'''
+
+
+class TTLCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.data = OrderedDict() # key -> (value, expires_at)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        # expires_at can only shorten the TTL, never extend it
+        expires_at = min(expires_at or float('inf'), time.time() + self.ttl)
+        with self.lock:
+            self.data[key] = (value, expires_at)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self.lock:
+            for key in [key for key, (value, _) in self.data.items() if predicate(value)]:
+                del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+MAX_ENTRIES = getattr(settings, 'AUTH_CACHE_MAX_ENTRIES', 10000)
+claims_cache = TTLCache(MAX_ENTRIES, getattr(settings, 'AUTH_CACHE_CLAIMS_TTL', 300))
+user_cache = TTLCache(MAX_ENTRIES, getattr(settings, 'AUTH_CACHE_USER_TTL', 60))
+
+
+def decode_access_claims(token):
+    # same as jwt.decode(token, SECRET_KEY, algorithms=['HS256']) and raises the same errors,
+    # but a token we already verified is only hashed (sha256 is much cheaper than a decode + HMAC check).
+    key = hashlib.sha256(token.encode()).digest()
+    claims = claims_cache.get(key)
+    if claims is None:
+        claims = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+        claims_cache.set(key, claims, expires_at=claims.get('exp'))
+    return claims
+
+
+def get_user(user_id):
+    # User with its role loaded, raises User.DoesNotExist.
+    user = user_cache.get(user_id)
+    if user is None:
+        user = User.objects.select_related('role').get(id=user_id)
+        user_cache.set(user_id, user)
+    # every request gets its own instance, views are free to modify it. copy.copy is shallow, the loaded role
+    # would still be the cached one, so it is copied too.
+    role = user.role
+    user = copy.copy(user)
+    if role is not None:
+        user.role = copy.copy(role)
+    return user
+
+
+def invalidate_user(user_id):
+    user_cache.delete(user_id)
+
+
+def invalidate_role(role_id):
+    user_cache.delete_where(lambda user: user.role_id == role_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def _user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Role)
+def _role_changed(sender, instance, **kwargs):
+    invalidate_role(instance.pk)
@@ -0,0 +1,23 @@
+import base64
+import json
+
+'''
+    Opaque cursors for keyset pagination.
+    A cursor is just the sort key of the last row the client saw, e.g. ["lasagna", 42],
+    serialized as json and base64 encoded so clients treat it as a token and don't build their own.
+'''
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, size):
+    # returns the list of sort key values, raises ValueError if the cursor was tampered with or is malformed.
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
@@ -0,0 +1,83 @@
+import json
+import os
+import re
+from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
+
+'''
+    Database profiles: DATABASES comes from config/database/<profile>.database.json, the profile from DB_PROFILE.
+        DB_PROFILE=sqlite                (default) SQLite in WAL mode, synchronous=NORMAL, busy_timeout, BEGIN IMMEDIATE
+        DB_PROFILE=sqlite-default        SQLite as Django ships it (rollback journal, one writer fails fast), the old settings
+        DB_PROFILE=postgres              Postgres with a psycopg connection pool that checks a connection before handing it out
+        DB_PROFILE=postgres-persistent   Postgres with persistent connections (CONN_MAX_AGE) + CONN_HEALTH_CHECKS, for pgbouncer setups
+        DB_PROFILE=sqlite-replicas       the sqlite profile + a read only connection to the same file as "replica"
+        DB_PROFILE=postgres-replicas     Postgres primary + a streaming replica (DB_REPLICA_HOST), see utils/db_router.py
+    The replica profiles need CACHES shared by every worker (system check db_router.E001).
+    A profile file is a DATABASES dict, so it can define more aliases than "default". An alias with
+    "TEST": {"MIRROR": "default"} is a read replica of default (replica_aliases(), DATABASE_REPLICAS).
+
+    Strings can read the environment: "${DB_PASSWORD}", "${DB_HOST:-localhost}" (default after :-). The numeric settings
+    (INTEGER_KEYS: PORT, CONN_MAX_AGE, the pool sizes and timeouts...) become ints, everything else stays a string,
+    a password or a database name made of digits included. Secrets stay in the environment, never in the files.
+    A relative sqlite NAME (or file: URI path) is relative to the project (BASE_DIR), the pool's "check": "check_connection" is
+    psycopg_pool.ConnectionPool.check_connection.
+'''
+
+PLACEHOLDER = re.compile(r'\$\{(\w+)(?::-([^}]*))?\}')
+NUMBER = re.compile(r'-?\d+')
+INTEGER_KEYS = {'PORT', 'CONN_MAX_AGE', 'min_size', 'max_size', 'timeout', 'max_idle', 'max_lifetime', 'max_waiting', 'num_workers', 'connect_timeout'}
+
+
+def load_databases(profile, config_dir, base_dir):
+    path = Path(config_dir) / f'{profile}.database.json'
+    try:
+        databases = json.loads(path.read_text())
+    except FileNotFoundError:
+        available = sorted(p.name[:-len('.database.json')] for p in Path(config_dir).glob('*.database.json'))
+        raise ImproperlyConfigured(f"Unknown DB_PROFILE {profile!r}, {path} doesn't exist (available: {', '.join(available)})")
+    except ValueError as e:
+        raise ImproperlyConfigured(f'{path} is not valid JSON: {e}')
+
+    databases = expand(databases)
+    for alias, database in databases.items():
+        if database.get('ENGINE', '').endswith('sqlite3') and database.get('NAME') != ':memory:':
+            database['NAME'] = sqlite_path(database['NAME'], base_dir)
+        pool = database.get('OPTIONS', {}).get('pool')
+        if isinstance(pool, dict) and pool.get('check') == 'check_connection':
+            pool['check'] = check_connection()
+    return databases
+
+
+def replica_aliases(databases):
+    return [alias for alias, database in databases.items() if database.get('TEST', {}).get('MIRROR') == 'default']
+
+
+def sqlite_path(name, base_dir):
+    # absolute paths stay as they are, "file:db.sqlite3?mode=ro" keeps its parameters (sqlite opens NAME as a URI)
+    if str(name).startswith('file:'):
+        path, _, params = name[len('file:'):].partition('?')
+        return f'file:{Path(base_dir) / path}' + (f'?{params}' if params else '')
+    return Path(base_dir) / name
+
+
+def expand(value, key=None):
+    if isinstance(value, dict):
+        return {name: expand(item, name) for name, item in value.items()}
+    if isinstance(value, list):
+        return [expand(item, key) for item in value]
+    if not isinstance(value, str):
+        return value
+    expanded = PLACEHOLDER.sub(lambda match: os.environ.get(match.group(1), match.group(2) or ''), value)
+    if key in INTEGER_KEYS and expanded:
+        if not NUMBER.fullmatch(expanded.strip()):
+            raise ImproperlyConfigured(f'{key} must be an integer, {value!r} is {expanded!r}')
+        return int(expanded)
+    return expanded
+
+
+def check_connection():
+    try:
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        raise ImproperlyConfigured('The postgres profile pools connections, install psycopg[pool] (or use DB_PROFILE=postgres-persistent)')
+    return ConnectionPool.check_connection
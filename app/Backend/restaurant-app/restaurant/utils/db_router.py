@@ -0,0 +1,199 @@
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.functional import LazyObject
+from restaurant.utils.metrics import Counter
+
+'''
+    Read replicas (DATABASE_ROUTERS = PrimaryReplicaRouter, replicas = DATABASE_REPLICAS, the aliases of the database
+    profile with "TEST": {"MIRROR": "default"}, see utils/db_profiles.py). Without replicas everything is the primary.
+
+    Writes always go to the primary ("default"). Reads go to a replica only inside replica_reads(), the read only
+    catalog and reporting views (get_products, variant_detail, view_login_history, sales_report, peak_hours_report):
+        @replica_reads()
+        def view_login_history(request):
+    every other read (auth, checkout, anything that reads before it writes) stays on the primary.
+
+    Read your writes: a replica is up to DATABASE_REPLICA_MAX_LAG_SECONDS behind, so inside replica_reads() the reads
+    go to the primary anyway when
+        - the request already wrote something, or is inside transaction.atomic()
+        - the client wrote in the last DATABASE_REPLICA_MAX_LAG_SECONDS: DatabaseRoutingMiddleware pins it with the
+          db_pin cookie and, for jwt users, a cache key per user (API clients don't keep cookies). That key is only
+          seen by every worker when CACHES is shared (memcached/redis), with the per process LocMemCache a jwt client
+          that wrote and lands on another worker reads from the lagging replica. With DATABASE_REPLICAS the check
+          db_router.E001 refuses to start on a per process cache (silence it for a single process setup).
+        - the code asked for it (pin_to_primary(), the menu cache does it right after a catalog change)
+
+    Failover: a replica that can't be connected to is skipped for DATABASE_REPLICA_RETRY_SECONDS (its reads go to
+    the next replica or the primary, restaurant_db_replica_failovers_total counts it). A replica that dies in the
+    middle of a request fails that request, the next ones fail over when they reconnect.
+'''
+
+PRIMARY = DEFAULT_DB_ALIAS
+PIN_COOKIE = 'db_pin'
+MAX_LAG_SECONDS = getattr(settings, 'DATABASE_REPLICA_MAX_LAG_SECONDS', 5)
+RETRY_SECONDS = getattr(settings, 'DATABASE_REPLICA_RETRY_SECONDS', 30)
+
+ROUTED_READS = Counter('restaurant_db_routed_reads_total', 'Reads inside replica_reads() per database alias', ['alias'])
+FAILOVERS = Counter('restaurant_db_replica_failovers_total', 'Replica connections that failed, their reads went elsewhere', ['alias'])
+
+logger = logging.getLogger(__name__)
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    # one per request (or replica_reads() block outside of a request), contextvars follow it into sync_to_async
+    def __init__(self, request=None):
+        self.request = request
+        self.pinned = request is not None and PIN_COOKIE in request.COOKIES
+        self.wrote = False
+        self.reading = 0
+        self.replica = None # picked on the first replica read, kept for the rest of the request
+        self.checked_user = None
+
+    def user_id(self):
+        user = self.request.__dict__.get('user') if self.request is not None else None
+        if user is None or isinstance(user, LazyObject): # the session user, resolving it would be a query
+            return None
+        return getattr(user, 'pk', None)
+
+    def use_primary(self):
+        if self.pinned or self.wrote:
+            return True
+        user_id = self.user_id()
+        if user_id is not None and user_id != self.checked_user: # once per request, jwt_required sets the user late
+            self.checked_user = user_id
+            self.pinned = bool(cache.get(pin_key(user_id)))
+        return self.pinned
+
+
+def pin_key(user_id):
+    return f'db:pin:user:{user_id}'
+
+
+@contextmanager
+def replica_reads():
+    state = _state.get()
+    token = None
+    if state is None:
+        state = RoutingState()
+        token = _state.set(state)
+    state.reading += 1
+    try:
+        yield state
+    finally:
+        state.reading -= 1
+        if token is not None:
+            _state.reset(token)
+
+
+def pin_to_primary():
+    # the rest of the current request reads from the primary
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def start_request(request):
+    return _state.set(RoutingState(request))
+
+
+def finish_request(token, response):
+    # pins a client that wrote to the primary for as long as the replicas may lag behind
+    state = _state.get()
+    _state.reset(token)
+    if not state.wrote or response is None:
+        return
+    response.set_cookie(PIN_COOKIE, '1', max_age=MAX_LAG_SECONDS, httponly=True, samesite='Lax')
+    user_id = state.user_id()
+    if user_id is not None:
+        cache.set(pin_key(user_id), True, MAX_LAG_SECONDS)
+
+
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs=None, **kwargs):
+    if not getattr(settings, 'DATABASE_REPLICAS', []) or settings.CACHES['default']['BACKEND'] not in PER_PROCESS_CACHES:
+        return []
+    return [checks.Error(
+        'DATABASE_REPLICAS needs a cache shared by every worker, the default cache is per process',
+        hint="Point CACHES['default'] to memcached/redis, jwt clients are pinned to the primary after a write through it "
+             "(or add db_router.E001 to SILENCED_SYSTEM_CHECKS when running a single process).",
+        id='db_router.E001',
+    )]
+
+
+class PrimaryReplicaRouter:
+    def __init__(self, replicas=None):
+        self.replicas = list(getattr(settings, 'DATABASE_REPLICAS', []) if replicas is None else replicas)
+        self.cycle = itertools.cycle(self.replicas)
+        self.down = {} # alias -> time.monotonic() until which it is skipped
+        self.lock = threading.Lock()
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db: # related objects come from where the instance came from
+            return instance._state.db
+        state = _state.get()
+        if state is None or not state.reading or not self.replicas:
+            return PRIMARY
+        if state.use_primary() or connections[PRIMARY].in_atomic_block:
+            alias = PRIMARY
+        else:
+            if state.replica is None:
+                state.replica = self.pick_replica()
+            alias = state.replica
+        ROUTED_READS.inc(alias=alias)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        databases = {PRIMARY, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.replicas: # they replicate the primary's schema
+            return False
+        return None
+
+    def pick_replica(self):
+        # round robin over the replicas that are up, the primary when none is
+        for _ in range(len(self.replicas)):
+            with self.lock:
+                alias = next(self.cycle)
+            if self.is_up(alias):
+                return alias
+        return PRIMARY
+
+    def is_up(self, alias):
+        if self.down.get(alias, 0) > time.monotonic():
+            return False
+        try:
+            self.connect(alias)
+        except DatabaseError as e:
+            self.down[alias] = time.monotonic() + RETRY_SECONDS
+            FAILOVERS.inc(alias=alias)
+            logger.warning('Replica %s is down, skipped for %ss: %s', alias, RETRY_SECONDS, e)
+            return False
+        self.down.pop(alias, None)
+        return True
+
+    def connect(self, alias):
+        connections[alias].ensure_connection() # nothing to do when this thread is already connected
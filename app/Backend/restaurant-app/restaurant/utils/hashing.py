@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, check_password
+from restaurant.utils.metrics import register_collector
+
+'''
+    Password hashing off the request workers.
+    make_password/check_password (PBKDF2) take tens to hundreds of ms of CPU each, called inline a burst of logins
+    pins every worker and the menu endpoints starve.
+
+    The auth views (signup, login, change_password) are async and await the hash on a small dedicated thread pool
+    (hashlib releases the GIL while hashing, so the threads really run in parallel).
+    The pool is bounded: at most PASSWORD_HASHING_WORKERS hashes run and PASSWORD_HASHING_MAX_QUEUE wait,
+    past that HashingPoolOverloaded is raised right away and the view answers 503 instead of piling up requests.
+'''
+
+class HashingPoolOverloaded(Exception):
+    pass
+
+
+class HashingPool:
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+        self.slots = threading.BoundedSemaphore(workers + max_queue) # running + waiting
+        self.lock = threading.Lock()
+        self.pending = 0 # submitted and not finished (running + queued)
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise HashingPoolOverloaded('Password hashing queue is full')
+
+        with self.lock:
+            self.pending += 1
+        try:
+            return self.executor.submit(self._run, fn, *args)
+        except Exception:
+            self._done(0.0)
+            raise
+
+    def _run(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._done(time.perf_counter() - start)
+
+    def _done(self, elapsed):
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+            self.busy_seconds += elapsed
+        self.slots.release()
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'running': min(self.pending, self.workers),
+                'queue_depth': max(self.pending - self.workers, 0),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'busy_seconds': round(self.busy_seconds, 3),
+            }
+
+
+hashing_pool = HashingPool(
+    getattr(settings, 'PASSWORD_HASHING_WORKERS', 4),
+    getattr(settings, 'PASSWORD_HASHING_MAX_QUEUE', 32),
+)
+
+
+@register_collector
+def _pool_metrics():
+    stats = hashing_pool.stats()
+    return [
+        ('restaurant_password_hashing_running', 'Hashes running in the pool', stats['running'], None),
+        ('restaurant_password_hashing_queue_depth', 'Hashes waiting for a worker', stats['queue_depth'], None),
+        ('restaurant_password_hashing_rejected', 'Hashes rejected because the queue was full', stats['rejected'], None),
+    ]
+
+
+async def hash_password(password):
+    return await hashing_pool.run(make_password, password)
+
+async def verify_password(password, encoded):
+    return await hashing_pool.run(check_password, password, encoded)
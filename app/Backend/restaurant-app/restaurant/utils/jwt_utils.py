@@ -15,13 +15,18 @@ def create_access_token(user_id, email):
     }
     return jwt.encode(payload, ACCESS_SECRET_KEY, algorithm=ALGORITHM)
 
-def create_refresh_token(user_id, email):
+REFRESH_TOKEN_LIFETIME = timedelta(days=30)
+
+def create_refresh_token(user_id, email, jti=None, expires_at=None):
+    # jti: id of the token in the refresh token store (user/tokens.py), only tokens issued by the store are accepted
     payload = {
         'user_id': user_id,
         'email': email,
         'token_type': 'refresh',
-        'exp': datetime.utcnow() + timedelta(days=30),
+        'exp': expires_at or datetime.utcnow() + REFRESH_TOKEN_LIFETIME,
     }
+    if jti:
+        payload['jti'] = jti
     return jwt.encode(payload, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -0,0 +1,138 @@
+import bisect
+import threading
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+'''
+    In process metrics in the Prometheus text format, served by GET /metrics (see metrics_view).
+    Counters and histograms live in this process only, with several workers every worker is its own target.
+
+        requests = Counter('restaurant_requests_total', 'Requests', ['view', 'method', 'status'])
+        requests.inc(view='get_products', method='GET', status='200')
+
+        latency = Histogram('restaurant_request_duration_seconds', 'Latency', ['view'], buckets=LATENCY_BUCKETS)
+        latency.observe(0.012, view='get_products')
+
+    Gauges that are read when scraped (queue depths, pool sizes...) are added with register_collector(fn),
+    fn returns [(name, help, value, labels dict)].
+'''
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_metrics = []
+_collectors = []
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {} # label values -> count
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # label values -> [count per bucket (+Inf last), sum]
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value) # first bucket with value <= le
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def snapshot(self, **labels):
+        # {'count', 'sum', 'buckets': {le: cumulative count}} of one label set, for tests and debugging
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self.lock:
+            counts, total = self.values.get(key, [[0] * (len(self.buckets) + 1), 0.0])
+            counts = list(counts)
+        cumulative, running = {}, 0
+        for le, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            cumulative[le] = running
+        return {'count': running, 'sum': total, 'buckets': cumulative}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self.values.items())
+        for key, counts, total in items:
+            running = 0
+            for le, count in zip(self.buckets + (float('inf'),), counts):
+                running += count
+                bound = '+Inf' if le == float('inf') else format_number(le)
+                lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), key + (bound,))} {running}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_number(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {running}')
+        return lines
+
+
+def register_collector(collect):
+    _collectors.append(collect)
+    return collect
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    gauges = {}
+    for collect in _collectors:
+        try:
+            for name, help, value, labels in collect():
+                gauges.setdefault((name, help), []).append((labels or {}, value))
+        except Exception:
+            continue # one broken collector doesn't take the whole endpoint down
+    for (name, help), samples in gauges.items():
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+        for labels, value in samples:
+            lines.append(f'{name}{format_labels(tuple(labels), tuple(labels.values()))} {format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    # GET /metrics, only from METRICS_ALLOWED_IPS (empty: from anywhere)
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden('Forbidden\n')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,81 @@
+import decimal
+import json
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError: # optional, render_json falls back to the json module with DRF's encoder
+    orjson = None
+
+'''
+    Fast JSON for the hot read endpoints (the menu: get_products, variant_detail).
+
+    render_json(payload) -> bytes, with the function FAST_JSON_DUMPS points to:
+        - orjson_dumps (default when orjson is installed): several times faster than json.dumps
+        - stdlib_dumps: the json module, same output as DRF's JSONRenderer
+    Both write the same JSON as DRF for everything DRF's encoder knows (datetimes as "...Z", UUIDs, lazy strings...),
+    except Decimals: DRF turns them into floats, which silently changes values with more than 15 significant digits.
+    Here a Decimal is a JSON number when its text is at most 15 characters long (a float keeps every digit of it,
+    that is every price, max_digits=10) and a string otherwise. NaN/Infinity raise instead of writing invalid JSON.
+
+    stream_json(payload, 'data') yields the same document in chunks, rows in batches, for pages too big to build in one piece.
+'''
+
+FLOAT_DIGITS = 15 # any decimal with up to 15 significant digits survives float() and back
+_encoder = JSONEncoder()
+
+
+def encode_decimal(value):
+    # str() is the cheap test (as_tuple() costs 4x more): at most 15 characters is at most 15 digits
+    text = str(value)
+    if len(text) <= FLOAT_DIGITS and value.is_finite() and -300 < value.adjusted() < 300:
+        return float(text)
+    if not value.is_finite():
+        raise ValueError(f'{value} is not valid JSON')
+    return text
+
+
+def default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return encode_decimal(obj)
+    return _encoder.default(obj) # DRF's representation of everything else (datetimes, UUIDs, querysets, lazy strings...)
+
+
+def orjson_dumps(payload):
+    # datetimes go through default() too so they are written the way DRF writes them
+    try:
+        return orjson.dumps(payload, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        # orjson reports every error of default() as "not serializable", the json module raises the real one (ValueError for NaN)
+        return stdlib_dumps(payload)
+
+
+def stdlib_dumps(payload):
+    return json.dumps(payload, default=default, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+
+
+_dumps = None
+
+def get_dumps():
+    global _dumps
+    if _dumps is None:
+        path = getattr(settings, 'FAST_JSON_DUMPS', 'restaurant.utils.renderers.orjson_dumps')
+        _dumps = stdlib_dumps if path.endswith('.orjson_dumps') and orjson is None else import_string(path)
+    return _dumps
+
+
+def render_json(payload):
+    return get_dumps()(payload)
+
+
+def stream_json(payload, key='data', chunk_size=200):
+    # payload[key] is the list, written chunk_size rows at a time after the other fields.
+    rows = payload[key]
+    head = render_json({name: value for name, value in payload.items() if name != key})
+    yield head[:-1] + (b',' if len(head) > 2 else b'') + render_json(key) + b':['
+    for start in range(0, len(rows), chunk_size):
+        yield (b',' if start else b'') + render_json(rows[start:start + chunk_size])[1:-1]
+    yield b']}'
+
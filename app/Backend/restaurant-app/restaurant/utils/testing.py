@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from restaurant.middlewares.profiling import QueryBudgetExceeded
+
+'''
+    Query budget helpers for tests.
+
+    Views declare their budget with @query_budget(n) (middlewares/profiling.py), with enforce_query_budgets
+    any request of the test client that goes over it fails the test with the list of queries:
+
+        @enforce_query_budgets
+        class MenuTests(TestCase):
+            def test_menu(self):
+                self.client.get('/products/?limit=20')
+
+    For code that isn't a view, or a tighter limit in one test:
+
+        with assert_max_queries(2):
+            fetch_variants(query[:20])
+'''
+
+enforce_query_budgets = override_settings(PROFILING_ENABLED=True, PROFILING_ENFORCE_QUERY_BUDGETS=True)
+
+
+@contextmanager
+def assert_max_queries(max_queries, using='default'):
+    with CaptureQueriesContext(connections[using]) as captured:
+        yield captured
+    if len(captured) > max_queries:
+        raise QueryBudgetExceeded(
+            f'{len(captured)} queries, the budget is {max_queries}:\n' +
+            '\n'.join(f"  {i}. {query['sql']}" for i, query in enumerate(captured.captured_queries, 1))
+        )
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class WaiterConfig(AppConfig):
+    name = 'restaurant.waiter'
+
+    def ready(self):
+        from . import feed # connects the order signals to the feed
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from restaurant.order.models import Order
+from restaurant.order.signals import order_status_changed
+
+'''
+    Live order feed for the waiter/kitchen tablets, instead of every tablet polling the orders table.
+
+    Order events are published to a broker once their transaction commits:
+        - order_created: {"id", "user_id", "total_amount", "status", "time_to_eat", "created_at"}
+        - order_status: {"order_ids": [...], "status": "completed"} one event for a whole bulk transition
+    and GET /waiter/orders/feed/ streams them to every connected client as Server-Sent Events (see views.py).
+
+    Resume: every event has an id "<epoch>:<n>", a browser's EventSource sends the last one back in the Last-Event-ID
+    header when it reconnects and the feed replays what it missed from the last ORDER_FEED_BACKLOG events.
+    When the id is too old, or from before a restart (other epoch), a "reset" event tells the client to reload
+    GET /waiter/orders/ and continue from the last_event_id it returns.
+
+    Broker: ORDER_FEED_BROKER is the dotted path of the broker class, InProcessBroker by default. It only reaches
+    the clients connected to this process, so run a single ASGI worker or swap in a broker with the same methods
+    (publish, last_event_id, subscribe, unsubscribe) that goes through a shared service.
+
+    A client that doesn't keep up (ORDER_FEED_QUEUE_SIZE events waiting) is disconnected, it reconnects and replays.
+'''
+
+
+class Subscription:
+    # one connected client. publish() may run in any thread, the events are handed to the client's event loop.
+    def __init__(self, queue_size):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def push(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        # the next event, None when the client fell behind: it reconnects and replays from the backlog
+        if self.overflowed:
+            return None
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    def __init__(self, backlog=None, queue_size=None):
+        self.epoch = str(int(time.time() * 1000))
+        self.counter = 0
+        self.events = deque(maxlen=backlog or getattr(settings, 'ORDER_FEED_BACKLOG', 1000))
+        self.queue_size = queue_size or getattr(settings, 'ORDER_FEED_QUEUE_SIZE', 100)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def publish(self, event_type, data):
+        with self.lock:
+            self.counter += 1
+            event = {'id': f'{self.epoch}:{self.counter}', 'seq': self.counter, 'type': event_type, 'data': data}
+            self.events.append(event)
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+        return event['id']
+
+    def last_event_id(self):
+        return f'{self.epoch}:{self.counter}'
+
+    def subscribe(self, last_event_id=None):
+        # returns (subscription, replay): replay is the list of events after last_event_id,
+        # or None when they can't be replayed anymore (the client has to reload its state).
+        # Registering and reading the backlog happen under the same lock, so no event falls in between.
+        subscription = Subscription(self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscription)
+            replay = self.replay(last_event_id)
+        return subscription, replay
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def replay(self, last_event_id):
+        if not last_event_id:
+            return []
+        epoch, _, seq = last_event_id.partition(':')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.counter:
+            return None
+        seq = int(seq)
+        oldest = self.events[0]['seq'] if self.events else self.counter + 1
+        if seq < oldest - 1:
+            return None # some events were dropped from the backlog
+        return [event for event in self.events if event['seq'] > seq]
+
+    def stats(self):
+        with self.lock:
+            return {'subscribers': len(self.subscribers), 'last_event_id': self.last_event_id(), 'backlog': len(self.events)}
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'ORDER_FEED_BROKER', 'restaurant.waiter.feed.InProcessBroker'))()
+    return _broker
+
+
+def format_event(event):
+    # one SSE message
+    data = json.dumps(event['data'], cls=DjangoJSONEncoder)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def stream(broker, last_event_id=None):
+    # async iterator of SSE messages for one client, unsubscribes when the client goes away
+    subscription, replay = broker.subscribe(last_event_id)
+    heartbeat = getattr(settings, 'ORDER_FEED_HEARTBEAT', 15)
+    try:
+        yield 'retry: 3000\n\n'
+        if replay is None:
+            yield format_event({'id': broker.last_event_id(), 'type': 'reset', 'data': {}})
+            replay = []
+        for event in replay:
+            yield format_event(event)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n' # keeps proxies from closing an idle connection
+                continue
+            if event is None:
+                break
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# --- publishing ---
+
+def order_payload(order):
+    return {
+        'id': order.id,
+        'user_id': order.user_id,
+        'total_amount': order.total_amount,
+        'status': order.status,
+        'time_to_eat': order.time_to_eat,
+        'created_at': order.created_at,
+    }
+
+
+@receiver(post_save, sender=Order)
+def _order_saved(sender, instance, created, **kwargs):
+    if created:
+        payload = order_payload(instance)
+        transaction.on_commit(lambda: get_broker().publish('order_created', payload))
+
+
+@receiver(order_status_changed)
+def _order_status_changed(sender, order_ids, status, **kwargs):
+    get_broker().publish('order_status', {'order_ids': list(order_ids), 'status': status}) # sent after the commit already
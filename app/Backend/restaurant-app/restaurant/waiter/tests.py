@@ -0,0 +1,72 @@
+import asyncio
+from django.test import SimpleTestCase
+from .feed import InProcessBroker, stream
+
+
+class BrokerReplayTests(SimpleTestCase):
+    async def test_resumes_after_the_last_event_id(self):
+        broker = InProcessBroker(backlog=10)
+        first = broker.publish('order_status', {'order_ids': [1], 'status': 'completed'})
+        broker.publish('order_status', {'order_ids': [2], 'status': 'completed'})
+        broker.publish('order_status', {'order_ids': [3], 'status': 'cancelled'})
+
+        subscription, replay = broker.subscribe(first)
+        self.assertEqual([event['data']['order_ids'] for event in replay], [[2], [3]])
+        self.assertEqual(broker.subscribe(broker.last_event_id())[1], []) # up to date
+        self.assertEqual(broker.subscribe(None)[1], []) # a new client only gets what comes next
+
+        live = broker.publish('order_status', {'order_ids': [4], 'status': 'completed'})
+        self.assertEqual((await subscription.get())['id'], live)
+
+    async def test_ids_that_cant_be_replayed_reset(self):
+        broker = InProcessBroker(backlog=2)
+        first = broker.publish('order_created', {'id': 1})
+        for order_id in (2, 3, 4):
+            broker.publish('order_created', {'id': order_id})
+
+        self.assertIsNone(broker.subscribe(first)[1]) # dropped from the backlog
+        self.assertIsNone(broker.subscribe(f'{int(broker.epoch) - 1}:3')[1]) # from before a restart
+        self.assertIsNone(broker.subscribe(f'{broker.epoch}:99')[1]) # from the future
+        self.assertIsNone(broker.subscribe('garbage')[1])
+        self.assertEqual([event['data']['id'] for event in broker.subscribe(f'{broker.epoch}:2')[1]], [3, 4]) # still in the backlog
+
+
+class FeedStreamTests(SimpleTestCase):
+    async def read(self, messages, count):
+        return [await asyncio.wait_for(anext(messages), 1) for _ in range(count)]
+
+    async def test_stream_replays_then_follows(self):
+        broker = InProcessBroker()
+        first = broker.publish('order_created', {'id': 1})
+        second = broker.publish('order_created', {'id': 2})
+
+        messages = stream(broker, first)
+        retry, replayed = await self.read(messages, 2)
+        self.assertEqual(retry, 'retry: 3000\n\n')
+        self.assertEqual(replayed, f'id: {second}\nevent: order_created\ndata: {{"id": 2}}\n\n')
+
+        third = broker.publish('order_status', {'order_ids': [2], 'status': 'completed'})
+        self.assertTrue((await self.read(messages, 1))[0].startswith(f'id: {third}\nevent: order_status\n'))
+        await messages.aclose()
+        self.assertEqual(broker.stats()['subscribers'], 0)
+
+    async def test_stream_from_another_epoch_resets(self):
+        broker = InProcessBroker()
+        broker.publish('order_created', {'id': 1})
+
+        messages = stream(broker, '1:1')
+        _, reset = await self.read(messages, 2)
+        self.assertEqual(reset, f'id: {broker.last_event_id()}\nevent: reset\ndata: {{}}\n\n')
+        await messages.aclose()
+
+    async def test_clients_that_fall_behind_are_disconnected(self):
+        broker = InProcessBroker(queue_size=1)
+        messages = stream(broker)
+        await self.read(messages, 1) # subscribed
+        for order_id in (1, 2, 3):
+            broker.publish('order_created', {'id': order_id})
+        await asyncio.sleep(0) # the events are handed over on the loop
+
+        with self.assertRaises(StopAsyncIteration):
+            await self.read(messages, 2)
+        self.assertEqual(broker.stats()['subscribers'], 0)
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('orders/', views.view_orders, name='view_orders'),
+    path('orders/feed/', views.order_feed, name='order_feed'),
+]
@@ -1,8 +1,68 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from restaurant.middlewares.is_waiter import waiter_only
+from restaurant.middlewares.is_authenticated import jwt_required, authenticate
+from restaurant.middlewares.has_role import role_required, get_role_name
+from restaurant.order.models import Order, OrderItem
+from .feed import get_broker, stream
 
+'''
+    Waiter routes: the open orders and the live feed of what happens to them.
+    A tablet loads GET /waiter/orders/ once, then listens on GET /waiter/orders/feed/?last_event_id=<the one it got>.
+'''
+
+STAFF_ROLES = ('admin', 'waiter')
+MAX_ORDERS = 500
+
+
+# ?status=pending (default) / completed / cancelled, oldest time_to_eat first.
+# last_event_id is the feed position this list is up to date with.
 @api_view(['GET'])
-@waiter_only
+@jwt_required
+@role_required(*STAFF_ROLES)
 def view_orders(request):
-    return Response({'message': 'Orders view'})
\ No newline at end of file
+    status = request.GET.get('status', 'pending')
+    if status not in ('pending', 'completed', 'cancelled'):
+        return Response({'error': 'Invalid status'}, status=400)
+
+    last_event_id = get_broker().last_event_id() # read first, anything that happens during the query is replayed by the feed
+    orders = list(
+        Order.objects.filter(status=status)
+        .order_by('time_to_eat', 'id')
+        .values('id', 'user_id', 'total_amount', 'status', 'time_to_eat', 'created_at')[:MAX_ORDERS]
+    )
+    items = {}
+    for order_id, variant_id, name, quantity in OrderItem.objects.filter(order_id__in=[order['id'] for order in orders]).values_list(
+        'order_id', 'product_variant_id', 'product_variant__name', 'quantity'
+    ):
+        items.setdefault(order_id, []).append({'variant_id': variant_id, 'name': name, 'quantity': quantity})
+    for order in orders:
+        order['items'] = items.get(order['id'], [])
+
+    return Response({'orders': orders, 'last_event_id': last_event_id}, status=200)
+
+
+def _authorize_feed(request):
+    # EventSource can't send headers, the token may come as ?token= instead
+    error = authenticate(request, token=request.GET.get('token'))
+    if error is None and get_role_name(request) not in STAFF_ROLES:
+        error = JsonResponse({'error': 'Unauthorized access'}, status=403)
+    return error
+
+
+# Server-Sent Events, order_created / order_status / reset, see feed.py.
+# Resumes after the Last-Event-ID header (sent by EventSource on reconnect) or ?last_event_id=.
+# Served by asgi.py: each client is a coroutine waiting on the broker, not a worker thread.
+@require_GET
+async def order_feed(request):
+    error = await sync_to_async(_authorize_feed)(request)
+    if error is not None:
+        return error
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    response = StreamingHttpResponse(stream(get_broker(), last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # nginx: don't buffer the stream
+    return response